@@ -0,0 +1,436 @@
+#!/usr/bin/env python
+""" benchmark.py
+
+Python command line interface for timing conversion, distance, clustering,
+U-fiber and statistics functions of neurobeer on synthetic tractography
+across bundle sizes. Results are recorded as JSON, which can be compared with
+results of a previous commit.
+
+"""
+import os, sys, io, json, time, platform, subprocess, tempfile, shutil
+import os.path as op
+import numpy as np
+from collections import OrderedDict
+from contextlib import redirect_stdout
+
+sys.path.insert(0, op.dirname(op.dirname(op.realpath(__file__))))
+sys.path.insert(0, op.dirname(op.realpath(__file__)))
+
+import synthetic
+from neurobeer.tractography import (cluster, distance, fibers, misc, prior,
+                                    stats, ufiber)
+
+def get_parser():
+    """
+    Argument Parser
+    """
+    from argparse import ArgumentParser, RawTextHelpFormatter
+
+    parser = ArgumentParser(description=('Benchmarks of neurobeer on '
+                                         'synthetic tractography'),
+                            formatter_class=RawTextHelpFormatter)
+
+    parser.add_argument('-n', action='store', nargs='+', type=int,
+                        metavar='no_of_fibers', default=[250, 500, 1000],
+                        help='bundle sizes (number of fibers) to benchmark')
+    parser.add_argument('-p', action='store', type=int, metavar='no_samples',
+                        default=20, help='number of samples along each fiber')
+    parser.add_argument('-k', action='store', type=int, metavar='k_clusters',
+                        default=10, help='number of clusters of bundle')
+    parser.add_argument('-u', action='store', type=float, metavar='fraction',
+                        default=0.2, help='fraction of U-shaped clusters')
+    parser.add_argument('-a', action='store', nargs='+', metavar='scalar',
+                        default=['FA', 'MD'], help='names of scalar maps')
+    parser.add_argument('-b', action='store', nargs='+', metavar='benchmark',
+                        default=None, choices=list(BENCHMARKS.keys()),
+                        help='benchmarks to run; defaults all')
+    parser.add_argument('-r', action='store', type=int, metavar='repeat',
+                        default=3, help='number of timed runs of benchmark')
+    parser.add_argument('-j', action='store', type=int, metavar='n_jobs',
+                        default=-1, help='number of cores to use')
+    parser.add_argument('-s', action='store', type=int, metavar='seed',
+                        default=0, help='seed of synthetic bundles')
+    parser.add_argument('-o', action='store', metavar='out_file',
+                        default=None, help=('JSON file to record results to; '
+                                            'defaults benchmark-<commit>.json'))
+    parser.add_argument('--compare', action='store', metavar='baseline',
+                        default=None, help=('JSON file of results of a '
+                                            'previous commit to compare with'))
+    parser.add_argument('--threshold', action='store', type=float,
+                        metavar='ratio', default=1.1,
+                        help=('ratio of median times above which a benchmark '
+                              'is reported as a regression'))
+
+    return parser
+
+def _benchConvertFromVTK(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Conversion of polydata to fiber tree.
+    """
+    polyData = synthetic.toPolyData(bundle['fiberArray'], bundle['scalars'])
+
+    def run():
+        fibers.FiberTree().convertFromVTK(polyData, opts.p)
+
+    return run
+
+def _benchConvertToVTK(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Conversion of fiber tree to VTK polydata.
+    """
+    fiberData = bundle['fiberData']
+
+    def run():
+        fiberData.convertToVTK()
+
+    return run
+
+def _benchFiberDistance(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Pairwise geometric distance between all fibers.
+    """
+    fiberData = bundle['fiberData']
+    fiberArray = fiberData.getFibers(range(fiberData.no_of_fibers))
+
+    def run():
+        distance.fiberDistance(fiberArray, n_jobs=opts.j)
+
+    return run
+
+def _benchScalarDistance(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Pairwise scalar distance between all fibers.
+    """
+    fiberData = bundle['fiberData']
+    scalarArray = fiberData.getScalars(range(fiberData.no_of_fibers),
+                                       opts.a[0])
+
+    def run():
+        distance.scalarDistance(scalarArray, n_jobs=opts.j)
+
+    return run
+
+def _benchSpectralClustering(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Clustering without a prior, including output polydata. Times of the
+    eigendecomposition and other steps are recorded as stages.
+    """
+    fiberData = bundle['fiberData']
+    weights = [1. / (len(opts.a) + 1)] * (len(opts.a) + 1)
+    weights[0] = 1. - sum(weights[1:])
+
+    def run():
+        cluster.spectralClustering(fiberData, scalarTypeList=opts.a,
+                                   scalarWeightList=weights,
+                                   k_clusters=opts.k,
+                                   sigma=[10] + [0.1] * len(opts.a),
+                                   n_jobs=opts.j, dirpath=tmpdir)
+
+    return run
+
+def _benchSpectralPriorCluster(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Clustering with a prior of the same size, including loading of prior.
+    """
+    priorVTKPath = op.join(tmpdir, 'prior_%d.vtk' % bundle['no_of_fibers'])
+    priorArray, priorLabels, priorScalars = synthetic.makeBundle(
+        bundle['no_of_fibers'], opts.p, opts.k, opts.u, opts.a, opts.s + 1)
+    synthetic.writePrior(priorVTKPath, priorArray, priorLabels, priorScalars)
+
+    fiberData = bundle['fiberData']
+    weights = [1. / (len(opts.a) + 1)] * (len(opts.a) + 1)
+    weights[0] = 1. - sum(weights[1:])
+
+    def run():
+        prior.clearCache()
+        cluster.spectralPriorCluster(fiberData, priorVTKPath,
+                                     scalarTypeList=opts.a,
+                                     scalarWeightList=weights,
+                                     sigma=[10] + [0.1] * len(opts.a),
+                                     n_jobs=opts.j, dirpath=tmpdir)
+
+    return run
+
+def _benchPriorIndex(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Matching of fibers to most similar fibers of a prior of the same bundles
+    (same templates of clusters), via the prior index. The fraction of fibers
+    requiring a fallback to a radius search is reported.
+    """
+    priorArray, _, _ = synthetic.makeBundle(bundle['no_of_fibers'], opts.p,
+                                            opts.k, opts.u, [], opts.s,
+                                            fiberSeed=opts.s + 1)
+    priorIndex = distance.FiberIndex(np.transpose(priorArray, (2, 0, 1)))
+
+    fiberData = bundle['fiberData']
+    fiberArray = fiberData.getFibers(range(fiberData.no_of_fibers))
+
+    def run():
+        priorIndex.no_of_queries, priorIndex.no_of_fallbacks = 0, 0
+        priorIndex.query(fiberArray, n_jobs=opts.j)
+
+        return OrderedDict([
+            ('no_of_queries', priorIndex.no_of_queries),
+            ('no_of_fallbacks', priorIndex.no_of_fallbacks),
+            ('fallback_rate', float(priorIndex.no_of_fallbacks) /
+                              max(priorIndex.no_of_queries, 1))])
+
+    return run
+
+def _benchPriorBruteForce(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Matching of fibers to most similar fibers of the prior of priorIndex by
+    exhaustive comparison in blocks, for reference.
+    """
+    priorArray, _, _ = synthetic.makeBundle(bundle['no_of_fibers'], opts.p,
+                                            opts.k, opts.u, [], opts.s,
+                                            fiberSeed=opts.s + 1)
+    priorArray = np.transpose(priorArray, (2, 0, 1))
+
+    fiberData = bundle['fiberData']
+    fiberArray = fiberData.getFibers(range(fiberData.no_of_fibers))
+
+    def run():
+        distance.fiberDistance(fiberArray, priorArray, pflag=True,
+                               n_jobs=opts.j)
+
+    return run
+
+def _benchFindUFiber(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Identification of U-shaped fibers.
+    """
+    fiberData = bundle['fiberData']
+
+    def run():
+        ufiber.findUFiber(fiberData)
+
+    return run
+
+def _benchWriteStats(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Along-tract statistics of all clusters, written for each scalar.
+    """
+    fiberData = bundle['fiberData']
+    clusterLabels = bundle['clusterLabels']
+    scalarArrays = [fiberData.getScalars(range(fiberData.no_of_fibers),
+                                         scalarType)
+                    for scalarType in opts.a]
+
+    def run():
+        for scalarType, scalarArray in zip(opts.a, scalarArrays):
+            clusterStats = stats.calcClusterStats(clusterLabels, scalarArray)
+            stats.writeStats(clusterStats, scalarType, dirpath=tmpdir)
+
+    return run
+
+def _benchWriteGeoStats(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Fiber length statistics of all clusters.
+    """
+    fiberData = bundle['fiberData']
+    clusterLabels = bundle['clusterLabels']
+
+    def run():
+        geoStats = stats.calcClusterGeoStats(
+            clusterLabels, fibers.calcFiberLength(fiberData))
+        stats.writeGeoStats(geoStats, dirpath=tmpdir)
+
+    return run
+
+def _benchWriteUFiberStats(bundle, opts, tmpdir):
+    """ *INTERNAL FUNCTION*
+    Length and end point separation statistics of all U-fiber clusters.
+    """
+    fiberArray = bundle['fiberArray']
+    clusterLabels = bundle['clusterLabels']
+    _, LArray, DArray = ufiber.classifyUFiber(fiberArray)
+
+    def run():
+        uStats = ufiber.calcUFiberStats(clusterLabels, LArray, DArray)
+        ufiber.writeUFiberStats(uStats, dirpath=tmpdir)
+
+    return run
+
+BENCHMARKS = OrderedDict([
+    ('convertFromVTK', _benchConvertFromVTK),
+    ('convertToVTK', _benchConvertToVTK),
+    ('fiberDistance', _benchFiberDistance),
+    ('scalarDistance', _benchScalarDistance),
+    ('spectralClustering', _benchSpectralClustering),
+    ('spectralPriorCluster', _benchSpectralPriorCluster),
+    ('priorIndex', _benchPriorIndex),
+    ('priorBruteForce', _benchPriorBruteForce),
+    ('findUFiber', _benchFindUFiber),
+    ('writeStats', _benchWriteStats),
+    ('writeGeoStats', _benchWriteGeoStats),
+    ('writeUFiberStats', _benchWriteUFiberStats)])
+
+def runBenchmark(benchFn, bundle, opts, tmpdir):
+    """
+    Times repeated runs of a benchmark, recording stages of each run with
+    the profiler. Any information returned by the benchmark (eg. fallback
+    rates) is recorded from the last run.
+
+    INPUT:
+        benchFn - function returning the function to be timed
+        bundle - dictionary of synthetic bundle
+        opts - parsed arguments
+        tmpdir - directory to write output files to
+
+    OUTPUT:
+        result - dictionary of times, stages and information of benchmark
+    """
+    with redirect_stdout(io.StringIO()):
+        run = benchFn(bundle, opts, tmpdir)
+
+    times, stageTimes = [], OrderedDict()
+    for _ in range(max(opts.r, 1)):
+        misc.startProfile()
+        with redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            info = run()
+            times.append(time.perf_counter() - t0)
+        report = misc.stopProfile()
+
+        for name, record in report['stages'].items():
+            stageTimes.setdefault(name, []).append(record['wall'])
+
+    result = OrderedDict([
+        ('times', times),
+        ('min', float(np.min(times))),
+        ('median', float(np.median(times))),
+        ('peak_rss_mb', report['peak_rss_mb']),
+        ('stages', OrderedDict((name, float(np.median(stageTime)))
+                               for name, stageTime in stageTimes.items()))])
+    if info is not None:
+        result['info'] = info
+
+    return result
+
+def compareResults(baseline, results, threshold=1.1):
+    """
+    Compares median times of benchmarks with those of a baseline.
+
+    INPUT:
+        baseline - dictionary of results of a previous commit
+        results - dictionary of current results
+        threshold - ratio of median times above which a benchmark is
+                    considered a regression
+
+    OUTPUT:
+        comparison - list of (benchmark, no_of_fibers, baseline median,
+                     current median, ratio, regression flag)
+    """
+    baselineTimes = dict(((result['benchmark'], result['no_of_fibers']),
+                          result['median'])
+                         for result in baseline['results'])
+
+    comparison = []
+    for result in results['results']:
+        key = (result['benchmark'], result['no_of_fibers'])
+        if key not in baselineTimes:
+            continue
+        ratio = result['median'] / baselineTimes[key]
+        comparison.append(key + (baselineTimes[key], result['median'], ratio,
+                                 ratio > threshold))
+
+    return comparison
+
+def _environment():
+    """ *INTERNAL FUNCTION*
+    Returns commit and versions of environment benchmarks are run in.
+    """
+    import scipy, vtk, joblib
+    from neurobeer._version import __version__
+
+    repodir = op.dirname(op.dirname(op.realpath(__file__)))
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         cwd=repodir,
+                                         stderr=subprocess.DEVNULL)
+        commit = commit.decode().strip()
+        dirty = subprocess.call(['git', 'diff', '--quiet', 'HEAD', '--',
+                                 'neurobeer'], cwd=repodir,
+                                stderr=subprocess.DEVNULL) != 0
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+
+    return OrderedDict([
+        ('commit', commit),
+        ('dirty', dirty),
+        ('timestamp', time.time()),
+        ('neurobeer', __version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('cpu_count', os.cpu_count()),
+        ('versions', OrderedDict([('numpy', np.__version__),
+                                  ('scipy', scipy.__version__),
+                                  ('vtk', vtk.vtkVersion.GetVTKVersion()),
+                                  ('joblib', joblib.__version__)]))])
+
+def main():
+    """
+    Entry point of code
+    """
+    opts = get_parser().parse_args()
+    benchNames = list(BENCHMARKS.keys()) if opts.b is None else opts.b
+
+    results = _environment()
+    results['params'] = OrderedDict([
+        ('pts_per_fiber', opts.p), ('k_clusters', opts.k),
+        ('u_fraction', opts.u), ('scalars', opts.a), ('seed', opts.s),
+        ('repeat', opts.r), ('n_jobs', opts.j)])
+    results['results'] = []
+
+    tmpdir = tempfile.mkdtemp(prefix='neurobeer_bench_')
+    try:
+        for no_of_fibers in opts.n:
+            fiberArray, clusterLabels, scalarDict = synthetic.makeBundle(
+                no_of_fibers, opts.p, opts.k, opts.u, opts.a, opts.s)
+            bundle = {'no_of_fibers': no_of_fibers,
+                      'fiberArray': fiberArray,
+                      'clusterLabels': clusterLabels,
+                      'scalars': scalarDict,
+                      'fiberData': synthetic.toFiberTree(fiberArray,
+                                                         scalarDict)}
+
+            for benchName in benchNames:
+                result = runBenchmark(BENCHMARKS[benchName], bundle, opts,
+                                      tmpdir)
+                print("%-22s %7d fibers: %9.4f s (min %.4f s)"
+                      % (benchName, no_of_fibers, result['median'],
+                         result['min']))
+                for name, value in result.get('info', {}).items():
+                    print("%-22s %s: %s" % ('', name, value))
+
+                result['benchmark'] = benchName
+                result['no_of_fibers'] = no_of_fibers
+                result.move_to_end('no_of_fibers', last=False)
+                result.move_to_end('benchmark', last=False)
+                results['results'].append(result)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    out_file = opts.o
+    if out_file is None:
+        out_file = 'benchmark-%s.json' % (results['commit'] or 'unknown')[:8]
+    with open(out_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Saved results to %s" % out_file)
+
+    if opts.compare is not None:
+        with open(opts.compare, 'r') as f:
+            baseline = json.load(f)
+
+        print("\nComparison with %s (commit %s)"
+              % (opts.compare, baseline.get('commit')))
+        for benchName, no_of_fibers, t0, t1, ratio, regression in \
+            compareResults(baseline, results, opts.threshold):
+            print("%-22s %7d fibers: %9.4f s -> %9.4f s (x%.2f)%s"
+                  % (benchName, no_of_fibers, t0, t1, ratio,
+                     '  REGRESSION' if regression else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+""" synthetic.py
+
+Module containing functions used to generate deterministic synthetic
+tractography for benchmarking.
+
+"""
+
+import numpy as np
+from collections import OrderedDict
+
+from neurobeer.tractography import cluster, fibers, tractio
+
+def makeBundle(no_of_fibers=1000, pts_per_fiber=20, k_clusters=10,
+               u_fraction=0.2, scalarTypes=['FA', 'MD'], seed=0,
+               fiberSeed=None):
+    """
+    Generates a synthetic bundle of clustered fibers. Each cluster follows a
+    template curve, with fibers of a cluster perturbed from the template and
+    half traversed in reverse. A fraction of clusters are short-ranged,
+    U-shaped fibers within a single hemisphere; the remaining clusters are
+    long-ranged, gently curved fibers. Scalars are sampled at each point from
+    smooth maps of position. The same arguments always return the same
+    bundle. Bundles of the same seed and different fiberSeed share templates
+    of clusters (eg. a subject and a prior of the same bundles).
+
+    INPUT:
+        no_of_fibers - number of fibers to generate; defaults 1000
+        pts_per_fiber - number of samples along each fiber; defaults 20
+        k_clusters - number of clusters; defaults 10
+        u_fraction - fraction of clusters which are U-shaped; defaults 0.2
+        scalarTypes - list of names of scalar maps; defaults ['FA', 'MD']
+        seed - seed of random number generator; defaults 0
+        fiberSeed - seed of perturbations of fibers from templates; defaults
+                    None (continue from seed)
+
+    OUTPUT:
+        fiberArray - array of fibers (N x pts_per_fiber x 3)
+        clusterLabels - array of cluster labels of fibers
+        scalarDict - dictionary of arrays (N x pts_per_fiber) of scalars
+                     indexed by scalar type
+    """
+    rng = np.random.RandomState(seed)
+
+    k_clusters = max(min(k_clusters, no_of_fibers), 1)
+    no_of_u = int(round(k_clusters * u_fraction))
+
+    # Fibers split evenly between clusters
+    clusterLabels = np.arange(no_of_fibers) % k_clusters
+    clusterLabels = np.sort(clusterLabels)
+
+    templates = np.array([_uTemplate(rng, pts_per_fiber) if label < no_of_u
+                          else _longTemplate(rng, pts_per_fiber)
+                          for label in range(k_clusters)])
+
+    if fiberSeed is not None:
+        rng = np.random.RandomState(fiberSeed)
+
+    # Perturb each fiber of cluster by an offset and jitter along fiber
+    offsets = rng.normal(scale=1.5, size=(no_of_fibers, 1, 3))
+    jitter = rng.normal(scale=0.3, size=(no_of_fibers, pts_per_fiber, 3))
+    fiberArray = templates[clusterLabels] + offsets + jitter
+
+    # Equivalent representations of fibers
+    flip = rng.rand(no_of_fibers) < 0.5
+    fiberArray[flip] = fiberArray[flip, ::-1]
+
+    scalarDict = OrderedDict()
+    for i, scalarType in enumerate(scalarTypes):
+        scalarDict[scalarType] = _scalarMap(fiberArray, i)
+
+    return fiberArray.astype(np.float32), clusterLabels, scalarDict
+
+def toPolyData(fiberArray, scalarDict={}):
+    """
+    Converts a synthetic bundle to polydata, as read from file.
+
+    INPUT:
+        fiberArray - array of fibers (N x pts_per_fiber x 3)
+        scalarDict - dictionary of arrays of scalars indexed by scalar type
+
+    OUTPUT:
+        polyData - tractography polydata of class tractio.PolyData
+    """
+    return tractio.fibersToPolyData(fiberArray, scalarDict)
+
+def toFiberTree(fiberArray, scalarDict={}):
+    """
+    Converts a synthetic bundle to a fiber tree, with scalars added.
+
+    INPUT:
+        fiberArray - array of fibers (N x pts_per_fiber x 3)
+        scalarDict - dictionary of arrays of scalars indexed by scalar type
+
+    OUTPUT:
+        fiberData - fiber tree of class fibers.FiberTree
+    """
+    pts_per_fiber = fiberArray.shape[1]
+    polyData = toPolyData(fiberArray, scalarDict)
+
+    fiberData = fibers.FiberTree()
+    fiberData.convertFromVTK(polyData, pts_per_fiber)
+    for scalarType in scalarDict.keys():
+        fiberData.addScalar(polyData, polyData.pointData[scalarType],
+                            scalarType, pts_per_fiber)
+
+    return fiberData
+
+def writePrior(priorVTKPath, fiberArray, clusterLabels, scalarDict={}):
+    """
+    Writes a synthetic bundle as a clustered prior, as output by the
+    clustering tools.
+
+    INPUT:
+        priorVTKPath - path of .vtk file to write prior to
+        fiberArray - array of fibers (N x pts_per_fiber x 3)
+        clusterLabels - array of cluster labels of fibers
+        scalarDict - dictionary of arrays of scalars indexed by scalar type
+
+    OUTPUT:
+        none
+    """
+    k_clusters = int(np.max(clusterLabels)) + 1
+
+    rng = np.random.RandomState(k_clusters)
+    centroids = rng.normal(size=(k_clusters, 4))
+    colour = cluster._cluster_to_rgb(centroids)
+
+    polyData = cluster._format_outputPolyData(toPolyData(fiberArray,
+                                                         scalarDict),
+                                              clusterLabels, colour,
+                                              centroids)
+    tractio.writeVTK(polyData, priorVTKPath)
+
+def _resample(curve, pts_per_fiber):
+    """ *INTERNAL FUNCTION*
+    Resamples a densely sampled curve to points equally spaced along its
+    length.
+    """
+    arcLength = np.r_[0, np.cumsum(np.linalg.norm(np.diff(curve, axis=0),
+                                                  axis=1))]
+    samples = np.linspace(0, arcLength[-1], pts_per_fiber)
+
+    return np.stack([np.interp(samples, arcLength, curve[:, i])
+                     for i in range(3)], axis=1)
+
+def _orthonormal(rng):
+    """ *INTERNAL FUNCTION*
+    Returns a random pair of orthonormal vectors.
+    """
+    u, _ = np.linalg.qr(rng.normal(size=(3, 2)))
+
+    return u[:, 0], u[:, 1]
+
+def _longTemplate(rng, pts_per_fiber):
+    """ *INTERNAL FUNCTION*
+    Generates a long-ranged (100 mm), gently curved template fiber.
+    """
+    d, b = _orthonormal(rng)
+    t = np.linspace(0, 100, 200)[:, None]
+
+    start = rng.uniform(-60, 60, size=3) - 50 * d
+    curve = start + t * d + 15 * rng.uniform(0.2, 1) * \
+            np.sin(np.pi * t / 100) * b
+
+    return _resample(curve, pts_per_fiber)
+
+def _uTemplate(rng, pts_per_fiber):
+    """ *INTERNAL FUNCTION*
+    Generates a short-ranged, U-shaped template fiber within a single
+    hemisphere, with two straight legs joined by a semicircle.
+    """
+    d, b = _orthonormal(rng)
+    legLength = rng.uniform(12, 18)
+    radius = rng.uniform(2, 4)
+
+    t = np.linspace(0, 1, 60)[:, None]
+    theta = np.linspace(0, np.pi, 80)[:, None]
+
+    leg1 = -radius * b + (1 - t) * legLength * d
+    arc = -radius * np.cos(theta) * b - radius * np.sin(theta) * d
+    leg2 = radius * b + t * legLength * d
+    curve = np.concatenate((leg1, arc, leg2))
+
+    centre = rng.uniform(-40, 40, size=3)
+    centre[0] = rng.choice([-1, 1]) * rng.uniform(40, 60)
+
+    return _resample(curve + centre, pts_per_fiber)
+
+def _scalarMap(fiberArray, i):
+    """ *INTERNAL FUNCTION*
+    Samples a smooth scalar map, differing with index i, at each point of
+    fibers.
+    """
+    x, y, z = fiberArray[..., 0], fiberArray[..., 1], fiberArray[..., 2]
+
+    scalars = 0.5 + 0.3 * np.sin(x / (10. + 5 * i) + i) * \
+              np.cos(y / (15. + 5 * i)) + 0.1 * np.sin(z / (20. + 5 * i))
+
+    return scalars.astype(np.float32)
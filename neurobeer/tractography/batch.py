@@ -0,0 +1,280 @@
+""" batch.py
+
+Module containing functions used to run clustering tools over multiple
+subjects within long-lived worker processes.
+
+"""
+
+import os, sys, json, glob, runpy, time, traceback
+import os.path as op
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from joblib import Parallel, delayed, cpu_count
+
+from . import misc, prior, tractio
+
+_statusName = 'clusterBatch_status.json'
+_manifestName = 'clusterBatch_manifest.json'
+
+def findSubjects(indir, bundle=None):
+    """
+    Identifies subjects within an input directory. BIDS-style subject
+    directories (sub-*) are used if present; otherwise, all directories
+    (containing the bundle, if provided) are considered subjects.
+
+    INPUT:
+        indir - directory with input data of subjects
+        bundle - tractography bundle of each subject; defaults None
+
+    OUTPUT:
+        subjects - sorted list of subject ids
+    """
+    subjects = [op.basename(subjdir)
+                for subjdir in glob.glob(op.join(indir, 'sub-*'))
+                if op.isdir(subjdir)]
+
+    if not subjects:
+        subjects = [subjid for subjid in os.listdir(indir)
+                    if op.isdir(op.join(indir, subjid)) and
+                    (bundle is None or
+                     op.exists(op.join(indir, subjid, bundle)))]
+
+    return sorted(subjects)
+
+def runBatch(scriptPath, subjects, indir, outdir, bundle, toolArgs=[],
+             n_workers=1, prefetch=1, retry=False, priorCache=None,
+             verbose=0):
+    """
+    Runs a clustering tool over multiple subjects, scheduled over a pool of
+    worker processes. Each worker runs its subjects in turn within the same
+    interpreter, reading tractography and scalars of upcoming subjects in a
+    background thread. Priors are loaded once and shared with workers via
+    the prior store. The status of each subject is written as it finishes
+    and collected into a manifest, such that failed subjects can be retried
+    alone.
+
+    INPUT:
+        scriptPath - path to clustering tool (eg. clusterPrior)
+        subjects - list of subject ids
+        indir - directory with input data
+        outdir - directory where output files should be stored
+        bundle - tractography bundle of each subject
+        toolArgs - list of additional arguments passed to tool
+        n_workers - number of worker processes; defaults 1
+        prefetch - number of subjects read ahead by each worker; defaults 1
+        retry - flag to only run subjects not previously completed;
+                defaults False
+        priorCache - directory of shared prior store; defaults
+                     <outdir>/.prior_cache
+        verbose - verbosity of function
+
+    OUTPUT:
+        manifest - dictionary of status of each subject
+    """
+    indir, outdir = op.realpath(indir), op.realpath(outdir)
+    if not op.exists(outdir):
+        os.makedirs(outdir)
+
+    if retry:
+        subjects = [subjid for subjid in subjects
+                    if _readStatus(outdir, subjid).get('status') != 'done']
+        misc.vprint("Retrying %d subjects" % len(subjects), verbose)
+
+    if n_workers < 0:
+        n_workers = max(cpu_count() + 1 + n_workers, 1)
+    n_workers = max(min(n_workers, len(subjects)), 1)
+
+    # Share cores of node between workers
+    toolArgs = list(toolArgs)
+    if '-j' not in toolArgs:
+        toolArgs += ['-j', str(max(cpu_count() // n_workers, 1))]
+
+    # Load prior once, stored for workers to attach to
+    toolGlobals = runpy.run_path(scriptPath, run_name='neurobeer_batch')
+    if subjects:
+        opts = toolGlobals['get_parser']().parse_args(
+            _toolArgv(indir, outdir, subjects[0], bundle, toolArgs))
+        if getattr(opts, 'prior', None) is not None:
+            if priorCache is None:
+                priorCache = op.join(outdir, '.prior_cache')
+            os.environ['NEUROBEER_PRIOR_CACHE'] = priorCache
+            prior.load(opts.prior, opts.t, verbose, priorCache)
+
+    misc.vprint("Running %d subjects over %d workers"
+                % (len(subjects), n_workers), verbose)
+
+    # Interleave subjects between workers
+    Parallel(n_jobs=n_workers)(
+        delayed(_runWorker)(scriptPath, subjects[widx::n_workers], indir,
+                            outdir, bundle, toolArgs, prefetch, verbose)
+        for widx in range(n_workers))
+
+    return writeManifest(outdir, subjects)
+
+def writeManifest(outdir, subjects=[]):
+    """
+    Collects the status of each subject into a manifest, updating subjects
+    of any previous manifest.
+
+    INPUT:
+        outdir - directory where output files are stored
+        subjects - list of subject ids to update
+
+    OUTPUT:
+        manifest - dictionary of status of each subject
+    """
+    manifest = loadManifest(outdir)
+    for subjid in subjects:
+        manifest[subjid] = _readStatus(outdir, subjid)
+
+    with open(op.join(outdir, _manifestName), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+def loadManifest(outdir):
+    """
+    Loads the manifest of status of each subject.
+
+    INPUT:
+        outdir - directory where output files are stored
+
+    OUTPUT:
+        manifest - dictionary of status of each subject; empty if not found
+    """
+    manifestPath = op.join(outdir, _manifestName)
+    if not op.exists(manifestPath):
+        return {}
+
+    with open(manifestPath, 'r') as f:
+        return json.load(f)
+
+def _runWorker(scriptPath, subjects, indir, outdir, bundle, toolArgs,
+               prefetch=1, verbose=0):
+    """ *INTERNAL FUNCTION*
+    Runs a clustering tool for each subject in turn, reading data of
+    upcoming subjects in a background thread.
+
+    INPUT:
+        scriptPath - path to clustering tool
+        subjects - list of subject ids
+        indir - directory with input data
+        outdir - directory where output files should be stored
+        bundle - tractography bundle of each subject
+        toolArgs - list of additional arguments passed to tool
+        prefetch - number of subjects read ahead
+        verbose - verbosity of function
+
+    OUTPUT:
+        statusList - list of status of each subject
+    """
+    toolGlobals = runpy.run_path(scriptPath, run_name='neurobeer_batch')
+    parser = toolGlobals['get_parser']()
+
+    argvList = [_toolArgv(indir, outdir, subjid, bundle, toolArgs)
+                for subjid in subjects]
+    fileList = [_subjectFiles(parser, argv) for argv in argvList]
+
+    statusList = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque()
+        for sidx in range(min(prefetch, len(subjects))):
+            pending.append(executor.submit(tractio.prefetch, fileList[sidx]))
+
+        for sidx, subjid in enumerate(subjects):
+            # Errors while reading are raised again by the tool
+            if pending:
+                pending.popleft().exception()
+            if sidx + prefetch < len(subjects):
+                pending.append(executor.submit(tractio.prefetch,
+                                               fileList[sidx + prefetch]))
+
+            status = _runSubject(toolGlobals['main'], argvList[sidx], outdir,
+                                 subjid, verbose)
+            tractio.clearPrefetch(fileList[sidx])
+            statusList.append(status)
+
+    return statusList
+
+def _runSubject(toolMain, argv, outdir, subjid, verbose=0):
+    """ *INTERNAL FUNCTION*
+    Runs entry point of a clustering tool for a single subject, recording
+    its status.
+
+    INPUT:
+        toolMain - entry point of clustering tool
+        argv - list of arguments of subject
+        outdir - directory where output files should be stored
+        subjid - subject id
+        verbose - verbosity of function
+
+    OUTPUT:
+        status - dictionary of status of subject
+    """
+    misc.vprint("Processing subject %s" % subjid, verbose)
+
+    status = {'status': 'running', 'start': time.time()}
+    _writeStatus(outdir, subjid, status)
+
+    sysArgv = sys.argv
+    sys.argv = [sysArgv[0]] + argv
+    try:
+        toolMain()
+        status['status'] = 'done'
+    except (Exception, SystemExit):
+        status['status'] = 'failed'
+        status['error'] = traceback.format_exc()
+        misc.vprint("Subject %s failed" % subjid, verbose)
+    finally:
+        sys.argv = sysArgv
+
+    status['end'] = time.time()
+    status['elapsed'] = status['end'] - status['start']
+    _writeStatus(outdir, subjid, status)
+
+    return status
+
+def _toolArgv(indir, outdir, subjid, bundle, toolArgs):
+    """ *INTERNAL FUNCTION*
+    Returns arguments of clustering tool for a subject.
+    """
+    return ['--indir', indir, '--outdir', outdir, '--subjid', subjid,
+            '--bundle', bundle] + list(toolArgs)
+
+def _subjectFiles(parser, argv):
+    """ *INTERNAL FUNCTION*
+    Returns tractography and scalar files read by clustering tool for a
+    subject.
+    """
+    opts = parser.parse_args(argv)
+    subjdir = op.join(opts.indir, opts.subjid)
+
+    return [op.join(subjdir, opts.bundle)] + \
+           [op.join(subjdir, str(scalar)) for scalar in opts.a]
+
+def _statusPath(outdir, subjid):
+    """ *INTERNAL FUNCTION*
+    Returns path of status file of a subject.
+    """
+    return op.join(outdir, subjid, _statusName)
+
+def _readStatus(outdir, subjid):
+    """ *INTERNAL FUNCTION*
+    Reads status of a subject; empty if subject has not been run.
+    """
+    statusPath = _statusPath(outdir, subjid)
+    if not op.exists(statusPath):
+        return {}
+
+    with open(statusPath, 'r') as f:
+        return json.load(f)
+
+def _writeStatus(outdir, subjid, status):
+    """ *INTERNAL FUNCTION*
+    Writes status of a subject.
+    """
+    if not op.exists(op.join(outdir, subjid)):
+        os.makedirs(op.join(outdir, subjid))
+
+    with open(_statusPath(outdir, subjid), 'w') as f:
+        json.dump(status, f, indent=2)
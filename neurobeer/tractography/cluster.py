@@ -8,10 +8,14 @@ parameters pertaining to clusters.
 import numpy as np
 import scipy.cluster, scipy.linalg
 import os
+from functools import partial
+from collections import OrderedDict
+from joblib import Parallel, delayed
 
-from . import fibers, distance, misc, prior
+from . import fibers, distance, misc, prior, tractio
 import vtk
 
+@misc.profiled('cluster.spectralClustering')
 def spectralClustering(fiberData, scalarDataList=[], scalarTypeList=[],
                        scalarWeightList=[], k_clusters=50, sigma=[10],
                        n_jobs=-1, dirpath=None, verbose=0):
@@ -55,69 +59,169 @@ def spectralClustering(fiberData, scalarDataList=[], scalarTypeList=[],
         misc.vprint("No. of fibers: %d" % int(fiberData.no_of_fibers), verbose)
         misc.vprint("No. of clusters: %d" % int(k_clusters), verbose)
 
-        # 1. Compute similarty matrix
-        W = _pairwiseWeightedSimilarity(fiberData, scalarTypeList,
-                                        scalarWeightList, sigma, n_jobs)
+        # 1 - 7. Spectral embedding and K-means clustering
+        centroids, clusterIdx, rejIdx = _spectralLabels(fiberData,
+                                                        scalarTypeList,
+                                                        scalarWeightList,
+                                                        k_clusters, sigma,
+                                                        n_jobs, dirpath,
+                                                        verbose)
+        colour = _cluster_to_rgb(centroids)
 
-        # Outlier detection
-        W, rejIdx = _outlierSimDetection(W)
+        misc.vprint("Finished computing clusters...", verbose)
 
-        # 2. Compute degree matrix
-        D = _degreeMatrix(W)
+        # 8. Return results
+        # Create model with user / default number of chosen samples along fiber
+        with misc.profileStage('cluster.output'):
+            outputData = fiberData.convertToVTK(rejIdx)
+            outputPolydata = _format_outputVTK(outputData, clusterIdx, colour,
+                                               centroids)
 
-        # 3. Compute unnormalized Laplacian
-        L = D - W
-        del W
+            # 9. Also add measurements from those used to cluster
+            for i in range(len(scalarTypeList)):
+                outputPolydata = addScalarToVTK(outputPolydata, fiberData,
+                                                scalarTypeList[i],
+                                                rejIdx=rejIdx)
 
-        # 4. Compute normalized Laplacian (random-walk)
-        D = np.diag(np.divide(1, np.sqrt(np.sum(D, axis=1))))
-        Lsym = np.linalg.multi_dot([D, L, D])
-        del D, L
+        return outputPolydata, clusterIdx, fiberData, rejIdx
 
-        # 5. Compute eigenvalues and eigenvectors of generalized eigenproblem
-        # Sort by ascending eigenvalue
-        eigval, eigvec = scipy.linalg.eigh(Lsym)
-        idx = eigval.argsort()
-        eigval, eigvec = eigval[idx], eigvec[:, idx]
-        misc.saveEig(dirpath, eigval, eigvec)
-        del Lsym, idx
+@misc.profiled('cluster.regionClustering')
+def regionClustering(fiberData, regionIdx, scalarDataList=[],
+                     scalarTypeList=[], scalarWeightList=[], k_clusters=50,
+                     sigma=[10], merge_thr=None, min_fibers=10, n_jobs=-1,
+                     verbose=0):
+        """
+        Clustering of fibers partitioned into spatial regions. Fibers of each
+        region are clustered independently and in parallel via spectral
+        clustering, with clusters of different regions merged if their mean
+        fibers lie within a distance threshold of each other (ie. clusters
+        split across region borders).
 
-        # 6. Find optimal eigengap and select embedding vector
-        gap_idx = _eiggap(eigval)
-        emvec = eigvec[:, 1:gap_idx + 1]
+        Clusters are allocated to regions in proportion to the number of
+        fibers within each region. Regions with fewer than min_fibers fibers
+        form a single cluster. As regions are embedded separately, no
+        eigenvalues or eigenvectors are saved.
 
-        if (k_clusters < gap_idx + 1):
-            misc.vprint("WARNING: k-clusters chosen may produce undesirable results",
-                        verbose)
+        INPUT:
+            fiberData - fiber tree of tractography data to be clustered
+            regionIdx - array of region labels of fibers
+            scalarDataList - list of scalar data for similarity measurements
+            scalarTypeList - list of scalar type for similarity measurements
+            scalarWeightList - list of weights for scalar measurements
+            k_clusters - total number of clusters via k-means clustering
+            sigma - width of Gaussian kernel; adjust to alter sensitivity
+            merge_thr - maximum distance (mm) between mean fibers of clusters
+                        to be merged across regions; defaults sigma of
+                        geometry
+            min_fibers - minimum number of fibers of region to be clustered
+            n_jobs - number of processes/threads (defaults to use all available
+                     resources)
+            verbose - verbosity of function
 
-        del eigval, eigvec, gap_idx
+        OUTPUT:
+            outputPolydata - polydata containing information from clustering
+            clusterIdx - cluster labels of fibers
+            fiberData - tree with spatial and quantitative info of fibers
+            rejIdx - indices of fibers to reject
+        """
+        if fiberData.no_of_fibers == 0:
+            raise ValueError("Input has 0 fibers!")
 
-        # 7. Find clusters using K-means clustering
-        centroids, clusterIdx = scipy.cluster.vq.kmeans2(emvec, k_clusters,
-                                                         iter=100,
-                                                         minit='points')
-        centroids, clusterIdx = _sortLabel(centroids, clusterIdx)
+        if merge_thr is None:
+            merge_thr = sigma[0]
+
+        regionIdx = np.asarray(regionIdx)
+        regions, regionCount = np.unique(regionIdx, return_counts=True)
+
+        misc.vprint("Starting regional clustering...", verbose)
+        misc.vprint("No. of fibers: %d" % int(fiberData.no_of_fibers), verbose)
+        misc.vprint("No. of regions: %d" % len(regions), verbose)
+
+        # Largest regions first to balance parallel workload
+        order = np.argsort(-regionCount)
+        regionIndex = fibers.ClusterIndex(regionIdx)
+        regionFidxes = [regionIndex.getMembers(regions[i]) for i in order]
+        regionK = [int(np.clip(np.round(k_clusters * len(fidxes) /
+                                        float(fiberData.no_of_fibers)),
+                               1, len(fidxes)))
+                   for fidxes in regionFidxes]
+
+        # 1. Cluster each region independently
+        results = Parallel(n_jobs=n_jobs, backend='threading')(
+                delayed(_regionLabels)(fiberData, fidxes, scalarTypeList,
+                                       scalarWeightList, k, sigma, min_fibers)
+                for fidxes, k in zip(regionFidxes, regionK))
+
+        fiberArray = distance.flatFibers(
+            fiberData.getFibers(range(fiberData.no_of_fibers)))
+
+        keepIdx, regionLabels, meanFibers, regionOf = [], [], [], []
+        no_of_labels = 0
+        for r, (fidxes, (labels, rejMask)) in enumerate(zip(regionFidxes,
+                                                            results)):
+            keepIdx.append(fidxes[~rejMask])
+            regionLabels.append(labels + no_of_labels)
+            for label in range(labels.max() + 1):
+                meanFibers.append(_meanFiber(
+                    fiberArray[fidxes[~rejMask][labels == label]]))
+                regionOf.append(r)
+            no_of_labels += labels.max() + 1
+
+        keepIdx = np.concatenate(keepIdx)
+        regionLabels = np.concatenate(regionLabels)
+        meanFibers, regionOf = np.array(meanFibers), np.array(regionOf)
+
+        # 2. Merge clusters across region borders
+        misc.vprint("Merging clusters across %d regions..." % len(regions),
+                    verbose)
+        mergeLabels = _mergeLabels(meanFibers, regionOf, merge_thr)
+
+        # 3. Sort labels by fiber count, retaining original fiber order
+        sortIdx = np.argsort(keepIdx)
+        keepIdx, clusterIdx = keepIdx[sortIdx], \
+                              mergeLabels[regionLabels[sortIdx]]
+        uniqueClusters, clusterIdx, countClusters = np.unique(
+            clusterIdx, return_inverse=True, return_counts=True)
+        sortedClusters = np.argsort(-countClusters, kind='stable')
+        newLabels = np.empty(len(sortedClusters), dtype=np.int64)
+        newLabels[sortedClusters] = np.arange(len(sortedClusters))
+        clusterIdx = newLabels[clusterIdx]
+
+        # Centroids as location of clusters relative to center of fibers
+        midpoints = 0.5 * (fiberArray[keepIdx, 0] + fiberArray[keepIdx, -1])
+        midpoints = midpoints - np.mean(midpoints, axis=0)
+        centroids = np.zeros((len(sortedClusters), 3))
+        for axis in range(3):
+            centroids[:, axis] = np.bincount(clusterIdx,
+                                             weights=midpoints[:, axis])
+        centroids /= np.bincount(clusterIdx)[:, None]
         colour = _cluster_to_rgb(centroids)
 
-        misc.vprint("Finished computing clusters...", verbose)
+        rejIdx = list(np.setdiff1d(np.arange(fiberData.no_of_fibers),
+                                   keepIdx))
+        rejIdx.reverse()
 
-        # 8. Return results
-        # Create model with user / default number of chosen samples along fiber
+        misc.vprint("Finished computing %d clusters..." % len(centroids),
+                    verbose)
+
+        # 4. Return results
         outputData = fiberData.convertToVTK(rejIdx)
         outputPolydata = _format_outputVTK(outputData, clusterIdx, colour,
                                            centroids)
 
-        # 9. Also add measurements from those used to cluster
+        # 5. Also add measurements from those used to cluster
         for i in range(len(scalarTypeList)):
             outputPolydata = addScalarToVTK(outputPolydata, fiberData,
                                             scalarTypeList[i], rejIdx=rejIdx)
 
         return outputPolydata, clusterIdx, fiberData, rejIdx
 
+@misc.profiled('cluster.spectralPriorCluster')
 def spectralPriorCluster(fiberData, priorVTK, templateFlag=False,
                          scalarDataList=[], scalarTypeList=[],
                          scalarWeightList=[], sigma=[10], pflag=True,
-                         n_jobs=-1, dirpath=None, verbose=0):
+                         n_candidates=None, n_medoids=1, n_jobs=-1,
+                         dirpath=None, verbose=0):
         """
         Clustering of fibers based on pairwise fiber similarity using
         previously clustered fibers via a Nystrom-like method.
@@ -141,6 +245,11 @@ def spectralPriorCluster(fiberData, priorVTK, templateFlag=False,
             scalarWeightList - list with weights for similarity measurements;
             sigma - width of Gaussian kernel; adjust to alter sensitivity
             pflag - flag indicating clustering with priors
+            n_candidates - number of prior clusters, closest by medoid, to
+                           compare all fibers of; defaults None (compare with
+                           all prior fibers)
+            n_medoids - number of medoids per prior cluster used to identify
+                        candidate clusters
             n_jobs - number of processes/threads (defaults to use all available
                      resources)
             dirpath - directory to store files
@@ -168,14 +277,32 @@ def spectralPriorCluster(fiberData, priorVTK, templateFlag=False,
         misc.vprint("No. of clusters: %d" % int(k_clusters), verbose)
 
         # 1. Compute similarity matrix
-        W, labels = _priorWeightedSimilarity(fiberData, priorData,
-                                             scalarTypeList, scalarWeightList,
-                                             sigma, pflag, n_jobs)
+        if n_candidates is None:
+            with misc.profileStage('cluster.similarity'):
+                W, labels = _priorWeightedSimilarity(fiberData, priorData,
+                                                     scalarTypeList,
+                                                     scalarWeightList, sigma,
+                                                     pflag, n_jobs)
+        else:
+            misc.vprint("Identifying candidate clusters from medoids...",
+                        verbose)
+            with misc.profileStage('cluster.medoids'):
+                medoidIdxes, medoidLabels = prior.getMedoids(priorData,
+                                                             priorLabels,
+                                                             n_medoids)
+            with misc.profileStage('cluster.similarity'):
+                W, labels = _priorMedoidSimilarity(fiberData, priorData,
+                                                   priorLabels, medoidIdxes,
+                                                   medoidLabels, n_candidates,
+                                                   scalarTypeList,
+                                                   scalarWeightList, sigma,
+                                                   n_jobs)
 
         misc.vprint("Performing outlier removal...", verbose)
-        W, rejIdx = _outlierSimDetection(W, labels=labels,
-                                         tflag=templateFlag,
-                                         subsetIdxes=subsetIdxes)
+        with misc.profileStage('cluster.outliers'):
+            W, rejIdx = _outlierSimDetection(W, labels=labels,
+                                             tflag=templateFlag,
+                                             subsetIdxes=subsetIdxes)
 
         # 2. Identify corresponding cluster indices from similarity
         labels = np.delete(labels, rejIdx)
@@ -186,15 +313,17 @@ def spectralPriorCluster(fiberData, priorVTK, templateFlag=False,
         del W
 
         misc.vprint("Finished clustering...", verbose)
-        outputData = fiberData.convertToVTK(rejIdx)
-        outputPolydata = _format_outputVTK(outputData, clusterIdx, colour,
-                                           priorCentroids)
-
-        misc.vprint("Mapping scalar data if applicable...", verbose)
-        # 3. Also add measurements from those used to cluster
-        for i in range(len(scalarTypeList)):
-            outputPolydata = addScalarToVTK(outputPolydata, fiberData,
-                                            scalarTypeList[i], rejIdx=rejIdx)
+        with misc.profileStage('cluster.output'):
+            outputData = fiberData.convertToVTK(rejIdx)
+            outputPolydata = _format_outputVTK(outputData, clusterIdx, colour,
+                                               priorCentroids)
+
+            misc.vprint("Mapping scalar data if applicable...", verbose)
+            # 3. Also add measurements from those used to cluster
+            for i in range(len(scalarTypeList)):
+                outputPolydata = addScalarToVTK(outputPolydata, fiberData,
+                                                scalarTypeList[i],
+                                                rejIdx=rejIdx)
 
         return outputPolydata, clusterIdx, fiberData, rejIdx
 
@@ -247,6 +376,64 @@ def addScalarToVTK(polyData, fiberTree, scalarType, fidxes=None, rejIdx=[]):
 
     return polyData
 
+@misc.profiled('cluster.writeClusters')
+def writeClusters(clusterData, clusterIdx, scalarTypeList, filePrefix,
+                  suffix='_Cluster%i.vtk', n_jobs=-1, verbose=0):
+    """
+    Writes each cluster to a separate .vtk file. Fibers and scalars are
+    partitioned by cluster once, with files of clusters written
+    concurrently. Files are written by tractio.writeVTK in the same format
+    (legacy version 4.2) as the clustered bundle.
+
+    INPUT:
+        clusterData - fiber tree of clustered fibers
+        clusterIdx - cluster labels of fibers of clusterData
+        scalarTypeList - list of scalar types to be added to polydata
+        filePrefix - path and prefix of files to be written
+        suffix - suffix of files, formatted with cluster label; defaults
+                 '_Cluster%i.vtk'
+        n_jobs - number of processes/threads (defaults to use all available
+                 resources)
+        verbose - verbosity of function
+
+    OUTPUT:
+        clusterIndex - index of fibers of each cluster (fibers.ClusterIndex)
+    """
+    clusterIndex = fibers.ClusterIndex(clusterIdx)
+    fidxes = range(clusterData.no_of_fibers)
+
+    fiberArray = distance.flatFibers(clusterData.getFibers(fidxes))
+    scalarList = [(Type.split('/', -1)[-1],
+                   np.asarray(clusterData.getScalars(fidxes, Type),
+                              dtype=np.float32))
+                  for Type in scalarTypeList]
+
+    Parallel(n_jobs=n_jobs, backend='threading')(
+        delayed(_writeCluster)(fiberArray[idxes],
+                               [(name, scalarArray[idxes])
+                                for name, scalarArray in scalarList],
+                               filePrefix + suffix % label, verbose)
+        for label, idxes in clusterIndex)
+
+    return clusterIndex
+
+def _writeCluster(fiberArray, scalarList, vtk_file, verbose=0):
+    """ *INTERNAL FUNCTION*
+    Writes fibers of a single cluster, with scalars added at each sample.
+
+    INPUT:
+        fiberArray - array of fibers of cluster (N, pts_per_fiber, 3)
+        scalarList - list of (name, scalar array (N, pts_per_fiber)) pairs
+        vtk_file - name of file to be written
+        verbose - verbosity of function
+
+    OUTPUT:
+        none
+    """
+    polyData = tractio.fibersToPolyData(fiberArray, OrderedDict(scalarList))
+
+    tractio.writeVTK(polyData, vtk_file, verbose)
+
 def extractCluster(inputVTK, clusterIdx, label, pts_per_fiber):
     """
     Extracts a cluster corresponding to the label provided.
@@ -264,7 +451,8 @@ def extractCluster(inputVTK, clusterIdx, label, pts_per_fiber):
     fiberTree = fibers.FiberTree()
     fiberTree.convertFromVTK(inputVTK, pts_per_fiber)
 
-    cluster = fiberTree.getFibers(np.where(clusterIdx == label)[0])
+    cluster = fiberTree.getFibers(
+        fibers.ClusterIndex(clusterIdx).getMembers(label))
     cluster = fibers.convertFromTuple(cluster)
     polyData = cluster.convertToVTK()
 
@@ -331,7 +519,7 @@ def _pairwiseQDistance_matrix(fiberTree, scalarType, n_jobs=-1):
         qDistances - NxN matrix containing pairwise distances between fibers
     """
 
-    qDistances = distance.scalarDistance(fiberTree.getScalars(
+    qDistances, _ = distance.scalarDistance(fiberTree.getScalars(
         range(fiberTree.no_of_fibers), scalarType), n_jobs=n_jobs)
 
     if np.diag(qDistances).all() != 0.0:
@@ -382,13 +570,21 @@ def _priorDistance_matrix(fiberTree, priorTree, pflag=True, n_jobs=-1):
                  resources)
 
     OUTPUT:
-        distances - matrix containing distances between fibers
+        distances - matrix containing distances between fibers; minimum
+                    distance to prior fibers if pflag is set
         labels - corresponding labels of most similar streamlines
     """
 
-    distances, labels = distance.fiberDistance(fiberTree.getFibers(
-        range(fiberTree.no_of_fibers)), priorTree.getFibers(
-        range(priorTree.no_of_fibers)), pflag=pflag, n_jobs=n_jobs)
+    if pflag is True:
+        # Search prior fibers through spatial index
+        priorIndex = distance.FiberIndex(priorTree.getFibers(
+            range(priorTree.no_of_fibers)))
+        distances, labels = priorIndex.query(fiberTree.getFibers(
+            range(fiberTree.no_of_fibers)), n_jobs=n_jobs)
+    else:
+        distances, labels = distance.fiberDistance(fiberTree.getFibers(
+            range(fiberTree.no_of_fibers)), priorTree.getFibers(
+            range(priorTree.no_of_fibers)), pflag=pflag, n_jobs=n_jobs)
 
     return distances, labels
 
@@ -440,8 +636,10 @@ def _priorQDistance_matrix(fiberTree, priorTree, scalarType, pflag=True,
         labels - corresponding labels of most similar streamlines
     """
 
-    qDistances, labels = distance.scalarDistance(priorTree.getScalars(
-        range(priorTree.no_of_fibers), scalarType), pflag=True, n_jobs=n_jobs)
+    qDistances, labels = distance.scalarDistance(fiberTree.getScalars(
+        range(fiberTree.no_of_fibers), scalarType), priorTree.getScalars(
+        range(priorTree.no_of_fibers), scalarType), pflag=pflag,
+        n_jobs=n_jobs)
     qDistances = np.array(qDistances)
 
     return qDistances, labels
@@ -495,6 +693,169 @@ def _degreeMatrix(inputMatrix):
 
     return degMat
 
+def _spectralLabels(fiberData, scalarTypeList=[], scalarWeightList=[],
+                    k_clusters=50, sigma=[10], n_jobs=-1, dirpath=None,
+                    verbose=0):
+    """ *INTERNAL FUNCTION*
+    Computes spectral embedding of fibers and clusters embedding via K-means.
+
+    INPUT:
+        fiberData - fiber tree of tractography data to be clustered
+        scalarTypeList - list of scalar type for similarity measurements
+        scalarWeightList - list of weights for scalar measurements
+        k_clusters - number of clusters via k-means clustering
+        sigma - width of Gaussian kernel; adjust to alter sensitivity
+        n_jobs - number of processes/threads (defaults to use all available
+                 resources)
+        dirpath - directory to store eigenvalues and eigenvectors; not
+                  stored if None
+        verbose - verbosity of function
+
+    OUTPUT:
+        centroids - centroids of clusters in embedding
+        clusterIdx - cluster labels of fibers
+        rejIdx - list of indices of fibers to reject, in descending order
+    """
+    # 1. Compute similarty matrix
+    with misc.profileStage('cluster.similarity'):
+        W = _pairwiseWeightedSimilarity(fiberData, scalarTypeList,
+                                        scalarWeightList, sigma, n_jobs)
+
+    # Outlier detection
+    with misc.profileStage('cluster.outliers'):
+        W, rejIdx = _outlierSimDetection(W)
+
+    # Descending order, such that fibers can be removed in turn
+    rejIdx = list(rejIdx[0])
+    rejIdx.reverse()
+
+    with misc.profileStage('cluster.laplacian'):
+        # 2. Compute degree matrix
+        D = _degreeMatrix(W)
+
+        # 3. Compute unnormalized Laplacian
+        L = D - W
+        del W
+
+        # 4. Compute normalized Laplacian (random-walk)
+        D = np.diag(np.divide(1, np.sqrt(np.sum(D, axis=1))))
+        Lsym = np.linalg.multi_dot([D, L, D])
+        del D, L
+
+    # 5. Compute eigenvalues and eigenvectors of generalized eigenproblem
+    # Sort by ascending eigenvalue
+    with misc.profileStage('cluster.eigendecomposition'):
+        eigval, eigvec = scipy.linalg.eigh(Lsym)
+        idx = eigval.argsort()
+        eigval, eigvec = eigval[idx], eigvec[:, idx]
+    if dirpath is not None:
+        with misc.profileStage('cluster.saveEig'):
+            misc.saveEig(dirpath, eigval, eigvec)
+    del Lsym, idx
+
+    # 6. Find optimal eigengap and select embedding vector
+    gap_idx = _eiggap(eigval)
+    emvec = eigvec[:, 1:max(gap_idx, 1) + 1]
+
+    if (k_clusters < gap_idx + 1):
+        misc.vprint("WARNING: k-clusters chosen may produce undesirable results",
+                    verbose)
+
+    del eigval, eigvec, gap_idx
+
+    # 7. Find clusters using K-means clustering
+    with misc.profileStage('cluster.kmeans'):
+        centroids, clusterIdx = scipy.cluster.vq.kmeans2(emvec, k_clusters,
+                                                         iter=100,
+                                                         minit='points')
+        centroids, clusterIdx = _sortLabel(centroids, clusterIdx)
+
+    return centroids, clusterIdx, rejIdx
+
+def _regionLabels(fiberData, fidxes, scalarTypeList=[], scalarWeightList=[],
+                  k_clusters=1, sigma=[10], min_fibers=10):
+    """ *INTERNAL FUNCTION*
+    Clusters fibers of a single region.
+
+    INPUT:
+        fiberData - fiber tree of tractography data to be clustered
+        fidxes - indices of fibers within region
+        scalarTypeList - list of scalar type for similarity measurements
+        scalarWeightList - list of weights for scalar measurements
+        k_clusters - number of clusters of region
+        sigma - width of Gaussian kernel; adjust to alter sensitivity
+        min_fibers - minimum number of fibers of region to be clustered
+
+    OUTPUT:
+        clusterIdx - cluster labels of retained fibers, from 0
+        rejMask - boolean array of fibers of region considered outliers
+    """
+    rejMask = np.zeros(len(fidxes), dtype=bool)
+
+    if len(fidxes) < max(min_fibers, 2) or k_clusters < 2:
+        return np.zeros(len(fidxes), dtype=np.int64), rejMask
+
+    regionData = fibers.convertFromTuple(fiberData.getFibers(fidxes))
+    regionData.copyScalar(fiberData, scalarTypeList, fidxes=list(fidxes))
+
+    _, clusterIdx, rejIdx = _spectralLabels(regionData, scalarTypeList,
+                                            scalarWeightList,
+                                            min(k_clusters, len(fidxes) // 2),
+                                            sigma, n_jobs=1)
+    rejMask[rejIdx] = True
+
+    # Consecutive labels, as K-means may leave clusters empty
+    clusterIdx = np.unique(clusterIdx, return_inverse=True)[1]
+
+    return clusterIdx.reshape(-1), rejMask
+
+def _meanFiber(fiberArray):
+    """ *INTERNAL FUNCTION*
+    Computes mean of fibers, with fibers flipped to the orientation of the
+    first fiber.
+
+    INPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+
+    OUTPUT:
+        meanFiber - mean fiber of shape (pts_per_fiber, 3)
+    """
+    ref = fiberArray[0]
+    flip = distance.calcMDF(fiberArray, ref[::-1]) < \
+           distance.calcMDF(fiberArray, ref)
+    fiberArray = np.where(flip[:, None, None], fiberArray[:, ::-1],
+                          fiberArray)
+
+    return np.mean(fiberArray, axis=0)
+
+def _mergeLabels(meanFibers, regionOf, merge_thr):
+    """ *INTERNAL FUNCTION*
+    Merges clusters of different regions with mean fibers within a distance
+    threshold, including chains of such clusters.
+
+    INPUT:
+        meanFibers - array of mean fibers of clusters (K, pts_per_fiber, 3)
+        regionOf - array of region of each cluster
+        merge_thr - maximum distance between mean fibers to be merged
+
+    OUTPUT:
+        mergeLabels - array of merged label of each cluster
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    dist = np.minimum(
+        distance.calcMDF(meanFibers[:, None], meanFibers[None]),
+        distance.calcMDF(meanFibers[:, None], meanFibers[None, :, ::-1]))
+    i, j = np.where((dist <= merge_thr) & (regionOf[:, None] !=
+                                           regionOf[None]))
+
+    graph = coo_matrix((np.ones(len(i)), (i, j)),
+                       shape=(len(meanFibers), len(meanFibers)))
+    _, mergeLabels = connected_components(graph, directed=False)
+
+    return mergeLabels
+
 def _cluster_to_rgb(data):
     """ *INTERNAL FUNCTION*
     Generate cluster color from first three components of data
@@ -509,6 +870,11 @@ def _cluster_to_rgb(data):
 
     colour = data[:, 0:3]
 
+    # Embeddings of fewer than three dimensions
+    if colour.shape[1] < 3:
+        colour = np.pad(colour, ((0, 0), (0, 3 - colour.shape[1])),
+                        mode='constant')
+
     # Normalize color
     colourMag = np.sqrt(np.sum(np.square(colour), 1))
     colour = np.divide(colour.T, colourMag).T
@@ -564,6 +930,30 @@ def _format_outputVTK(polyData, clusterIdx, colour, centroids, rejIdx=[]):
 
     return polyData
 
+def _format_outputPolyData(polyData, clusterIdx, colour, centroids):
+    """ *INTERNAL FUNCTION*
+    Formats polydata stored as arrays with cluster index and colour, in the
+    same layout as _format_outputVTK.
+
+    INPUT:
+        polyData - polydata of class tractio.PolyData for information to be
+                   applied to
+        clusterIdx - cluster indices to be applied to each fiber within the
+                     polydata model
+        colour - colours to be applied to each fiber within the polydata model
+        centroid - centroid location to associated with each cluster
+
+    OUTPUT:
+        polyData - updated polydata with cluster and colour information
+    """
+    clusterIdx = np.asarray(clusterIdx, dtype=np.int64)
+
+    polyData.cellData['Colour'] = colour[clusterIdx].astype(np.uint8)
+    polyData.cellData['ClusterLabel'] = clusterIdx.astype(np.int32)
+    polyData.cellData['Centroid'] = centroids[clusterIdx].astype(np.float32)
+
+    return polyData
+
 def _pairwiseWeightedSimilarity(fiberTree, scalarTypeList=[],
                                 scalarWeightList=[], sigma=[10], n_jobs=-1):
     """ *INTERNAL FUNCTION*
@@ -583,23 +973,13 @@ def _pairwiseWeightedSimilarity(fiberTree, scalarTypeList=[],
         wSimilarity - matrix containing the computed weighted similarity
     """
 
-    if ((scalarWeightList == []) and (scalarTypeList != [])):
-        raise ValueError("No weights given for provided measurements!")
-
-    elif ((scalarWeightList != []) and (scalarTypeList == [])):
-        raise ValueError("Please also specify measurement(s) type!")
-
-    elif ((((scalarWeightList == [])) and ((scalarTypeList == []))) or
-    (scalarWeightList[0] == 1)):
+    if distance.checkWeights(scalarTypeList, scalarWeightList):
         print("\nCalculating similarity based on geometry.")
         wSimilarity = _pairwiseSimilarity_matrix(fiberTree, sigma[0],
                                                  n_jobs=n_jobs)
         print("\nFinished calculating similarity")
 
     else:   # Calculate weighted similarity
-        if np.sum(scalarWeightList) != 1.0:
-            raise ValueError("Weights given do not sum 1!")
-
         wSimilarity = _pairwiseSimilarity_matrix(fiberTree, sigma[0], n_jobs)
         wSimilarity = wSimilarity * scalarWeightList[0]
 
@@ -637,14 +1017,7 @@ def _priorWeightedSimilarity(fiberTree, priorTree, scalarTypeList=[],
         labels - corresponding labels of most similar streamlines
     """
 
-    if ((scalarWeightList == []) and (scalarTypeList != [])):
-        raise ValueError("No weights given for provided measurements!")
-
-    elif ((scalarWeightList != []) and (scalarTypeList == [])):
-        raise ValueError("Please also specify measurement(s) type!")
-
-    elif (((scalarWeightList == []) and (scalarTypeList == [])) or
-    (scalarWeightList[0] == 1)):
+    if distance.checkWeights(scalarTypeList, scalarWeightList):
         print("\nCalculating similarity based on geometry.")
         wSimilarity, labels = _priorSimilarity_matrix(fiberTree, priorTree,
                                                       sigma[0], pflag=pflag,
@@ -652,25 +1025,171 @@ def _priorWeightedSimilarity(fiberTree, priorTree, scalarTypeList=[],
         print("\nFinished calculating similarity")
 
     else:   # Calculate weighted similarity
-    # NEEDS TO BE FIXED TO HANDLE HIGHER STREAMLINE COUNTS
+        # Most similar prior fiber found by streaming over blocks of fibers
+        fidxes = range(fiberTree.no_of_fibers)
+        pidxes = range(priorTree.no_of_fibers)
+
+        wSimilarity, labels = distance.weightedPriorSimilarity(
+            fiberTree.getFibers(fidxes), priorTree.getFibers(pidxes),
+            [fiberTree.getScalars(fidxes, scalarType)
+             for scalarType in scalarTypeList],
+            [priorTree.getScalars(pidxes, scalarType)
+             for scalarType in scalarTypeList],
+            scalarWeightList, sigma, n_jobs=n_jobs)
 
-        if np.sum(scalarWeightList) != 1.0:
-            raise ValueError("Weights given do not sum 1.")
+    return wSimilarity, labels
 
-        wSimilarity = _priorSimilarity_matrix(fiberTree, priorTree, sigma[0],
-                                              n_jobs=n_jobs)
-        wSimilarity = wSimilarity * scalarWeightList[0]
+def _priorMedoidSimilarity(fiberTree, priorTree, priorLabels, medoidIdxes,
+                           medoidLabels, n_candidates=5, scalarTypeList=[],
+                           scalarWeightList=[], sigma=[10], n_jobs=-1):
+    """ *INTERNAL FUNCTION*
+    Computes the similarity of each fiber to its most similar prior fiber in
+    two stages. Fibers are first compared to the medoids of each prior
+    cluster, followed by comparison with all members of the n_candidates
+    closest clusters only.
 
-        for i in range(len(scalarTypeList)):
-            similarity = _priorQSimilarity_matrix(fiberTree, priorTree,
-                scalarTypeList[i], sigma[i+1], n_jobs=n_jobs)
+    INPUT:
+        fiberTree - tree containing scalar data for similarity measurements
+        priorTree - tree containing previously clustered tract information
+        priorLabels - cluster labels of prior fibers
+        medoidIdxes - indices of medoid fibers with one row per cluster
+        medoidLabels - cluster labels corresponding to rows of medoidIdxes
+        n_candidates - number of closest clusters to compare fibers with
+        scalarTypeList - list of scalar type for similarity measurements
+        scalarWeightList - list of weights for similarity measurements
+        sigma - width of Gaussian kernel; adjust to alter sensitivity
+        n_jobs - number of processes/threads (defaults to use all available
+                 resources)
 
-            wSimilarity += similarity * scalarWeightList[i+1]
+    OUTPUT:
+        wSimilarity - similarity of each fiber to its most similar prior fiber
+        labels - corresponding labels of most similar streamlines
+    """
 
-        del similarity
+    geoFlag = distance.checkWeights(scalarTypeList, scalarWeightList)
+
+    fidxes = range(fiberTree.no_of_fibers)
+    pidxes = range(priorTree.no_of_fibers)
+
+    fiberArray = distance.flatFibers(fiberTree.getFibers(fidxes))
+    priorArray = distance.flatFibers(priorTree.getFibers(pidxes))
+
+    if geoFlag:
+        scalarWeightList = [1.0]
+        fiberScalarList, priorScalarList = [], []
+    else:
+        fiberScalarList = [np.asarray(fiberTree.getScalars(fidxes, scalarType),
+                                      dtype=np.float32)
+                           for scalarType in scalarTypeList]
+        priorScalarList = [np.asarray(priorTree.getScalars(pidxes, scalarType),
+                                      dtype=np.float32)
+                           for scalarType in scalarTypeList]
+
+    # Stage 1: closest clusters by medoid
+    n_candidates = min(n_candidates, len(medoidLabels))
+    medoidArray = priorArray[medoidIdxes.ravel()]
+    candidates = _medoidCandidates(fiberArray, medoidArray,
+                                   medoidIdxes.shape, n_candidates)
+
+    # Group fibers by candidate cluster
+    order = np.argsort(candidates.ravel(), kind='mergesort')
+    bounds = np.searchsorted(candidates.ravel()[order],
+                             np.arange(len(medoidLabels) + 1))
+    candFibers = order // n_candidates
+
+    # Stage 2: compare with members of candidate clusters
+    priorIndex = fibers.ClusterIndex(priorLabels)
+    clusterMatch = Parallel(n_jobs=n_jobs, backend='threading')(
+        delayed(_clusterMatch)(fiberArray, priorArray, fiberScalarList,
+                               priorScalarList, scalarWeightList, sigma,
+                               candFibers[bounds[i]:bounds[i+1]],
+                               priorIndex.getMembers(medoidLabels[i]))
+        for i in range(len(medoidLabels)))
+
+    wSimilarity = np.full(fiberArray.shape[0], -np.inf, dtype=np.float32)
+    labels = np.zeros(fiberArray.shape[0], dtype=int)
+    for fidxes, score, pidx in clusterMatch:
+        better = score > wSimilarity[fidxes]
+        wSimilarity[fidxes[better]] = score[better]
+        labels[fidxes[better]] = pidx[better]
 
     return wSimilarity, labels
 
+def _medoidCandidates(fiberArray, medoidArray, medoidShape, n_candidates,
+                      chunk_size=1024):
+    """ *INTERNAL FUNCTION*
+    Identifies the closest clusters of each fiber from distances to medoids
+
+    INPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+        medoidArray - array of medoid fibers ordered by cluster
+        medoidShape - shape of array of medoid indices (clusters, medoids)
+        n_candidates - number of closest clusters to keep
+        chunk_size - number of fibers compared at once
+
+    OUTPUT:
+        candidates - row indices of medoid array of closest clusters
+    """
+    candidates = np.zeros((fiberArray.shape[0], n_candidates), dtype=int)
+
+    for i0 in range(0, fiberArray.shape[0], chunk_size):
+        i1 = min(i0 + chunk_size, fiberArray.shape[0])
+
+        clusterDist = -distance.geoScore(fiberArray, medoidArray, i0, i1, 0,
+                                         medoidArray.shape[0])
+        clusterDist = np.min(clusterDist.reshape(i1 - i0, medoidShape[0],
+                                                 medoidShape[1]), axis=2)
+        candidates[i0:i1] = np.argpartition(clusterDist, n_candidates - 1,
+                                            axis=1)[:, :n_candidates]
+
+    return candidates
+
+def _clusterMatch(fiberArray, priorArray, fiberScalarList, priorScalarList,
+                  scalarWeightList, sigma, fidxes, pidxes,
+                  max_block=4000000):
+    """ *INTERNAL FUNCTION*
+    Finds the most similar member of a single prior cluster for a subset of
+    fibers
+
+    INPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+        priorArray - array of prior fibers of shape (M, pts_per_fiber, 3)
+        fiberScalarList - list of scalar arrays of fibers
+        priorScalarList - list of scalar arrays of prior fibers
+        scalarWeightList - list of weights for similarity measurements
+        sigma - width of Gaussian kernel; adjust to alter sensitivity
+        fidxes - indices of fibers to compare
+        pidxes - indices of prior fibers belonging to the cluster
+        max_block - maximum number of sample points compared at once
+
+    OUTPUT:
+        fidxes - indices of fibers compared
+        score - similarity of each fiber to most similar cluster member
+        pidx - index of most similar cluster member
+    """
+    score = np.zeros(len(fidxes), dtype=np.float32)
+    pidx = np.zeros(len(fidxes), dtype=int)
+
+    if len(fidxes) == 0 or len(pidxes) == 0:
+        return fidxes, score - np.inf, pidx
+
+    scoreFn = partial(distance.weightedScore, fiberArray[fidxes],
+                      priorArray[pidxes],
+                      [scalar[fidxes] for scalar in fiberScalarList],
+                      [scalar[pidxes] for scalar in priorScalarList],
+                      scalarWeightList, sigma)
+
+    step = max(1, int(max_block // (len(pidxes) * fiberArray.shape[1])))
+    for i0 in range(0, len(fidxes), step):
+        i1 = min(i0 + step, len(fidxes))
+        blockScore = scoreFn(i0, i1, 0, len(pidxes))
+        best = np.argmax(blockScore, axis=1)
+
+        score[i0:i1] = blockScore[np.arange(i1 - i0), best]
+        pidx[i0:i1] = pidxes[best]
+
+    return fidxes, score, pidx
+
 def _sortLabel(centroids, clusterIdx):
     """ *INTERNAL FUNCTION*
     Sort the cluster label by fiber count.
@@ -732,18 +1251,16 @@ def _outlierSimDetection(W, labels=None, tflag=False, subsetIdxes=None):
             return W, rejIdx[0]
 
     else:
-        rejIdx = []
-        for label in np.unique(labels):
-            temp = np.where(labels == label)
-            W_outlierthr = np.mean(W[temp]) - np.std(W[temp])
-            for idx in temp[0]:
-                if W[idx] < W_outlierthr:
-                    rejIdx.append(idx)
-                else:
-                    continue
-
-        rejIdx = list(np.unique(rejIdx))
-        rejIdx.reverse()
+        labelIndex = fibers.ClusterIndex(labels)
+        binIdx, counts = labelIndex.inverse, labelIndex.counts
+
+        W_mean = np.bincount(binIdx, weights=W) / counts
+        W_std = np.sqrt(np.bincount(binIdx,
+                                    weights=np.square(W - W_mean[binIdx])) /
+                        counts)
+        W_outlierthr = W_mean - W_std
+
+        rejIdx = list(np.where(W < W_outlierthr[binIdx])[0][::-1])
 
         W = np.delete(W, rejIdx)
 
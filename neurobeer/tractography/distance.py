@@ -6,8 +6,10 @@ similarity measurements.
 """
 
 import numpy as np
-from joblib import Parallel, delayed
+from functools import partial
+from joblib import Parallel, delayed, effective_n_jobs
 from joblib.pool import has_shareable_memory
+from scipy.spatial import cKDTree
 
 def _calcDistance(fiberMatrix1, fiberMatrix2):
     """ *INTERNAL FUNCTION*
@@ -36,7 +38,7 @@ def _calcQDistance(fiberMatrix1, fiberMatrix2):
     OUTPUT:
         Average "Euclidean" distance of quantitative values
     """
-    return np.asarray(np.mean(np.linalg.norm(fiberMatrix1, fiberMatrix2), axis=1))
+    return np.mean(np.abs(np.subtract(fiberMatrix1, fiberMatrix2)), axis=1)
 
 def _fiberDistance_internal(fiberMatrix1, fiberMatrix2, flip=False,
                             pflag=False, n_jobs=-1):
@@ -71,7 +73,7 @@ def _fiberDistance_internal(fiberMatrix1, fiberMatrix2, flip=False,
             for i in range(fiberMatrix1.shape[1]))
 
     if pflag is False:
-        return distance
+        return distance, None
     else:
         label, minDist = [], []
         for i in range(fiberMatrix1.shape[1]):
@@ -118,7 +120,7 @@ def _scalarDistance_internal(fiberScalarMatrix1, fiberScalarMatrix2,
     else:
         qDistance = Parallel(n_jobs=n_jobs, backend='threading')(
             delayed(_calcQDistance, has_shareable_memory)(
-                np.flip(fiberScalarMatrix1[i, :], fiberScalarMatrix2))
+                np.flip(fiberScalarMatrix1[i, :], axis=0), fiberScalarMatrix2)
             for i in range(fiberScalarMatrix1.shape[0]))
 
     if pflag is False:
@@ -145,7 +147,21 @@ def fiberDistance(fiberArray1, fiberArray2=None, pflag=False, n_jobs=-1):
                    traversed in both directions
     """
 
-    if fiberArray2 is None:
+    if (pflag is True) and (fiberArray2 is not None):
+        fiberArray1 = flatFibers(fiberArray1)
+        fiberArray2 = flatFibers(fiberArray2)
+
+        # Keep only most similar fiber while traversing comparison group
+        distance, label = _priorTopK(partial(geoScore, fiberArray1,
+                                            fiberArray2),
+                                     fiberArray1.shape[0],
+                                     fiberArray2.shape[0],
+                                     pair_bytes=fiberArray1[0].nbytes,
+                                     n_jobs=n_jobs)
+
+        return -distance[:, 0], label[:, 0]
+
+    elif fiberArray2 is None:
         fiberArray1 = np.asarray(fiberArray1, dtype=np.float32)
 
         # Compute distances for fiber and flipped fiber of group
@@ -198,7 +214,21 @@ def scalarDistance(fiberScalarArray1, fiberScalarArray2=None, pflag=False,
     OUTPUT:
         distance - distance between group of fiber and single fiber
     """
-    if fiberScalarArray2 is None:
+    if (pflag is True) and (fiberScalarArray2 is not None):
+        fiberScalarArray1 = np.asarray(fiberScalarArray1, dtype=np.float32)
+        fiberScalarArray2 = np.asarray(fiberScalarArray2, dtype=np.float32)
+
+        # Keep only most similar fiber while traversing comparison group
+        distance, label = _priorTopK(partial(_scalarScore, fiberScalarArray1,
+                                             fiberScalarArray2),
+                                     fiberScalarArray1.shape[0],
+                                     fiberScalarArray2.shape[0],
+                                     pair_bytes=fiberScalarArray1[0].nbytes,
+                                     n_jobs=n_jobs)
+
+        return -distance[:, 0], label[:, 0]
+
+    elif fiberScalarArray2 is None:
         fiberScalarArray1 = np.asarray(fiberScalarArray1, dtype=np.float32)
 
         # Compute distances for fiber and fiber equivalent to fiber group
@@ -236,6 +266,483 @@ def scalarDistance(fiberScalarArray1, fiberScalarArray2=None, pflag=False,
 
     return distance, label
 
+def checkWeights(scalarTypeList=[], scalarWeightList=[]):
+    """
+    Validates weights of geometry and scalar measurements used to compute
+    weighted similarity. First element of scalarWeightList should be weight
+    placed for geometry, followed by order given in scalarTypeList.
+
+    INPUT:
+        scalarTypeList - list of scalar type for similarity measurements
+        scalarWeightList - list of weights for similarity measurements
+
+    OUTPUT:
+        geoFlag - flag indicating similarity is based on geometry only
+    """
+    if (len(scalarWeightList) == 0) and (len(scalarTypeList) != 0):
+        raise ValueError("No weights given for provided measurements!")
+
+    elif (len(scalarWeightList) != 0) and (len(scalarTypeList) == 0):
+        raise ValueError("Please also specify measurement(s) type!")
+
+    elif (len(scalarWeightList) == 0) or (scalarWeightList[0] == 1):
+        return True
+
+    elif np.sum(scalarWeightList) != 1.0:
+        raise ValueError("Weights given do not sum 1.")
+
+    return False
+
+def weightedPriorSimilarity(fiberArray1, fiberArray2, scalarArrayList1=[],
+                            scalarArrayList2=[], scalarWeightList=[1.0],
+                            sigma=[10], k=1, chunk_size=128, n_jobs=-1):
+    """
+    Computes the weighted similarity of each fiber in a group to its most
+    similar fibers in a second (prior) group. Subject fibers are processed in
+    blocks against blocks of the second group, retaining only a running top-k
+    per fiber, such that the full distance matrix is never stored.
+
+    Scalar distances are computed in the orientation providing the smallest
+    geometric distance for each pair of fibers.
+
+    INPUT:
+        fiberArray1 - group of fibers for comparison
+        fiberArray2 - group of fibers to compare fiberArray1 to
+        scalarArrayList1 - list of scalar arrays pertaining to fiberArray1
+        scalarArrayList2 - list of scalar arrays pertaining to fiberArray2, in
+                           the same order as scalarArrayList1
+        scalarWeightList - list of weights, geometry first followed by scalars
+        sigma - list of kernel widths, geometry first followed by scalars
+        k - number of most similar fibers to return
+        chunk_size - maximum number of fibers of fiberArray1 processed per
+                     block
+        n_jobs - number of processes/threads (defaults to use all available
+                 resources)
+
+    OUTPUT:
+        similarity - weighted similarity to most similar fibers; shape (N,) if
+                     k is 1, otherwise (N, k)
+        label - indices of most similar fibers in fiberArray2; same shape as
+                similarity
+    """
+    fiberArray1 = flatFibers(fiberArray1)
+    fiberArray2 = flatFibers(fiberArray2)
+
+    scalarArrayList1 = [np.asarray(scalarArray, dtype=np.float32)
+                        for scalarArray in scalarArrayList1]
+    scalarArrayList2 = [np.asarray(scalarArray, dtype=np.float32)
+                        for scalarArray in scalarArrayList2]
+
+    if len(scalarArrayList1) != len(scalarArrayList2):
+        raise ValueError("Scalar data provided for both groups do not match!")
+
+    similarity, label = _priorTopK(partial(weightedScore, fiberArray1,
+                                          fiberArray2, scalarArrayList1,
+                                          scalarArrayList2, scalarWeightList,
+                                          sigma),
+                                   fiberArray1.shape[0], fiberArray2.shape[0],
+                                   k=k, chunk_size=chunk_size,
+                                   pair_bytes=fiberArray1[0].nbytes,
+                                   n_jobs=n_jobs)
+
+    if k == 1:
+        return similarity[:, 0], label[:, 0]
+    else:
+        return similarity, label
+
+def _priorTopK(scoreFn, no_of_fibers1, no_of_fibers2, k=1, chunk_size=128,
+               prior_chunk_size=2048, pair_bytes=240, max_bytes=2**30,
+               n_jobs=-1):
+    """ *INTERNAL FUNCTION*
+    Streams over blocks of two groups of fibers, keeping the k highest scores
+    and corresponding indices for each fiber of the first group. Blocks are
+    shrunk such that blocks of all threads together hold at most max_bytes.
+
+    INPUT:
+        scoreFn - function returning block of scores given (i0, i1, j0, j1)
+                  ranges of both groups; higher is more similar
+        no_of_fibers1 - number of fibers in first group
+        no_of_fibers2 - number of fibers in second group
+        k - number of highest scores to keep
+        chunk_size - maximum number of fibers of first group per block
+        prior_chunk_size - maximum number of fibers of second group per block
+        pair_bytes - memory of intermediates per pair of fibers compared (ie.
+                     differences of sample points)
+        max_bytes - maximum memory of blocks compared at once by all threads
+        n_jobs - number of processes/threads (defaults to use all available
+                 resources)
+
+    OUTPUT:
+        topScore - k highest scores for each fiber in descending order
+        topIdx - indices of fibers of second group with highest scores
+    """
+    k = min(k, no_of_fibers2)
+
+    # Memory of each thread's block bounded by its share of max_bytes
+    n_threads = max(min(effective_n_jobs(n_jobs), no_of_fibers1), 1)
+    max_pairs = max(max_bytes // (pair_bytes * n_threads), 1)
+    prior_chunk_size = int(np.clip(max_pairs // chunk_size, 1,
+                                   prior_chunk_size))
+    chunk_size = int(np.clip(max_pairs // prior_chunk_size, 1, chunk_size))
+
+    topk = Parallel(n_jobs=n_jobs, backend='threading')(
+        delayed(_priorTopK_chunk)(scoreFn, i0, min(i0 + chunk_size,
+                                  no_of_fibers1), no_of_fibers2, k,
+                                  prior_chunk_size)
+        for i0 in range(0, no_of_fibers1, chunk_size))
+
+    topScore = np.concatenate([chunk[0] for chunk in topk], axis=0)
+    topIdx = np.concatenate([chunk[1] for chunk in topk], axis=0)
+
+    return topScore, topIdx
+
+def _priorTopK_chunk(scoreFn, i0, i1, no_of_fibers2, k, prior_chunk_size):
+    """ *INTERNAL FUNCTION*
+    Computes running top-k of a single block of fibers.
+
+    INPUT:
+        scoreFn - function returning block of scores
+        i0, i1 - range of fibers in first group
+        no_of_fibers2 - number of fibers in second group
+        k - number of highest scores to keep
+        prior_chunk_size - number of fibers of second group per block
+
+    OUTPUT:
+        topScore - k highest scores for each fiber in descending order
+        topIdx - indices of fibers of second group with highest scores
+    """
+    topScore = np.empty((i1 - i0, 0), dtype=np.float32)
+    topIdx = np.empty((i1 - i0, 0), dtype=int)
+
+    for j0 in range(0, no_of_fibers2, prior_chunk_size):
+        j1 = min(j0 + prior_chunk_size, no_of_fibers2)
+
+        score = np.concatenate((topScore, scoreFn(i0, i1, j0, j1)), axis=1)
+        idx = np.concatenate((topIdx, np.broadcast_to(np.arange(j0, j1),
+                             (i1 - i0, j1 - j0))), axis=1)
+
+        if score.shape[1] > k:
+            keep = np.argpartition(-score, k - 1, axis=1)[:, :k]
+            score = np.take_along_axis(score, keep, axis=1)
+            idx = np.take_along_axis(idx, keep, axis=1)
+
+        topScore, topIdx = score, idx
+
+    order = np.argsort(-topScore, axis=1, kind='mergesort')
+
+    return np.take_along_axis(topScore, order, axis=1), \
+        np.take_along_axis(topIdx, order, axis=1)
+
+def geoScore(fiberArray1, fiberArray2, i0, i1, j0, j1):
+    """
+    Computes negative minimum MDF distance of both orientations between
+    blocks of two groups of fibers.
+
+    INPUT:
+        fiberArray1 - array of fibers of shape (N, pts_per_fiber, 3)
+        fiberArray2 - array of fibers of shape (M, pts_per_fiber, 3)
+        i0, i1 - range of fibers of first group
+        j0, j1 - range of fibers of second group
+
+    OUTPUT:
+        score - block of scores of shape (i1 - i0, j1 - j0); higher is more
+                similar
+    """
+    fiberBlock1 = fiberArray1[i0:i1, None]
+    fiberBlock2 = fiberArray2[None, j0:j1]
+
+    return -np.minimum(calcMDF(fiberBlock1, fiberBlock2),
+                       calcMDF(fiberBlock1[:, :, ::-1], fiberBlock2))
+
+def _scalarScore(fiberScalarArray1, fiberScalarArray2, i0, i1, j0, j1):
+    """ *INTERNAL FUNCTION*
+    Negative minimum scalar distance of both orientations between blocks of
+    fibers of shape (N, pts_per_fiber)
+    """
+    scalarBlock1 = fiberScalarArray1[i0:i1, None]
+    scalarBlock2 = fiberScalarArray2[None, j0:j1]
+
+    return -np.minimum(_calcScalarDist(scalarBlock1, scalarBlock2),
+                       _calcScalarDist(scalarBlock1[:, :, ::-1], scalarBlock2))
+
+def weightedScore(fiberArray1, fiberArray2, scalarArrayList1,
+                  scalarArrayList2, scalarWeightList, sigma, i0, i1, j0, j1):
+    """
+    Computes weighted similarity between blocks of two groups of fibers,
+    combining geometry and scalar information. Scalar distances are computed
+    in the orientation providing the smallest geometric distance. Weights
+    are expected to be validated (see checkWeights).
+
+    INPUT:
+        fiberArray1 - array of fibers of shape (N, pts_per_fiber, 3)
+        fiberArray2 - array of fibers of shape (M, pts_per_fiber, 3)
+        scalarArrayList1 - list of scalar arrays pertaining to fiberArray1
+        scalarArrayList2 - list of scalar arrays pertaining to fiberArray2
+        scalarWeightList - list of weights, geometry first followed by scalars
+        sigma - list of kernel widths, geometry first followed by scalars
+        i0, i1 - range of fibers of first group
+        j0, j1 - range of fibers of second group
+
+    OUTPUT:
+        score - block of similarities of shape (i1 - i0, j1 - j0)
+    """
+    fiberBlock1 = fiberArray1[i0:i1, None]
+    fiberBlock2 = fiberArray2[None, j0:j1]
+
+    geoDist = calcMDF(fiberBlock1, fiberBlock2)
+    flipDist = calcMDF(fiberBlock1[:, :, ::-1], fiberBlock2)
+    flip = flipDist < geoDist
+
+    score = scalarWeightList[0] * \
+        gausKernel_similarity(np.minimum(geoDist, flipDist), sigma[0])
+
+    for i in range(len(scalarArrayList1)):
+        scalarBlock1 = scalarArrayList1[i][i0:i1, None]
+        scalarBlock2 = scalarArrayList2[i][None, j0:j1]
+
+        qDist = np.where(flip,
+                         _calcScalarDist(scalarBlock1[:, :, ::-1],
+                                         scalarBlock2),
+                         _calcScalarDist(scalarBlock1, scalarBlock2))
+        score += scalarWeightList[i+1] * \
+            gausKernel_similarity(qDist, sigma[i+1])
+
+    return score
+
+def _calcScalarDist(fiberScalarArray1, fiberScalarArray2):
+    """ *INTERNAL FUNCTION*
+    Computes average absolute difference of scalar values between
+    broadcastable arrays of shape (..., pts_per_fiber)
+    """
+    return np.mean(np.abs(fiberScalarArray1 - fiberScalarArray2), axis=-1)
+
+class FiberIndex:
+    """
+    Spatial index over a group of (prior) fibers used to find the most similar
+    fibers of another group without computing the full distance matrix.
+    Centroids of fibers, which do not depend on orientation, are inserted into
+    a KD-tree. As the distance between centroids of two fibers bounds their
+    minimum average Euclidean (MDF) distance from below, fibers with nearest
+    centroids are compared until no other fiber can be closer. Queries return
+    the exact MDF distance.
+
+    The number of queried fibers and those requiring more than the initial
+    candidates (fallbacks) are counted in no_of_queries and no_of_fallbacks.
+    """
+
+    def __init__(self, fiberArray, leafsize=16):
+        """
+        Builds the index.
+
+        INPUT:
+            fiberArray - group of fibers to index; tuple / array of "x", "y"
+                         and "z" components as returned by getFibers
+            leafsize - number of points at which KD-tree switches to brute
+                       force
+
+        OUTPUT:
+            none
+        """
+        fiberArray = flatFibers(fiberArray)
+
+        self.no_of_fibers = fiberArray.shape[0]
+        self.pts_per_fiber = fiberArray.shape[1]
+
+        # Fibers in both orientations
+        self.fiberArray = np.concatenate((fiberArray,
+                                          fiberArray[:, ::-1, :]), axis=0)
+        self.kdTree = cKDTree(fiberArray.mean(axis=1), leafsize=leafsize)
+
+        self.no_of_queries = 0
+        self.no_of_fallbacks = 0
+
+    def query(self, fiberArray, k=1, n_candidates=32, chunk_size=4096,
+              max_pairs=65536, n_jobs=-1):
+        """
+        Finds the k most similar indexed fibers for each fiber provided.
+
+        The n_candidates fibers with nearest centroids are compared by MDF
+        distance. Where the k-th smallest MDF distance exceeds the distance to
+        the furthest candidate centroid, another fiber may be closer and all
+        fibers with centroids within the k-th smallest MDF distance are
+        compared instead (fallback), such that returned matches are exact.
+
+        INPUT:
+            fiberArray - group of fibers to query; tuple / array of "x", "y"
+                         and "z" components as returned by getFibers
+            k - number of most similar fibers to return
+            n_candidates - number of candidates compared per fiber prior to
+                           fallback
+            chunk_size - number of fibers queried at once
+            max_pairs - maximum number of fiber pairs compared at once
+            n_jobs - number of processes/threads (defaults to use all
+                     available resources)
+
+        OUTPUT:
+            distance - MDF distance to most similar fibers; shape (N,) if k is
+                       1, otherwise (N, k)
+            label - indices of most similar indexed fibers; same shape as
+                    distance
+        """
+        fiberArray = flatFibers(fiberArray)
+
+        if fiberArray.shape[1] != self.pts_per_fiber:
+            raise ValueError("Number of samples along fibers do not match!")
+
+        k = min(k, self.no_of_fibers)
+        n_candidates = min(max(n_candidates, k), self.no_of_fibers)
+
+        distance = np.empty((fiberArray.shape[0], k), dtype=np.float32)
+        label = np.empty((fiberArray.shape[0], k), dtype=int)
+
+        for start in range(0, fiberArray.shape[0], chunk_size):
+            chunk = fiberArray[start:start + chunk_size]
+            centroids = chunk.mean(axis=1)
+
+            centroidDist, candIdx = _kdQuery(self.kdTree, centroids,
+                                             n_candidates, n_jobs)
+            centroidDist = centroidDist.reshape(chunk.shape[0], -1)
+            candIdx = candIdx.reshape(chunk.shape[0], -1)
+
+            rowIdx = np.repeat(np.arange(chunk.shape[0]), n_candidates)
+            chunkDist, chunkLabel = self._rowTopk(chunk, rowIdx,
+                                                  candIdx.reshape(-1), k,
+                                                  max_pairs, n_jobs)
+
+            # Fibers outside of the candidates are at least this far away
+            flagged = np.where(centroidDist[:, -1] < chunkDist[:, -1])[0]
+            if n_candidates < self.no_of_fibers and len(flagged) > 0:
+                balls = _kdBallQuery(self.kdTree, centroids[flagged],
+                                     chunkDist[flagged, -1] * (1 + 1e-5),
+                                     n_jobs)
+                ballCount = np.array([len(ball) for ball in balls], dtype=int)
+                ballIdx = np.concatenate([np.asarray(ball, dtype=int)
+                                          for ball in balls])
+                rowIdx = np.repeat(np.arange(len(flagged)), ballCount)
+                chunkDist[flagged], chunkLabel[flagged] = \
+                    self._rowTopk(chunk[flagged], rowIdx, ballIdx, k,
+                                  max_pairs, n_jobs)
+            else:
+                flagged = []
+
+            self.no_of_queries += chunk.shape[0]
+            self.no_of_fallbacks += len(flagged)
+
+            distance[start:start + chunk.shape[0]] = chunkDist
+            label[start:start + chunk.shape[0]] = chunkLabel
+
+        if k == 1:
+            return distance[:, 0], label[:, 0]
+        else:
+            return distance, label
+
+    def _rowTopk(self, fiberArray, rowIdx, fiberIdx, k, max_pairs=65536,
+                 n_jobs=-1):
+        """ *INTERNAL FUNCTION*
+        Selects the k most similar of indexed fibers paired with each queried
+        fiber, comparing pairs in blocks of at most max_pairs.
+
+        INPUT:
+            fiberArray - array of queried fibers of shape (N, pts_per_fiber, 3)
+            rowIdx - index of queried fiber of each pair, in ascending order
+            fiberIdx - index of indexed fiber of each pair
+            k - number of fibers to return
+            max_pairs - maximum number of fiber pairs compared at once
+            n_jobs - number of processes/threads (defaults to use all
+                     available resources)
+
+        OUTPUT:
+            topDist - distance to k most similar fibers of shape (N, k)
+            topIdx - indices of k most similar fibers of shape (N, k)
+        """
+        pairDist = Parallel(n_jobs=n_jobs, backend='threading')(
+            delayed(self._pairDist)(fiberArray, rowIdx[i:i + max_pairs],
+                                    fiberIdx[i:i + max_pairs])
+            for i in range(0, len(rowIdx), max_pairs))
+        pairDist = np.concatenate(pairDist) if pairDist else \
+            np.empty(0, dtype=np.float32)
+
+        # Rank of fibers by distance within rows
+        order = np.lexsort((pairDist, rowIdx))
+        rows = rowIdx[order]
+        rowStart = np.searchsorted(rows, np.arange(fiberArray.shape[0]))
+        rank = np.arange(len(order)) - rowStart[rows]
+        keep = rank < k
+
+        topDist = np.full((fiberArray.shape[0], k), np.inf, dtype=np.float32)
+        topIdx = np.zeros((fiberArray.shape[0], k), dtype=int)
+        topDist[rows[keep], rank[keep]] = pairDist[order[keep]]
+        topIdx[rows[keep], rank[keep]] = fiberIdx[order[keep]]
+
+        return topDist, topIdx
+
+    def _pairDist(self, fiberArray, rowIdx, fiberIdx):
+        """ *INTERNAL FUNCTION*
+        Minimum MDF distance of both orientations between pairs of queried
+        and indexed fibers.
+        """
+        rowFibers = fiberArray[rowIdx]
+
+        return np.minimum(calcMDF(rowFibers, self.fiberArray[fiberIdx]),
+                          calcMDF(rowFibers, self.fiberArray[
+                                                 fiberIdx + self.no_of_fibers]))
+
+def flatFibers(fiberArray):
+    """
+    Reorders fiber components (ie. from FiberTree.getFibers) for per-fiber
+    access.
+
+    INPUT:
+        fiberArray - tuple / array of "x", "y" and "z" components of fibers
+
+    OUTPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+    """
+    fiberArray = np.asarray(fiberArray, dtype=np.float32)
+
+    return np.ascontiguousarray(np.transpose(fiberArray, (1, 2, 0)))
+
+def calcMDF(fiberArray1, fiberArray2):
+    """
+    Computes average Euclidean distance of sample points between broadcastable
+    arrays of fibers of shape (..., pts_per_fiber, 3)
+
+    INPUT:
+        fiberArray1 - array of fibers
+        fiberArray2 - array of fibers for comparison
+
+    OUTPUT:
+        Average Euclidean distance of sample points
+    """
+    return np.mean(np.sqrt(np.sum(np.square(fiberArray1 - fiberArray2),
+                                  axis=-1)), axis=-1)
+
+def _kdQuery(kdTree, x, k, n_jobs=-1):
+    """ *INTERNAL FUNCTION*
+    Queries k nearest neighbours of KD-tree across SciPy versions.
+    """
+    try:
+        return kdTree.query(x, k=k, workers=n_jobs)
+    except TypeError:
+        return kdTree.query(x, k=k, n_jobs=n_jobs)
+
+def _kdBallQuery(kdTree, x, r, n_jobs=-1):
+    """ *INTERNAL FUNCTION*
+    Queries neighbours within radius of KD-tree across SciPy versions. A
+    radius may be given for each point.
+    """
+    try:
+        return kdTree.query_ball_point(x, r, workers=n_jobs)
+    except TypeError:
+        pass
+
+    # Older SciPy versions take a single radius
+    if np.ndim(r) == 0:
+        return kdTree.query_ball_point(x, r, n_jobs=n_jobs)
+
+    return [kdTree.query_ball_point(xi, ri, n_jobs=n_jobs)
+            for xi, ri in zip(x, r)]
+
 def gausKernel_similarity(distance, sigma):
     """
     Computes the similarity using a Gaussian (RBF) kernel.
@@ -7,8 +7,8 @@ information.
 
 import numpy as np
 import vtk
-from collections import defaultdict
-from . import misc
+from collections import defaultdict, OrderedDict
+from . import misc, tractio
 
 def tree():
     """
@@ -48,6 +48,65 @@ def convertFromTuple(fiberTuple):
 
     return fiberTree
 
+def resamplePolyData(inputVTK, pts_per_fiber=20):
+    """
+    Resamples tractography to a fixed number of points along each fiber,
+    retaining data stored per fiber.
+
+    INPUT:
+        inputVTK - tractography polydata (vtkPolyData or tractio.PolyData)
+        pts_per_fiber - number of points to sample along a fiber
+
+    OUTPUT:
+        outVTK - resampled tractography polydata of class tractio.PolyData
+    """
+    if not isinstance(inputVTK, tractio.PolyData):
+        inputVTK = tractio.polyDataFromVTK(inputVTK)
+
+    no_of_fibers = inputVTK.getNumberOfLines()
+    ptIdx = _calcPointIndices(inputVTK, pts_per_fiber, no_of_fibers)
+
+    outVTK = tractio.PolyData(
+        points=inputVTK.points[ptIdx.ravel()].astype(np.float32),
+        offsets=np.arange(no_of_fibers + 1, dtype=np.int64) * pts_per_fiber,
+        connectivity=np.arange(no_of_fibers * pts_per_fiber, dtype=np.int64))
+    outVTK.cellData.update(inputVTK.cellData)
+
+    return outVTK
+
+def _calcPointIndices(inputVTK, pts_per_fiber, no_of_fibers):
+    """ *INTERNAL FUNCTION*
+    Determine indices of points to traverse data along each fiber.
+
+    Indices include both end points of the fiber plus evenly spaced points
+    along the line, rounded to the nearest point. Module determines which
+    indices are wanted based on fiber length and desired number of points
+    along the length.
+
+    INPUT:
+        inputVTK - tractography polydata (vtkPolyData or tractio.PolyData)
+        pts_per_fiber - number of desired points along fiber
+        no_of_fibers - number of fibers to traverse
+
+    OUTPUT:
+        ptIdx - array of point indices for each fiber and sample
+    """
+
+    if not isinstance(inputVTK, tractio.PolyData):
+        inputVTK = tractio.polyDataFromVTK(inputVTK)
+
+    offsets = inputVTK.offsets[:no_of_fibers + 1]
+    fiberLength = np.diff(offsets)
+
+    # Step length between points along fiber
+    stepLength = (fiberLength - 1.0) / (pts_per_fiber - 1.0)
+
+    # Output indices along fiber
+    lineIdx = np.arange(pts_per_fiber)[None, :] * stepLength[:, None]
+    lineIdx = np.round(lineIdx).astype(np.int64)
+
+    return inputVTK.connectivity[offsets[:-1, None] + lineIdx]
+
 def calcEndPointSep(fiberData, rejIdx):
     """
     Calculates distance between end points
@@ -97,28 +156,13 @@ def calcFiberLength(fiberData, rejIdx=[]):
         print("Not enough samples to determine length of fiber")
         raise ValueError
 
-    LArray = []
-
-    fidxes = [i for i in range(fiberData.no_of_fibers)]
-    for i in rejIdx:
-        del fidxes[i]
-
-    for fidx in fidxes:
-        L = 0
-
-        for idx in range(1, no_of_pts):
-            x1 = fiberData.fiberTree[fidx][idx]['x']
-            x2 = fiberData.fiberTree[fidx][idx - 1]['x']
-            y1 = fiberData.fiberTree[fidx][idx]['y']
-            y2 = fiberData.fiberTree[fidx][idx - 1]['y']
-            z1 = fiberData.fiberTree[fidx][idx]['z']
-            z2 = fiberData.fiberTree[fidx][idx - 1]['z']
-
-            L = L + np.sqrt((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2)
-
-        LArray.append(L)
+    fiberArray = np.stack(fiberData.getFibers(range(fiberData.no_of_fibers)),
+                          axis=-1)
+    fiberArray = np.delete(fiberArray,
+                           np.asarray(rejIdx, dtype=np.int64).reshape(-1),
+                           axis=0)
 
-    return LArray
+    return np.sum(np.linalg.norm(np.diff(fiberArray, axis=1), axis=2), axis=1)
 
 def addLDRatio(DArray, LArray, polyData):
     """
@@ -142,6 +186,76 @@ def addLDRatio(DArray, LArray, polyData):
 
     polyData.GetCellData().AddArray(LDScalar)
 
+class ClusterIndex:
+    """
+    Index of fiber membership of each cluster. Fiber indices are grouped by
+    cluster label via a stable sort, such that members of each cluster are a
+    contiguous slice (in fiber index order) between consecutive offsets.
+    Value returned is of class ClusterIndex
+    """
+
+    def __init__(self, clusterLabels):
+        clusterLabels = np.asarray(clusterLabels).reshape(-1)
+
+        # Info related to clusters
+        self.no_of_fibers = len(clusterLabels)
+        self.order = np.argsort(clusterLabels, kind='stable')
+        self.labels, self.inverse, self.counts = np.unique(
+            clusterLabels, return_inverse=True, return_counts=True)
+        self.inverse = self.inverse.reshape(-1)
+        self.offsets = np.zeros(len(self.labels) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.counts)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        for i in range(len(self.labels)):
+            yield self.labels[i], self.order[self.offsets[i]:
+                                             self.offsets[i + 1]]
+
+    def getLabelIdx(self, label):
+        """
+        Finds position of a cluster label within the index.
+
+        INPUT:
+            label - cluster label
+
+        OUTPUT:
+            lidx - position of cluster within labels, counts and offsets
+        """
+        lidx = int(np.searchsorted(self.labels, label))
+        if lidx == len(self.labels) or self.labels[lidx] != label:
+            raise KeyError("Cluster %s not in index" % str(label))
+
+        return lidx
+
+    def getMembers(self, label):
+        """
+        Extracts indices of fibers belonging to a cluster.
+
+        INPUT:
+            label - cluster label
+
+        OUTPUT:
+            fidxes - array of fiber indices of cluster, in ascending order
+        """
+        lidx = self.getLabelIdx(label)
+
+        return self.order[self.offsets[lidx]:self.offsets[lidx + 1]]
+
+    def getCount(self, label):
+        """
+        Returns number of fibers belonging to a cluster.
+
+        INPUT:
+            label - cluster label
+
+        OUTPUT:
+            count - number of fibers of cluster
+        """
+        return int(self.counts[self.getLabelIdx(label)])
+
 class FiberTree:
     """
     Data pertaining to a group of fibers.
@@ -154,31 +268,22 @@ class FiberTree:
         # Info related to fibers
         self.no_of_fibers = None
         self.pts_per_fiber = None
+        self.clusterIndex = None
 
-    def _calc_fiber_indices(self, fiberLength, pts_per_fiber):
+    def _calc_point_indices(self, inputVTK, pts_per_fiber):
         """ *INTERNAL FUNCTION*
-        Determine indices to traverse data along a fiber.
-
-        Indices include both end points of the fiber plus evenly spaced points
-        along the line. Module determines which indices are wanted based on
-        fiber length and desired number of points along the length.
+        Determine indices of points to traverse data along each fiber of the
+        tree.
 
         INPUT:
-            fiberLength - number of points along a fiber
+            inputVTK - tractography polydata (vtkPolyData or tractio.PolyData)
             pts_per_fiber - number of desired points along fiber
 
         OUTPUT:
-            idxList - corresponding new indices to traverse along fiber
+            ptIdx - array of point indices for each fiber and sample
         """
 
-        # Step length between points along fiber
-        stepLength = (fiberLength - 1.0) / (pts_per_fiber - 1.0)
-
-        # Output indices along fiber
-        idxList = []
-        for idx in range(0, pts_per_fiber):
-            idxList.append(idx * stepLength)
-        return idxList
+        return _calcPointIndices(inputVTK, pts_per_fiber, self.no_of_fibers)
 
     def getFiber(self, fiberIdx):
         """
@@ -261,12 +366,10 @@ class FiberTree:
             none
         """
 
-        uniqueLabels = np.unique(clusterLabels, return_counts=False)
+        self.clusterIndex = ClusterIndex(clusterLabels)
 
-        for label in uniqueLabels:
-            for fidx in np.where(clusterLabels == label)[0]:
-                self.fiberTree[fidx][str(label)] = label
-                self.fiberTree['centroid'][label] = centroids[label]
+        for label in self.clusterIndex.labels:
+            self.fiberTree['centroid'][label] = centroids[label]
 
     def copyScalar(self, fiberData, scalarTypeArray, fidxes=[], rejIdx=[]):
         """ * INTERNAL FUNCTION *
@@ -310,6 +413,7 @@ class FiberTree:
                         self.fiberTree[idx][pidx][Type] = float(fiberData.fiberTree[fidx][pidx][Type])
                     idx += 1
 
+    @misc.profiled('fibers.addScalar')
     def addScalar(self, inputVTK, scalarData, scalarType, pts_per_fiber=20):
         """
         Add scalar information pertaining to tractography. Values are
@@ -317,7 +421,8 @@ class FiberTree:
         quantitative measurements as needed.
 
         INPUT:
-            inputVTK - tractography polydata to extract corresponding indices
+            inputVTK - tractography polydata (vtkPolyData or tractio.PolyData)
+                       to extract corresponding indices
             scalarData - list of scalar values to be stored
             scalarType - type of quantitative scalar (ie. FA, T1)
             pts_per_fiber - number of samples to take along fiber
@@ -325,24 +430,13 @@ class FiberTree:
         OUTPUT:
             none
         """
-        inputVTK.GetLines().InitTraversal()
-        ptIds = vtk.vtkIdList()
+        ptIdx = self._calc_point_indices(inputVTK, pts_per_fiber)
+        scalarData = np.asarray(scalarData, dtype=float)[ptIdx]
 
         # Loop over all fibers
         for fidx in range(0, self.no_of_fibers):
-            inputVTK.GetLines().GetNextCell(ptIds)
-            fiberLength = ptIds.GetNumberOfIds()
-
-            # Loop over pts for ea. fiber
-            pidx = 0
-            lineIdx = self._calc_fiber_indices(fiberLength, pts_per_fiber)
-            lineIdx = [int(round(idx)) for idx in lineIdx]
-
-            for idx in lineIdx:
-                # Find point index
-                tidx = int(ptIds.GetId(idx))
-                self.fiberTree[fidx][pidx][scalarType] = float(scalarData[tidx])
-                pidx += 1
+            for pidx in range(0, pts_per_fiber):
+                self.fiberTree[fidx][pidx][scalarType] = scalarData[fidx][pidx]
 
     def getScalar(self, fidx, scalarType):
         """
@@ -390,12 +484,13 @@ class FiberTree:
 
         return scalarList
 
+    @misc.profiled('fibers.convertFromVTK')
     def convertFromVTK(self, inputVTK, pts_per_fiber=20, verbose=0):
         """
         Convert input tractography VTK data to array form
 
         INPUT:
-            inputVTK - tractography polydata
+            inputVTK - tractography polydata (vtkPolyData or tractio.PolyData)
             pts_per_fiber - number of points to sample along a fiber
             verbose - verbosity of function; 1 to print messages to user.
 
@@ -403,7 +498,10 @@ class FiberTree:
             none
         """
 
-        self.no_of_fibers = inputVTK.GetNumberOfLines()
+        if not isinstance(inputVTK, tractio.PolyData):
+            inputVTK = tractio.polyDataFromVTK(inputVTK)
+
+        self.no_of_fibers = inputVTK.getNumberOfLines()
         self.pts_per_fiber = pts_per_fiber
 
         misc.vprint("Converting polydata to array representation.", verbose)
@@ -411,29 +509,18 @@ class FiberTree:
         misc.vprint("Points sampled along fiber: %d" % int(self.pts_per_fiber),
                      verbose)
 
-        # Loop over all fibers
-        inputVTK.GetLines().InitTraversal()
-        inputPts = inputVTK.GetPoints()
-        ptIds = vtk.vtkIdList()
+        # Perform NN interpolation
+        ptIdx = self._calc_point_indices(inputVTK, self.pts_per_fiber)
+        fiberPts = inputVTK.points[ptIdx].astype(float)
 
+        # Loop over all fibers
         for fidx in range(0, self.no_of_fibers):
-            inputVTK.GetLines().GetNextCell(ptIds)
-            fiberLength = ptIds.GetNumberOfIds()
-
-            # Loop over pts for ea. fiber
-            pidx = 0
-            lineIdx = self._calc_fiber_indices(fiberLength, self.pts_per_fiber)
-            lineIdx = [int(round(idx)) for idx in lineIdx]
-
-            for idx in lineIdx:
-                # Perform NN interpolation
-                tidx = int(ptIds.GetId(idx))
-                self.fiberTree[fidx][pidx]['x'] = inputPts.GetPoint(tidx)[0]
-                self.fiberTree[fidx][pidx]['y'] = inputPts.GetPoint(tidx)[1]
-                self.fiberTree[fidx][pidx]['z'] = inputPts.GetPoint(tidx)[2]
-                pidx += 1
-
-            # Sanity check message + remove copied points (for memory purposes)
+            for pidx in range(0, self.pts_per_fiber):
+                self.fiberTree[fidx][pidx]['x'] = fiberPts[fidx][pidx][0]
+                self.fiberTree[fidx][pidx]['y'] = fiberPts[fidx][pidx][1]
+                self.fiberTree[fidx][pidx]['z'] = fiberPts[fidx][pidx][2]
+
+            # Sanity check message
             if (fidx > 0) and ((fidx % 25000) == 0):
                 misc.vprint("...", verbose)
 
@@ -476,3 +563,109 @@ class FiberTree:
         outVTK.SetPoints(outPts)
 
         return outVTK
+
+class FiberArray(FiberTree):
+    """
+    Data pertaining to a group of fibers stored as arrays (ie. memory-mapped
+    arrays of a shared prior store). Fibers and scalars are extracted from
+    the arrays when requested, instead of being stored per point in a tree.
+    Arrays are not copied and should not be modified.
+    Value returned is of class FiberArray
+    """
+
+    def __init__(self, fiberArray, scalarArrays=None):
+        """
+        INPUT:
+            fiberArray - array of "x", "y" and "z" spatial components of
+                         shape (3, no_of_fibers, pts_per_fiber)
+            scalarArrays - dictionary of arrays of scalar values of shape
+                           (no_of_fibers, pts_per_fiber), keyed by scalar
+                           type; defaults None
+        """
+        FiberTree.__init__(self)
+
+        self.fiberArray = fiberArray
+        self.scalarArrays = OrderedDict(scalarArrays or [])
+
+        # Info related to fibers
+        self.no_of_fibers, self.pts_per_fiber = fiberArray.shape[1:]
+
+    def getFiber(self, fiberIdx):
+        """
+        Extract a single fiber from the group with corresponding data.
+
+        INPUT:
+            fiberIdx - index of fiber to be extracted
+
+        OUTPUT
+            fiber_x - array of "x" spatial component at each sample
+            fiber_y - array of "y" spatial component at each sample
+            fiber_z - array of "z" spatial component at each sample
+        """
+        fiber = np.asarray(self.fiberArray[:, fiberIdx], dtype=float)
+
+        return fiber[0], fiber[1], fiber[2]
+
+    def getFibers(self, fidxes, rejIdx=[]):
+        """
+        Extracts a subset of fibers corresponding to inputted indices.
+
+        INPUT:
+            fidxes - Indices of subset of fibers to be extracted
+            rejIdx - indices of fibers to be excluded, in descending order;
+                     defaults to []
+
+        OUTPUT:
+            fiberArray_x - array of "x" spatial component at each sample for
+                           fiber bundle
+            fiberArray_y - array of "y" spatial component at each sample for
+                           fiber bundle
+            fiberArray_z - array of "z" spatial component at each sample for
+                           fiber bundle
+        """
+        fidxes = list(fidxes)
+
+        for i in rejIdx:
+            if i > (len(fidxes) - 1):
+                continue
+            else:
+                del fidxes[i]
+
+        fiberArray = np.asarray(
+            self.fiberArray[:, np.asarray(fidxes, dtype=int)], dtype=float)
+
+        return fiberArray[0], fiberArray[1], fiberArray[2]
+
+    def getScalar(self, fidx, scalarType):
+        """
+        Extracts scalar information of a specified scalarType pertaining to
+        a single fiber.
+
+        INPUT:
+            fidx - index corresponding to fiber to extract scalar information
+            scalarType - type of quantitative scalar (ie. FA, T1)
+
+        OUTPUT:
+            scalarList - list of scalar values indexed by point
+        """
+
+        return np.asarray(self.scalarArrays[str(scalarType)][fidx],
+                          dtype=float)
+
+    def getScalars(self, fidxes, scalarType):
+        """
+        Extracts scalar information of a specified scalarType pertaining to
+        a group of fibers.
+
+        INPUT:
+            fidxes - indices corresponding to fibers to extract scalar
+                     information from
+            scalarType - type of quantitative scalar (ie. FA, T1)
+
+        OUTPUT:
+            scalarList - list of scalar values indexed by fiber and point
+        """
+
+        return np.asarray(self.scalarArrays[str(scalarType)][
+            np.asarray(list(fidxes), dtype=int)], dtype=float).reshape(
+                -1, self.pts_per_fiber)
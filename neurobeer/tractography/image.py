@@ -0,0 +1,278 @@
+""" image.py
+
+Module containing functions relating tractography to volumetric (nifti)
+images.
+
+"""
+
+import numpy as np
+from scipy.ndimage import map_coordinates
+from . import misc
+
+def loadImage(img, dtype=np.float32):
+    """
+    Loads a nifti image, returning its data and affine.
+
+    INPUT:
+        img - path to nifti image or loaded nibabel image
+        dtype - data type of returned data; defaults np.float32
+
+    OUTPUT:
+        imgData - array of image data
+        affine - 4x4 voxel to world (RAS+ mm) affine of image
+    """
+    import nibabel as nib
+
+    if not hasattr(img, 'affine'):
+        img = nib.load(img)
+
+    imgData = np.asarray(img.get_fdata(dtype=dtype))
+
+    return imgData, img.affine
+
+def worldToVoxel(points, affine):
+    """
+    Maps points in world (RAS+ mm) coordinates to continuous voxel
+    coordinates of an image.
+
+    INPUT:
+        points - array of points (N x 3) in world coordinates
+        affine - 4x4 voxel to world affine of image
+
+    OUTPUT:
+        voxels - array of voxel coordinates (N x 3)
+    """
+    invAffine = np.linalg.inv(affine)
+
+    return np.dot(points, invAffine[:3, :3].T) + invAffine[:3, 3]
+
+def applyAffine(points, affine):
+    """
+    Applies a 4x4 affine transformation to points.
+
+    INPUT:
+        points - array of points (N x 3)
+        affine - 4x4 affine transformation
+
+    OUTPUT:
+        xfmPoints - array of transformed points (N x 3)
+    """
+    affine = np.asarray(affine, dtype=np.float64)
+
+    return np.dot(points, affine[:3, :3].T) + affine[:3, 3]
+
+def applyWarp(points, warpData, warpAffine, order=1):
+    """
+    Applies a displacement field to points in world (RAS+ mm) coordinates.
+    Displacements are interpolated at each point within the grid of the
+    field.
+
+    INPUT:
+        points - array of points (N x 3) in world coordinates
+        warpData - array of displacement field (X x Y x Z x 3), with
+                   displacements in world coordinates
+        warpAffine - 4x4 voxel to world affine of displacement field
+        order - order of interpolation; defaults 1 (trilinear)
+
+    OUTPUT:
+        xfmPoints - array of displaced points (N x 3)
+    """
+    warpData = warpData.reshape(warpData.shape[:3] + (-1,))
+    if warpData.shape[3] != 3:
+        raise ValueError("Displacement field must have 3 components.")
+
+    voxels = worldToVoxel(points, warpAffine)
+
+    return points + sampleImage(warpData, voxels, order)
+
+def sampleImage(imgData, voxels, order=1):
+    """
+    Samples image data at continuous voxel coordinates. Points outside of
+    the image take the value of the nearest voxel.
+
+    INPUT:
+        imgData - array of image data; 4D images are sampled per volume
+        voxels - array of voxel coordinates (N x 3)
+        order - order of interpolation; defaults 1 (trilinear)
+
+    OUTPUT:
+        samples - array of sampled values (N) or (N x volumes)
+    """
+    coords = np.asarray(voxels, dtype=np.float64).T
+
+    if imgData.ndim == 3:
+        return map_coordinates(imgData, coords, order=order, mode='nearest')
+
+    imgData = imgData.reshape(imgData.shape[:3] + (-1,))
+    samples = np.zeros((coords.shape[1], imgData.shape[3]),
+                       dtype=imgData.dtype)
+    for vol in range(imgData.shape[3]):
+        samples[:, vol] = map_coordinates(imgData[..., vol], coords,
+                                          order=order, mode='nearest')
+
+    return samples
+
+def sampleScalars(polyData, scalarImgs, order=1, verbose=0):
+    """
+    Tracks scalar information from images to every point of tractography,
+    interpolating within each image.
+
+    INPUT:
+        polyData - tractography polydata of class tractio.PolyData, with
+                   points in world (RAS+ mm) coordinates
+        scalarImgs - list of nifti images (paths or nibabel images) with
+                     scalars to be tracked
+        order - order of interpolation; defaults 1 (trilinear)
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        scalarDataList - list of arrays of scalar values per point, in order
+                         of images
+    """
+    scalarDataList = []
+    voxels, voxelAffine = None, None
+
+    for scalarImg in scalarImgs:
+        misc.vprint("Tracking scalar to streamlines...", verbose)
+
+        imgData, affine = loadImage(scalarImg)
+
+        # Images sharing a grid reuse voxel coordinates
+        if voxelAffine is None or not np.allclose(affine, voxelAffine):
+            voxels = worldToVoxel(polyData.points, affine)
+            voxelAffine = affine
+
+        scalarData = sampleImage(imgData, voxels, order)
+        scalarDataList.append(scalarData.astype(np.float32))
+
+    return scalarDataList
+
+def voxelize(polyData, shape, affine, step_size=0.1, labels=None,
+             chunk_size=10000, verbose=0):
+    """
+    Voxelizes tractography onto the grid of a reference image. Streamlines
+    are densely resampled at the provided step size and each sample is
+    assigned to its nearest voxel. Streamline counts of clusters are only
+    kept for voxels the cluster passes through.
+
+    INPUT:
+        polyData - tractography polydata of class tractio.PolyData, with
+                   points in world (RAS+ mm) coordinates
+        shape - shape of reference image grid
+        affine - 4x4 voxel to world affine of reference image
+        step_size - distance (mm) between samples along streamlines;
+                    defaults 0.1
+        labels - array of cluster labels per streamline to compute
+                 streamline counts of each cluster; defaults None
+        chunk_size - number of streamlines voxelized at a time; defaults
+                     10000
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        streamlineCount - number of streamlines passing through each voxel
+        clusterCount - dictionary indexed by cluster label of flat indices
+                       of voxels passed through by cluster and streamline
+                       counts of cluster within these voxels; empty if
+                       labels is None
+    """
+    shape = tuple(int(dim) for dim in shape[:3])
+    no_of_voxels = int(np.prod(shape))
+    no_of_fibers = polyData.getNumberOfLines()
+
+    misc.vprint("Voxelizing %d streamlines..." % no_of_fibers, verbose)
+
+    streamlineCount = np.zeros(no_of_voxels, dtype=np.uint32)
+    if labels is not None:
+        clusterLabels, labelIdx = np.unique(np.asarray(labels).reshape(-1),
+                                            return_inverse=True)
+    clusterKeys, clusterCounts = [], []
+
+    for f0 in range(0, no_of_fibers, chunk_size):
+        f1 = min(f0 + chunk_size, no_of_fibers)
+
+        fidxes, points = _resampleStep(polyData, f0, f1, step_size)
+
+        voxels = np.round(worldToVoxel(points, affine)).astype(np.int64)
+        inside = np.all((voxels >= 0) & (voxels < shape), axis=1)
+        fidxes = fidxes[inside]
+        vidxes = np.ravel_multi_index(voxels[inside].T, shape)
+
+        # Count each streamline once per voxel; consecutive samples mostly
+        # fall in the same voxel and are dropped before sorting
+        keys = fidxes * no_of_voxels + vidxes
+        if len(keys) > 0:
+            keys = keys[np.r_[True, keys[1:] != keys[:-1]]]
+        keys = np.unique(keys)
+        fidxes, vidxes = keys // no_of_voxels, keys % no_of_voxels
+
+        streamlineCount += np.bincount(vidxes, minlength=no_of_voxels
+                                       ).astype(np.uint32)
+
+        # Counts of clusters within voxels passed through in chunk
+        if labels is not None:
+            keys, counts = np.unique(labelIdx[fidxes] * no_of_voxels + vidxes,
+                                     return_counts=True)
+            clusterKeys.append(keys)
+            clusterCounts.append(counts)
+
+    clusterCount = {}
+    if labels is not None and len(clusterKeys) > 0:
+        keys, inverse = np.unique(np.concatenate(clusterKeys),
+                                  return_inverse=True)
+        counts = np.bincount(inverse.reshape(-1),
+                             weights=np.concatenate(clusterCounts))
+        bounds = np.searchsorted(keys, np.arange(len(clusterLabels) + 1) *
+                                 no_of_voxels)
+
+        for lidx in range(len(clusterLabels)):
+            if bounds[lidx + 1] > bounds[lidx]:
+                k0, k1 = bounds[lidx], bounds[lidx + 1]
+                clusterCount[clusterLabels[lidx]] = \
+                    (keys[k0:k1] - lidx * no_of_voxels,
+                     counts[k0:k1].astype(np.uint32))
+
+    return streamlineCount.reshape(shape), clusterCount
+
+def _resampleStep(polyData, f0, f1, step_size):
+    """ *INTERNAL FUNCTION*
+    Resamples a range of streamlines at a fixed step size. Each segment is
+    sampled from its start point, with the last point of each streamline
+    retained.
+
+    INPUT:
+        polyData - tractography polydata of class tractio.PolyData
+        f0, f1 - range of streamline indices to resample
+        step_size - distance between samples along streamlines
+
+    OUTPUT:
+        fidxes - array of streamline indices of samples
+        samples - array of resampled points (N x 3)
+    """
+    offsets = polyData.offsets
+    lengths = np.diff(offsets[f0:f1 + 1])
+
+    points = polyData.points[polyData.connectivity[offsets[f0]:offsets[f1]]]
+    points = points.astype(np.float64)
+    pointFidxes = np.repeat(np.arange(f0, f1), lengths)
+
+    # Segments between consecutive points of the same streamline
+    segIdx = np.where(pointFidxes[:-1] == pointFidxes[1:])[0]
+    segVec = points[segIdx + 1] - points[segIdx]
+    segSamples = np.ceil(np.linalg.norm(segVec, axis=1) / step_size)
+    segSamples = np.maximum(segSamples, 1).astype(np.int64)
+
+    sampleSeg = np.repeat(np.arange(len(segIdx)), segSamples)
+    sampleStart = np.cumsum(segSamples) - segSamples
+    t = (np.arange(len(sampleSeg)) - sampleStart[sampleSeg]) / \
+        segSamples[sampleSeg].astype(np.float64)
+
+    samples = points[segIdx[sampleSeg]] + t[:, None] * segVec[sampleSeg]
+
+    # Last point of each streamline
+    lastIdx = (offsets[f0 + 1:f1 + 1] - offsets[f0] - 1)[lengths > 0]
+
+    fidxes = np.concatenate((pointFidxes[segIdx[sampleSeg]],
+                             pointFidxes[lastIdx]))
+    samples = np.concatenate((samples, points[lastIdx]))
+
+    return fidxes, samples
@@ -5,7 +5,14 @@ Module providing miscallaneous functionality
 """
 
 import os.path as op
+import sys, time, json, threading
 import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+# Active profiler of process; None if not profiling
+_profiler = None
 
 def saveEig(dir_path, eigval_arr, eigvec_arr, verbose=0):
     """
@@ -32,6 +39,40 @@ def saveEig(dir_path, eigval_arr, eigvec_arr, verbose=0):
 
     return
 
+def loadEig(dir_path, remove=False, verbose=0):
+    """
+    Function used to load eigenvalues and eigenvectors saved by saveEig.
+
+    INPUT:
+        dir_path - directory path files are stored in
+        remove - flag to remove files once loaded; defaults False
+
+    OUTPUT:
+        eigval_arr - array of eigenvalues; None if not found
+        eigvec_arr - matrix of eigenvectors; None if not found
+    """
+    # Paths to load
+    eigval_path = op.join(op.realpath(dir_path), "eigval.npz")
+    eigvec_path = op.join(op.realpath(dir_path), "eigvec.npz")
+
+    if not (op.isfile(eigval_path) and op.isfile(eigvec_path)):
+        return None, None
+
+    with np.load(eigval_path) as eigval_file:
+        eigval_arr = eigval_file['arr_0']
+    with np.load(eigvec_path) as eigvec_file:
+        eigvec_arr = eigvec_file['arr_0']
+
+    if remove:
+        import os
+        os.remove(eigval_path)
+        os.remove(eigvec_path)
+
+    vprint("Loaded eigenvalues & eigenvectors from %s" % op.realpath(dir_path),
+           verbose)
+
+    return eigval_arr, eigvec_arr
+
 def vprint(txt, verbose, debug=False):
     """
     Function used to print verbose statements
@@ -50,3 +91,257 @@ def vprint(txt, verbose, debug=False):
         print("DEBUG: %s" % txt)
 
     return
+
+class Profiler(object):
+    """
+    Records wall time, CPU time and peak resident memory (RSS) of named
+    stages. Repeated stages (eg. called per region or per subject) are
+    accumulated under the same name, and times of nested stages are also
+    included in those of enclosing stages. CPU time is recorded both for the
+    thread running the stage ('thread_cpu') and for the whole process
+    ('process_cpu'). Process CPU time includes worker threads of the stage,
+    but also any other threads running at the same time, such that it is
+    counted more than once for stages running concurrently. Peak RSS is the
+    high-water mark of the process at the end of the stage, with its increase
+    during the stage indicating memory allocated by the stage.
+
+    Stages listed in cprofileStages are additionally profiled with cProfile,
+    accumulated over calls of each stage, with statistics dumped to
+    <cprofilePrefix>.<stage>.prof once profiling is stopped.
+    """
+    def __init__(self, cprofileStages=[], cprofilePrefix=None):
+        """
+        Initialization of profiler.
+
+        INPUT:
+            cprofileStages - list of stages to profile with cProfile
+            cprofilePrefix - path prefix of cProfile statistics; defaults
+                             'profile'
+
+        OUTPUT:
+            none
+        """
+        self.stages = OrderedDict()
+        self.cprofileStages = list(cprofileStages)
+        self.cprofilePrefix = 'profile' if cprofilePrefix is None \
+                              else cprofilePrefix
+        self.startTime = time.time()
+        self.startWall = time.perf_counter()
+        self.startCPU = time.process_time()
+        self._lock = threading.Lock()
+        self._cprofiles = {}
+        self._cprofiling = False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager recording a named stage.
+
+        INPUT:
+            name - name of stage
+
+        OUTPUT:
+            none
+        """
+        cprof = self._startCProfile(name)
+        rss0 = _peakRSS()
+        wall0 = time.perf_counter()
+        thread0, process0 = time.thread_time(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall0
+            threadCPU = time.thread_time() - thread0
+            processCPU = time.process_time() - process0
+            rss = _peakRSS()
+            self._stopCProfile(cprof)
+
+            with self._lock:
+                if name not in self.stages:
+                    self.stages[name] = {'calls': 0, 'wall': 0.,
+                                         'thread_cpu': 0.,
+                                         'process_cpu': 0.,
+                                         'peak_rss_mb': None,
+                                         'rss_increase_mb': None}
+                record = self.stages[name]
+                record['calls'] += 1
+                record['wall'] += wall
+                record['thread_cpu'] += threadCPU
+                record['process_cpu'] += processCPU
+                if rss is not None:
+                    record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0.,
+                                                rss)
+                    record['rss_increase_mb'] = \
+                        max(record['rss_increase_mb'] or 0., rss - rss0)
+
+    def report(self):
+        """
+        Returns report of recorded stages.
+
+        INPUT:
+            none
+
+        OUTPUT:
+            report - dictionary of run information and recorded stages
+        """
+        with self._lock:
+            stages = OrderedDict((name, dict(record))
+                                 for name, record in self.stages.items())
+
+        return OrderedDict([
+            ('command', sys.argv),
+            ('start', self.startTime),
+            ('wall', time.perf_counter() - self.startWall),
+            ('process_cpu', time.process_time() - self.startCPU),
+            ('peak_rss_mb', _peakRSS()),
+            ('stages', stages)])
+
+    def _startCProfile(self, name):
+        """ *INTERNAL FUNCTION*
+        Starts cProfile of stage if requested; only a single stage is
+        profiled at a time.
+        """
+        if name not in self.cprofileStages:
+            return None
+
+        with self._lock:
+            if self._cprofiling:
+                return None
+            self._cprofiling = True
+
+        import cProfile
+
+        cprof = self._cprofiles.setdefault(name, cProfile.Profile())
+        try:
+            cprof.enable()
+        except ValueError:
+            # Another profiler is already active
+            self._cprofiling = False
+            return None
+
+        return cprof
+
+    def _stopCProfile(self, cprof):
+        """ *INTERNAL FUNCTION*
+        Stops cProfile of stage.
+        """
+        if cprof is None:
+            return
+
+        cprof.disable()
+        self._cprofiling = False
+
+    def dumpCProfiles(self):
+        """
+        Dumps cProfile statistics of profiled stages.
+
+        INPUT:
+            none
+
+        OUTPUT:
+            none
+        """
+        for name, cprof in self._cprofiles.items():
+            cprof.dump_stats('%s.%s.prof' % (self.cprofilePrefix, name))
+
+def startProfile(cprofileStages=[], cprofilePrefix=None):
+    """
+    Starts recording stages of the process.
+
+    INPUT:
+        cprofileStages - list of stages to profile with cProfile
+        cprofilePrefix - path prefix of cProfile statistics
+
+    OUTPUT:
+        profiler - active profiler of class Profiler
+    """
+    global _profiler
+
+    _profiler = Profiler(cprofileStages, cprofilePrefix)
+
+    return _profiler
+
+def stopProfile(profile_file=None):
+    """
+    Stops recording stages, optionally writing the report to a JSON file.
+    cProfile statistics of profiled stages are dumped.
+
+    INPUT:
+        profile_file - path of JSON file to write report to; defaults None
+
+    OUTPUT:
+        report - dictionary of run information and recorded stages; None if
+                 not profiling
+    """
+    global _profiler
+
+    if _profiler is None:
+        return None
+
+    report = _profiler.report()
+    if profile_file is not None:
+        with open(profile_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    _profiler.dumpCProfiles()
+    _profiler = None
+
+    return report
+
+@contextmanager
+def profileStage(name):
+    """
+    Context manager recording a named stage if profiling; otherwise does
+    nothing.
+
+    INPUT:
+        name - name of stage
+
+    OUTPUT:
+        none
+    """
+    profiler = _profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name):
+            yield
+
+def profiled(name):
+    """
+    Decorator recording each call of a function as a named stage if
+    profiling.
+
+    INPUT:
+        name - name of stage
+
+    OUTPUT:
+        decorator - function decorator
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            with _profiler.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+def _peakRSS():
+    """ *INTERNAL FUNCTION*
+    Returns peak resident memory (MB) of process; None if unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS and kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return maxrss / 1024. ** 2
+
+    return maxrss / 1024.
@@ -4,20 +4,35 @@ Module containing classes and functions pertaining to use of previously clustere
 
 """
 
-import os
+import os, hashlib, json, shutil, tempfile
 import numpy as np
-from . import fibers, tractio, misc
+from collections import OrderedDict
+from . import distance, fibers, tractio, misc
 from vtk.util import numpy_support
 
-def load(priorVTKPath, templateFlag=False, verbose=0):
+# In-process cache of loaded priors, least recently used first
+_priorCache = OrderedDict()
+_cacheSize = 4
+
+@misc.profiled('prior.load')
+def load(priorVTKPath, templateFlag=False, verbose=0, cacheDir=None):
     """
     Class used to load .vtk prior file.
 
+    Loaded priors are kept in an in-process cache keyed by path and
+    modification time, such that repeated loads of the same prior are only
+    parsed once. Optionally, loaded priors are also stored as memory-mapped
+    arrays in cacheDir (or the directory given by the NEUROBEER_PRIOR_CACHE
+    environment variable), which other processes on the same node attach to
+    read-only instead of parsing the VTK. Returned data is shared between
+    calls and should not be modified.
+
     INPUT:
         priorVTKPath - absolute path to VTK file containing prior information
                        to be used
         templateflag - flag to set for subsetting; defaults false
         verbose - verbosity of function; defaults 0
+        cacheDir - directory of shared prior store; defaults None
 
     OUTPUT:
         priorTree - returns prior information stored in a tree format
@@ -31,12 +46,73 @@ def load(priorVTKPath, templateFlag=False, verbose=0):
     if not os.path.exists(priorVTKPath):
         raise IOError("Error: Prior data %s does not exist" % priorVTKPath)
 
+    if cacheDir is None:
+        cacheDir = os.environ.get('NEUROBEER_PRIOR_CACHE')
+
+    # Check cached priors
+    cacheKey = _cacheKey(priorVTKPath, templateFlag)
+    if cacheKey in _priorCache:
+        misc.vprint("Using cached prior data.", verbose)
+        _priorCache[cacheKey] = _priorCache.pop(cacheKey)
+
+        return _priorCache[cacheKey]
+
+    priorInfo = None
+    if cacheDir is not None:
+        with misc.profileStage('prior.attach'):
+            priorInfo = _attachStore(cacheDir, cacheKey, verbose)
+
+    if priorInfo is None:
+        with misc.profileStage('prior.parse'):
+            priorInfo = _loadVTK(priorVTKPath, templateFlag, verbose)
+
+        if cacheDir is not None:
+            with misc.profileStage('prior.store'):
+                _writeStore(cacheDir, cacheKey, priorInfo, verbose)
+
+    # Update cache, removing least recently used prior
+    _priorCache[cacheKey] = priorInfo
+    while len(_priorCache) > _cacheSize:
+        _priorCache.popitem(last=False)
+
+    misc.vprint("Finishined loading prior data.", verbose)
+
+    return priorInfo
+
+def clearCache():
+    """
+    Removes all priors from the in-process cache.
+
+    INPUT:
+        none
+
+    OUTPUT:
+        none
+    """
+    _priorCache.clear()
+
+def _loadVTK(priorVTKPath, templateFlag=False, verbose=0):
+    """ *INTERNAL FUNCTION*
+    Reads and converts prior information from .vtk file.
+
+    INPUT:
+        priorVTKPath - absolute path to VTK file containing prior information
+        templateflag - flag to set for subsetting; defaults false
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        priorTree - returns prior information stored in a tree format
+        sortedCentroids - codebook of centroids to be used in future clustering
+        subsetIdxes - return subset of indices; returns value only if
+                      templateFlag is true
+    """
+
     # Prior information
+    no_of_fibers, pts_per_fiber = getFiberInfo(priorVTKPath)
+    priorVTK = tractio.readVTK(priorVTKPath)
+    fiberArray = _getFiberArray(priorVTK, pts_per_fiber)
 
-    priorTree = fibers.FiberTree()
-    priorVTK, priorTree.no_of_fibers, priorTree.pts_per_fiber = \
-        getFiberInfo(priorVTKPath)
-    priorTree.convertFromVTK(priorVTK, priorTree.pts_per_fiber, verbose)
+    misc.vprint("Fibers: %d" % int(no_of_fibers), verbose)
 
     # Get cluster labels + set number of fibers
     clusterCentroids, clusterArray = _getClusterInfo(priorVTK)
@@ -45,32 +121,142 @@ def load(priorVTKPath, templateFlag=False, verbose=0):
     if templateFlag is True:
         subsetIdxes = _getSubset(clusterArray)
 
-        centroidTree = priorTree.getFibers(subsetIdxes)
-        centroidTree = fibers.convertFromTuple(centroidTree)
-        _getScalarInfo(priorVTK, centroidTree, subsetIdxes,
-                       centroidTree.pts_per_fiber, verbose)
+        centroidTree = fibers.FiberArray(
+            np.transpose(fiberArray[subsetIdxes], (2, 0, 1)),
+            _getScalarInfo(priorVTK, subsetIdxes, pts_per_fiber, verbose))
         clusterArray = _addCentroidInfo(centroidTree, subsetIdxes,
                         clusterArray)
 
     else:
-        centroidTree = priorTree.getFibers(range(priorTree.no_of_fibers))
-        centroidTree = fibers.convertFromTuple(centroidTree)
-        _getScalarInfo(priorVTK, centroidTree, range(priorTree.no_of_fibers),
-                       centroidTree.pts_per_fiber, verbose)
-        clusterArray = _addCentroidInfo(centroidTree,
-                            range(priorTree.no_of_fibers), clusterArray)
+        # Index to copy arrays, such that prior polydata can be released
+        centroidTree = fibers.FiberArray(
+            np.transpose(fiberArray[np.arange(no_of_fibers)], (2, 0, 1)),
+            _getScalarInfo(priorVTK, range(no_of_fibers), pts_per_fiber,
+                           verbose))
+        clusterArray = _addCentroidInfo(centroidTree, range(no_of_fibers),
+                                        clusterArray)
 
         subsetIdxes = None
 
-    misc.vprint("Finishined loading prior data.", verbose)
+    del priorVTK, fiberArray
+
+    return centroidTree, clusterCentroids, clusterArray, subsetIdxes
+
+def _cacheKey(priorVTKPath, templateFlag):
+    """ *INTERNAL FUNCTION*
+    Identifies a loaded prior by its location and modification time.
+
+    INPUT:
+        priorVTKPath - path to VTK file containing prior information
+        templateflag - flag to set for subsetting
+
+    OUTPUT:
+        cacheKey - tuple identifying loaded prior
+    """
+    priorVTKPath = os.path.realpath(priorVTKPath)
+
+    return (priorVTKPath, os.path.getmtime(priorVTKPath), bool(templateFlag))
+
+def _storePath(cacheDir, cacheKey):
+    """ *INTERNAL FUNCTION*
+    Directory of shared store of a prior.
+    """
+    storeName = hashlib.sha1(repr(cacheKey).encode('utf-8')).hexdigest()
+
+    return os.path.join(os.path.realpath(cacheDir), storeName)
+
+def _writeStore(cacheDir, cacheKey, priorInfo, verbose=0):
+    """ *INTERNAL FUNCTION*
+    Saves loaded prior as arrays to shared store. Store is written to a
+    temporary directory first, such that processes only attach to complete
+    stores.
+
+    INPUT:
+        cacheDir - directory of shared prior stores
+        cacheKey - tuple identifying prior
+        priorInfo - loaded prior information, as returned by load
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        none
+    """
+    storePath = _storePath(cacheDir, cacheKey)
+    if os.path.exists(storePath):
+        return
+    elif not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+
+    centroidTree, clusterCentroids, clusterArray, subsetIdxes = priorInfo
+    scalarTypes = list(centroidTree.scalarArrays.keys())
+
+    tmpPath = tempfile.mkdtemp(prefix='.tmp', dir=os.path.dirname(storePath))
+    np.save(os.path.join(tmpPath, 'fibers.npy'),
+            np.asarray(centroidTree.fiberArray, dtype=np.float32))
+    np.save(os.path.join(tmpPath, 'centroids.npy'), clusterCentroids)
+    np.save(os.path.join(tmpPath, 'clusters.npy'), clusterArray)
+    if subsetIdxes is not None:
+        np.save(os.path.join(tmpPath, 'subset.npy'), subsetIdxes)
+    for i in range(len(scalarTypes)):
+        np.save(os.path.join(tmpPath, 'scalar%d.npy' % i),
+                centroidTree.scalarArrays[scalarTypes[i]])
+    with open(os.path.join(tmpPath, 'info.json'), 'w') as f:
+        json.dump({'path': cacheKey[0], 'scalarTypes': scalarTypes}, f)
+
+    try:
+        os.rename(tmpPath, storePath)
+        misc.vprint("Saved prior store to %s" % storePath, verbose)
+    except OSError:
+        # Store written by another process
+        shutil.rmtree(tmpPath, ignore_errors=True)
+
+def _attachStore(cacheDir, cacheKey, verbose=0):
+    """ *INTERNAL FUNCTION*
+    Loads prior from shared store, memory-mapping stored arrays read-only.
+    Fibers and scalars are read from the mapped arrays when requested, such
+    that attaching does not copy the prior into each process.
+
+    INPUT:
+        cacheDir - directory of shared prior stores
+        cacheKey - tuple identifying prior
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        priorInfo - loaded prior information, as returned by load; None if
+                    prior has not been stored
+    """
+    storePath = _storePath(cacheDir, cacheKey)
+    if not os.path.exists(os.path.join(storePath, 'info.json')):
+        return None
+
+    misc.vprint("Attaching to prior store %s" % storePath, verbose)
+
+    with open(os.path.join(storePath, 'info.json'), 'r') as f:
+        scalarTypes = json.load(f)['scalarTypes']
+
+    fiberArray = np.load(os.path.join(storePath, 'fibers.npy'), mmap_mode='r')
+    clusterCentroids = np.load(os.path.join(storePath, 'centroids.npy'),
+                               mmap_mode='r')
+    clusterArray = np.load(os.path.join(storePath, 'clusters.npy'),
+                           mmap_mode='r')
+    if os.path.exists(os.path.join(storePath, 'subset.npy')):
+        subsetIdxes = list(np.load(os.path.join(storePath, 'subset.npy')))
+    else:
+        subsetIdxes = None
 
-    del priorVTK, priorTree
+    centroidTree = fibers.FiberArray(fiberArray, [
+        (scalarTypes[i], np.load(os.path.join(storePath, 'scalar%d.npy' % i),
+                                 mmap_mode='r'))
+        for i in range(len(scalarTypes))])
+    clusterArray = _addCentroidInfo(centroidTree,
+                                    range(centroidTree.no_of_fibers),
+                                    clusterArray)
 
     return centroidTree, clusterCentroids, clusterArray, subsetIdxes
 
 def getFiberInfo(priorVTKPath):
     """
-    Function to retrieve number of points from vtk polydata
+    Function to retrieve number of points from vtk polydata. Only the headers
+    of the file are read.
 
     INPUT:
         priorVTKPath - path of .vtk polydata filer
@@ -80,11 +266,9 @@ def getFiberInfo(priorVTKPath):
         pts_per_fiber - number of samples along fiber
     """
 
-    priorVTK = tractio.readVTK(priorVTKPath)
-    no_of_fibers = priorVTK.GetNumberOfLines()
-    pts_per_fiber = int(priorVTK.GetNumberOfPoints() / no_of_fibers)
+    vtkInfo = tractio.readVTKInfo(priorVTKPath)
 
-    return priorVTK, no_of_fibers, pts_per_fiber
+    return vtkInfo['no_of_fibers'], vtkInfo['pts_per_fiber']
 
 def _getSubset(clusterArray):
     """ *INTERNAL FUNCTION*
@@ -100,8 +284,7 @@ def _getSubset(clusterArray):
 
     subsetIdxes = []
 
-    for cluster in np.unique(clusterArray):
-        idx = np.where(clusterArray == cluster)[0]
+    for _, idx in fibers.ClusterIndex(clusterArray):
         if len(idx) > 25:
             subsetIdx = np.random.choice(idx, 25, replace=False)
         else:
@@ -111,6 +294,267 @@ def _getSubset(clusterArray):
 
     return subsetIdxes
 
+def getMedoids(priorTree, clusterArray, n_medoids=1, max_samples=250):
+    """
+    Identifies representative fibers (medoids) of each prior cluster to be
+    used for coarse comparisons prior to comparing with all cluster members.
+
+    INPUT:
+        priorTree - tree containing prior fiber data
+        clusterArray - array of cluster labels for each fiber
+        n_medoids - number of medoids to identify per cluster
+        max_samples - maximum number of fibers per cluster considered as
+                      medoids; larger clusters are evenly subsampled
+
+    OUTPUT:
+        medoidIdxes - array of fiber indices of medoids with one row per
+                      cluster; rows of clusters with fewer fibers than
+                      n_medoids repeat medoids
+        medoidLabels - cluster labels corresponding to rows of medoidIdxes
+    """
+    fiberArray = distance.flatFibers(priorTree.getFibers(
+        range(priorTree.no_of_fibers)))
+
+    return _getMedoids(fiberArray, clusterArray, n_medoids, max_samples)
+
+def compact(priorVTKPath, outVTKPath=None, n_fibers=None, max_error=None,
+            method='kcenter', max_samples=250, verbose=0):
+    """
+    Compacts a prior by selecting a small set of representative fibers from
+    each cluster. Representatives are stored with the number of prior fibers
+    they represent ('MemberCount') and the largest distance between a
+    represented fiber and its representative ('CoverRadius'). Any fiber of
+    the original prior is within CoverRadius (MDF) of a representative of
+    its cluster, bounding the change in distance when labelling against the
+    compact prior.
+
+    Representatives are selected either via k-center (farthest fiber first)
+    to a target number of fibers per cluster and / or error bound, or via
+    medoids to a target number of fibers per cluster. Without a target or
+    bound, 25 fibers per cluster are selected, as with template subsetting.
+
+    INPUT:
+        priorVTKPath - path to VTK file containing prior information
+        outVTKPath - path to write compacted prior to; defaults None
+        n_fibers - maximum number of representative fibers per cluster
+        max_error - maximum distance (mm) of fibers to representative; only
+                    used with k-center
+        method - selection of representatives, 'kcenter' or 'medoid'
+        max_samples - maximum number of fibers per cluster considered as
+                      medoids
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        compactVTK - polydata of compacted prior
+    """
+    if method not in ('kcenter', 'medoid'):
+        raise ValueError("Unrecognized method %s" % method)
+    elif method == 'medoid' and max_error is not None:
+        raise ValueError("Error bound can only be used with k-center")
+    elif n_fibers is None and max_error is None:
+        n_fibers = 25
+
+    no_of_fibers, pts_per_fiber = getFiberInfo(priorVTKPath)
+    priorVTK = tractio.readVTK(priorVTKPath)
+    fiberArray = np.asarray(_getFiberArray(priorVTK, pts_per_fiber),
+                            dtype=np.float32)
+    _, clusterArray = _getClusterInfo(priorVTK)
+
+    misc.vprint("Compacting %d fibers from %d clusters..."
+                % (no_of_fibers, len(np.unique(clusterArray))), verbose)
+
+    repIdxes, memberCount, coverRadius = [], [], []
+    for label, idx in fibers.ClusterIndex(clusterArray):
+        if method == 'kcenter':
+            first = _getMedoids(fiberArray[idx], np.zeros(len(idx)), 1,
+                                max_samples)[0][0, 0]
+            reps = _kCenter(fiberArray[idx], first, n_fibers, max_error)
+        else:
+            reps = _getMedoids(fiberArray[idx], np.zeros(len(idx)), n_fibers,
+                               max_samples)[0][0]
+            reps = np.unique(reps)
+
+        # Assign fibers of cluster to nearest representative
+        repDist = np.stack([_mdfToFiber(fiberArray[idx], fiberArray[idx[rep]])
+                            for rep in reps], axis=1)
+        nearest = np.argmin(repDist, axis=1)
+        minDist = repDist[np.arange(len(idx)), nearest]
+
+        repIdxes.extend(idx[reps])
+        memberCount.extend(np.bincount(nearest, minlength=len(reps)))
+        coverRadius.extend([np.max(minDist[nearest == i], initial=0.)
+                            for i in range(len(reps))])
+
+        misc.vprint("Cluster %d: %d of %d fibers, max. distance %.2f"
+                    % (label, len(reps), len(idx), np.max(minDist)),
+                    verbose)
+
+    compactVTK = _subsetVTK(priorVTK, fiberArray, np.asarray(repIdxes))
+    _addCellArray(compactVTK, np.asarray(memberCount, dtype=np.int32),
+                  'MemberCount')
+    _addCellArray(compactVTK, np.asarray(coverRadius, dtype=np.float32),
+                  'CoverRadius')
+
+    misc.vprint("Compacted prior to %d fibers." % len(repIdxes), verbose)
+
+    if outVTKPath is not None:
+        tractio.writeVTK(compactVTK, outVTKPath, verbose)
+
+    return compactVTK
+
+def _getMedoids(fiberArray, clusterArray, n_medoids=1, max_samples=250):
+    """ *INTERNAL FUNCTION*
+    Function to identify medoids from each cluster. Used alongside subsetting
+    of template.
+
+    INPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+        clusterArray - array of cluster labels for each fiber
+        n_medoids - number of medoids per cluster
+        max_samples - maximum number of fibers per cluster to consider
+
+    OUTPUT:
+        medoidIdxes - array of fiber indices of medoids per cluster
+        medoidLabels - cluster labels corresponding to rows of medoidIdxes
+    """
+    clusterIndex = fibers.ClusterIndex(clusterArray)
+    medoidLabels = clusterIndex.labels
+    medoidIdxes = np.zeros((len(medoidLabels), n_medoids), dtype=int)
+
+    for i, (_, idx) in enumerate(clusterIndex):
+        if len(idx) > max_samples:
+            idx = idx[np.linspace(0, len(idx) - 1, max_samples).astype(int)]
+
+        medoids = _buildMedoids(_pairwiseMDF(fiberArray[idx]), n_medoids)
+        medoidIdxes[i] = np.resize(idx[medoids], n_medoids)
+
+    return medoidIdxes, medoidLabels
+
+def _buildMedoids(distMatrix, n_medoids):
+    """ *INTERNAL FUNCTION*
+    Greedily selects medoids, each reducing the total distance of fibers to
+    their nearest medoid the most.
+
+    INPUT:
+        distMatrix - pairwise distance matrix between fibers of a cluster
+        n_medoids - number of medoids to select
+
+    OUTPUT:
+        medoids - indices of selected medoids within distMatrix
+    """
+    medoids = [int(np.argmin(np.sum(distMatrix, axis=1)))]
+    nearest = distMatrix[medoids[0]]
+
+    while len(medoids) < min(n_medoids, distMatrix.shape[0]):
+        gain = np.sum(np.maximum(nearest[None, :] - distMatrix, 0), axis=1)
+        gain[medoids] = -1
+
+        medoids.append(int(np.argmax(gain)))
+        nearest = np.minimum(nearest, distMatrix[medoids[-1]])
+
+    return np.array(medoids)
+
+def _pairwiseMDF(fiberArray):
+    """ *INTERNAL FUNCTION*
+    Computes pairwise MDF distance between fibers traversed in both directions
+
+    INPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+
+    OUTPUT:
+        distMatrix - NxN matrix of distances between fibers
+    """
+    return np.minimum(distance.calcMDF(fiberArray[:, None],
+                                       fiberArray[None]),
+                      distance.calcMDF(fiberArray[:, None, ::-1],
+                                       fiberArray[None]))
+
+def _kCenter(fiberArray, first, n_fibers=None, max_error=None):
+    """ *INTERNAL FUNCTION*
+    Greedily selects representatives, each being the fiber farthest from all
+    previously selected representatives, until the target number of
+    representatives or error bound is reached.
+
+    INPUT:
+        fiberArray - array of fibers of a cluster of shape
+                     (N, pts_per_fiber, 3)
+        first - index of first representative
+        n_fibers - maximum number of representatives; defaults None
+        max_error - maximum distance of fibers to nearest representative;
+                    defaults None
+
+    OUTPUT:
+        reps - indices of representatives within fiberArray
+    """
+    reps = [first]
+    nearest = _mdfToFiber(fiberArray, fiberArray[first])
+
+    while (n_fibers is None) or (len(reps) < n_fibers):
+        farthest = int(np.argmax(nearest))
+        if nearest[farthest] == 0 or \
+           (max_error is not None and nearest[farthest] <= max_error):
+            break
+
+        reps.append(farthest)
+        nearest = np.minimum(nearest, _mdfToFiber(fiberArray,
+                                                  fiberArray[farthest]))
+
+    return np.array(reps)
+
+def _mdfToFiber(fiberArray, fiber):
+    """ *INTERNAL FUNCTION*
+    Computes MDF distance between a group of fibers and a single fiber
+    traversed in both directions
+    """
+    return np.minimum(distance.calcMDF(fiberArray, fiber),
+                      distance.calcMDF(fiberArray, fiber[::-1]))
+
+def _subsetVTK(priorVTK, fiberArray, fidxes):
+    """ *INTERNAL FUNCTION*
+    Extracts fibers of prior polydata, retaining cell and point data. Fibers
+    of prior are expected to each have the same number of points.
+
+    INPUT:
+        priorVTK - prior .vtk polydata
+        fiberArray - array of prior fibers of shape (N, pts_per_fiber, 3)
+        fidxes - indices of fibers to extract
+
+    OUTPUT:
+        subsetVTK - polydata of extracted fibers
+    """
+    pts_per_fiber = fiberArray.shape[1]
+
+    subsetTree = fibers.convertFromTuple(np.transpose(fiberArray[fidxes],
+                                                      (2, 0, 1)))
+    subsetVTK = subsetTree.convertToVTK()
+
+    ptIdxes = (fidxes[:, None] * pts_per_fiber +
+               np.arange(pts_per_fiber)[None, :]).ravel()
+
+    for i in range(priorVTK.GetCellData().GetNumberOfArrays()):
+        array = priorVTK.GetCellData().GetArray(i)
+        _addCellArray(subsetVTK, numpy_support.vtk_to_numpy(array)[fidxes],
+                      array.GetName(), array.GetDataType())
+
+    for i in range(priorVTK.GetPointData().GetNumberOfArrays()):
+        array = priorVTK.GetPointData().GetArray(i)
+        subsetArray = numpy_support.numpy_to_vtk(
+            np.ascontiguousarray(numpy_support.vtk_to_numpy(array)[ptIdxes]),
+            deep=1, array_type=array.GetDataType())
+        subsetArray.SetName(array.GetName())
+        subsetVTK.GetPointData().AddArray(subsetArray)
+
+    return subsetVTK
+
+def _addCellArray(polyData, dataArray, name, array_type=None):
+    """ *INTERNAL FUNCTION*
+    Adds array of values per fiber to polydata
+    """
+    cellArray = numpy_support.numpy_to_vtk(np.ascontiguousarray(dataArray),
+                                           deep=1, array_type=array_type)
+    cellArray.SetName(name)
+    polyData.GetCellData().AddArray(cellArray)
+
 def _addCentroidInfo(centroidTree, subsetIdxes, clusterArray):
     """ *INTERNAL FUNCTION*
     Function to add centroid info to subset tree.
@@ -124,10 +568,7 @@ def _addCentroidInfo(centroidTree, subsetIdxes, clusterArray):
         nClusterArray - array with new cluster info for subset
     """
     nClusterArray = clusterArray[subsetIdxes]
-
-    for fidx in range(centroidTree.no_of_fibers):
-            centroidTree.fiberTree[fidx][str(nClusterArray[fidx])] = \
-                nClusterArray[fidx]
+    centroidTree.clusterIndex = fibers.ClusterIndex(nClusterArray)
 
     return nClusterArray
 
@@ -141,60 +582,63 @@ def _getClusterInfo(priorVTK):
 
     OUTPUT:
         sortedCentroid - array of sorted centroids to be used for future clustering
+        clusterArray - array of cluster labels for each fiber
     """
 
     # Get cluster information in array
-    clusterLabels = priorVTK.GetCellData().GetArray('ClusterLabel')
-    centroidLabels = priorVTK.GetCellData().GetArray('Centroid')
-    clusterArray = numpy_support.vtk_to_numpy(clusterLabels)
-    centroidArray = numpy_support.vtk_to_numpy(centroidLabels)
+    clusterArray = numpy_support.vtk_to_numpy(
+        priorVTK.GetCellData().GetArray('ClusterLabel'))
+    centroidArray = numpy_support.vtk_to_numpy(
+        priorVTK.GetCellData().GetArray('Centroid'))
 
-    for cluster in np.unique(clusterArray):
-        idx = np.where(clusterArray == cluster)[0][0]
+    # Sort centroids by label, taking centroid of first fiber of each cluster
+    _, firstIdx = np.unique(clusterArray, return_index=True)
+    sortedCentroid = centroidArray.reshape(len(clusterArray), -1)[firstIdx]
 
-        # Sort centroids
-        if cluster == 0:
-            sortedCentroid = centroidArray[idx]
-        else:
-            sortedCentroid = np.vstack((sortedCentroid, centroidArray[idx]))
+    return sortedCentroid, clusterArray
 
-    del clusterLabels, centroidLabels, centroidArray
+def _getFiberArray(priorVTK, pts_per_fiber=20):
+    """ *INTERNAL FUNCTION*
+    Reads fiber coordinates of prior, where each fiber is stored with the
+    same number of consecutive points
 
-    return sortedCentroid, clusterArray
+    INPUT:
+        priorVTK - prior .vtk polydata file
+        pts_per_fiber - number of points along each fiber
+
+    OUTPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+    """
+    fiberArray = numpy_support.vtk_to_numpy(priorVTK.GetPoints().GetData())
+
+    return fiberArray.reshape(-1, pts_per_fiber, 3)
 
-def _getScalarInfo(priorVTK, centroidTree, subsetIdx, pts_per_fiber=20,
-                   verbose=0):
+def _getScalarInfo(priorVTK, subsetIdx, pts_per_fiber=20, verbose=0):
     """ *INTERNAL FUNCTION*
-    Reads and converts scalar information stored in VTK to fiberTree
+    Reads scalar information stored in VTK as arrays
 
     INPUT:
         priorVTK - prior .vtk polydata file
-        centroidTree - tree containing subset fiber data
         subsetIdx - subset of fibers to extract scalars from
         pts_per_fiber - number of points to sample along
 
     OUTPUT:
-        none
+        scalarArrays - dictionary of arrays of scalar values of shape
+                       (N, pts_per_fiber), keyed by scalar type
     """
+    subsetIdx = np.asarray(subsetIdx, dtype=int)
+    scalarArrays = OrderedDict()
 
     for i in range(priorVTK.GetPointData().GetNumberOfArrays()):
         scalarType = priorVTK.GetPointData().GetArray(i).GetName()
 
         misc.vprint("Adding %s to fiber data" % scalarType, verbose)
 
-        fidx = 0
-        for idx in subsetIdx:
-            if idx == 0:
-                j = 0
-            else:
-                j = idx * pts_per_fiber
-
-            for pidx in range(0, centroidTree.pts_per_fiber):
-                centroidTree.fiberTree[fidx][pidx][scalarType] = \
-                    priorVTK.GetPointData().GetArray(i).GetValue(j)
-                j += 1
+        scalarArray = numpy_support.vtk_to_numpy(
+            priorVTK.GetPointData().GetArray(i)).reshape(-1, pts_per_fiber)
+        scalarArrays[scalarType] = scalarArray[subsetIdx]
 
-            fidx += 1
+    return scalarArrays
 
 # def loadEig(dirpath, eigvalFile, eigvecFile):
 #     """ WARNING: TO BE DEPRECATED
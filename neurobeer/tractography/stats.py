@@ -5,9 +5,9 @@ tract-based statistics.
 
 """
 
-import os, csv
+import os, csv, glob, tempfile
 import numpy as np
-import matplotlib.pyplot as plt
+from . import misc
 
 def _mean(fiberTree, scalarType, idxes=None):
     """ *INTERNAL FUNCTION*
@@ -26,14 +26,11 @@ def _mean(fiberTree, scalarType, idxes=None):
     """
 
     if idxes is None:
-        clusterAvg = np.nanmean(fiberTree.getScalars(range(fiberTree.no_of_fibers),
-                            scalarType)[:, :], axis=0)
-        avg = np.nanmean(fiberTree.getScalars(range(fiberTree.no_of_fibers),
-                      scalarType)[:, :])
-    else:
-        clusterAvg = np.nanmean(fiberTree.getScalars(idxes, scalarType)[:, :],
-                             axis=0)
-        avg = np.nanmean(fiberTree.getScalars(idxes, scalarType)[:, :])
+        idxes = range(fiberTree.no_of_fibers)
+
+    scalarArray = fiberTree.getScalars(idxes, scalarType)
+    clusterAvg = np.nanmean(scalarArray, axis=0)
+    avg = np.nanmean(scalarArray)
 
     return clusterAvg, avg
 
@@ -54,14 +51,11 @@ def _stddev(fiberTree, scalarType, idxes=None):
         stdev - standard deviation of fiber group
     """
     if idxes is None:
-        clusterSdev = np.nanstd(fiberTree.getScalars(range(fiberTree.no_of_fibers),
-                             scalarType)[:, :], axis=0)
-        stdev = np.nanstd(fiberTree.getScalars(range(fiberTree.no_of_fibers),
-                       scalarType)[:, :])
-    else:
-        clusterSdev = np.nanstd(fiberTree.getScalars(idxes, scalarType)[:, :],
-                             axis=0)
-        stdev = np.nanstd(fiberTree.getScalars(idxes, scalarType)[:, :])
+        idxes = range(fiberTree.no_of_fibers)
+
+    scalarArray = fiberTree.getScalars(idxes, scalarType)
+    clusterSdev = np.nanstd(scalarArray, axis=0)
+    stdev = np.nanstd(scalarArray)
     return clusterSdev, stdev
 
 def calcGeoStats(LArray):
@@ -84,6 +78,102 @@ def calcGeoStats(LArray):
 
     return LMean, LSD, fiberCount
 
+def calcClusterMeanStd(clusterLabels, valueList):
+    """
+    Calculates the mean and standard deviation of values of fibers (ie.
+    fiber length) of all clusters at once
+
+    INPUT:
+        clusterLabels - array of cluster labels of fibers
+        valueList - list of (key, array of values) tuples, with values in
+                    order of clusterLabels
+
+    OUTPUT:
+        clusterStats - dictionary of arrays indexed by cluster, with keys:
+                       'labels' - cluster labels
+                       'count' - number of fibers of each cluster
+                       key + 'Mean', key + 'Std' - mean & standard deviation
+                                                   of values
+    """
+    labels, binIdx, count = np.unique(np.asarray(clusterLabels).reshape(-1),
+                                      return_inverse=True, return_counts=True)
+    binIdx = binIdx.reshape(-1)
+
+    clusterStats = {'labels': labels, 'count': count}
+    for key, values in valueList:
+        values = np.asarray(values, dtype=np.float64)
+        mean = np.bincount(binIdx, weights=values) / count
+        var = np.bincount(binIdx, weights=np.square(values - mean[binIdx]))
+        clusterStats[key + 'Mean'] = mean
+        clusterStats[key + 'Std'] = np.sqrt(var / count)
+
+    return clusterStats
+
+def writeClusterInfo(clusterStats, columnList, dirpath=None):
+    """
+    Writes statistics of all clusters to clusterInfo.csv in a single write
+
+    INPUT:
+        clusterStats - dictionary of statistics (from calcClusterMeanStd)
+        columnList - list of (key, header) tuples of columns written between
+                     cluster ID and fiber count
+        dirpath - directory to store CSV file; default None
+
+    OUTPUT:
+        none
+    """
+    if dirpath is None:
+        dirpath = os.getcwd()
+
+    statspath = dirpath + '/stats/'
+    if not os.path.exists(statspath):
+        os.makedirs(statspath)
+
+    rows = [','.join(['Cluster ID'] + [header for _, header in columnList] +
+                     ['Fiber Count'])]
+    for i in range(len(clusterStats['labels'])):
+        rows.append(','.join([str(int(clusterStats['labels'][i]))] +
+                             [repr(float(clusterStats[key][i]))
+                              for key, _ in columnList] +
+                             [str(int(clusterStats['count'][i]))]))
+
+    with open(statspath + 'clusterInfo.csv', 'w') as f:
+        f.write('\n'.join(rows) + '\n')
+
+def calcClusterGeoStats(clusterLabels, LArray):
+    """
+    Calculates the mean and standard deviation fiber length of all clusters
+    at once
+
+    INPUT:
+        clusterLabels - array of cluster labels of fibers
+        LArray - array of fiber lengths, in order of clusterLabels
+
+    OUTPUT:
+        geoStats - dictionary of arrays indexed by cluster, with keys:
+                   'labels' - cluster labels
+                   'count' - number of fibers of each cluster
+                   'LMean', 'LStd' - mean & standard deviation of fiber
+                                     length
+    """
+
+    return calcClusterMeanStd(clusterLabels, [('L', LArray)])
+
+@misc.profiled('stats.writeGeoStats')
+def writeGeoStats(geoStats, dirpath=None):
+    """
+    Writes the length of all clusters to clusterInfo.csv in a single write
+
+    INPUT:
+        geoStats - dictionary of statistics (from calcClusterGeoStats)
+        dirpath - directory to store CSV file; default None
+
+    OUTPUT:
+        none
+    """
+    writeClusterInfo(geoStats, [('LMean', 'Length Mean'),
+                                ('LStd', 'Length S.D.')], dirpath)
+
 def writeGeoCSV(clusterLabel, LMean, LStd, fiberCount, dirpath=None):
     """
     Writes the length and distance of each cluster for an identified group of
@@ -177,6 +267,505 @@ def writeCSV(clusterLabel, fiberTree, scalarType, idxes=None, dirpath=None):
 
     f.close()
 
+@misc.profiled('stats.calcClusterStats')
+def calcClusterStats(clusterLabels, scalarArray, percentiles=[25, 50, 75]):
+    """
+    Calculates along-tract statistics of all clusters at once. Statistics at
+    each sampled point ignore missing (NaN) values.
+
+    INPUT:
+        clusterLabels - array of cluster labels for each fiber
+        scalarArray - array of scalar values indexed by fiber and point
+        percentiles - percentiles to compute at each point; defaults
+                      [25, 50, 75]
+
+    OUTPUT:
+        clusterStats - dictionary of statistics with sorted cluster labels
+                       ('labels'), number of values ('count'), mean ('mean'),
+                       standard deviation ('std') and percentiles
+                       ('percentiles', indexed by percentile, cluster and
+                       point) at each point, as well as the mean ('avg') and
+                       standard deviation ('stdev') of each cluster
+    """
+    scalarArray = np.asarray(scalarArray, dtype=np.float64)
+    no_of_fibers, pts_per_fiber = scalarArray.shape
+
+    uniqueLabels, labelIdx = np.unique(clusterLabels, return_inverse=True)
+    no_of_clusters = len(uniqueLabels)
+
+    valid = ~np.isnan(scalarArray)
+    values = np.where(valid, scalarArray, 0.)
+
+    # Reduce over fibers of each cluster at each point
+    binIdx = (labelIdx[:, None] * pts_per_fiber +
+              np.arange(pts_per_fiber)[None, :]).ravel()
+    binShape = (no_of_clusters, pts_per_fiber)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count = _binSum(binIdx, valid, binShape)
+        sums = _binSum(binIdx, values, binShape)
+        mean = sums / count
+        dev = np.where(valid, scalarArray - mean[labelIdx], 0.)
+        std = np.sqrt(_binSum(binIdx, dev ** 2, binShape) / count)
+
+        clusterCount = count.sum(axis=1)
+        avg = sums.sum(axis=1) / clusterCount
+        dev = np.where(valid, scalarArray - avg[labelIdx][:, None], 0.)
+        stdev = np.sqrt(_binSum(binIdx, dev ** 2, binShape).sum(axis=1) /
+                        clusterCount)
+
+    clusterStats = {'labels': uniqueLabels, 'count': count.astype(np.int64),
+                    'mean': mean, 'std': std, 'avg': avg, 'stdev': stdev,
+                    'q': np.asarray(percentiles, dtype=np.float64),
+                    'percentiles': _clusterPercentiles(scalarArray, labelIdx,
+                                                       count, percentiles)}
+
+    return clusterStats
+
+def _binSum(binIdx, weights, binShape):
+    """ *INTERNAL FUNCTION*
+    Sums weights falling in each bin, returning sums in shape of bins.
+    """
+    return np.bincount(binIdx, weights=np.ravel(weights).astype(np.float64),
+                       minlength=int(np.prod(binShape))).reshape(binShape)
+
+def _clusterPercentiles(scalarArray, labelIdx, count, percentiles):
+    """ *INTERNAL FUNCTION*
+    Computes percentiles of every cluster at each sampled point, using linear
+    interpolation between closest ranks and ignoring NaN values.
+
+    INPUT:
+        scalarArray - array of scalar values indexed by fiber and point
+        labelIdx - array of cluster indices (0..K-1) for each fiber
+        count - number of non-NaN values of each cluster at each point
+        percentiles - percentiles to compute
+
+    OUTPUT:
+        clusterPercentiles - array of percentiles indexed by percentile,
+                             cluster and point
+    """
+    no_of_clusters, pts_per_fiber = count.shape
+    q = np.asarray(percentiles, dtype=np.float64)
+
+    clusterPercentiles = np.full((len(q), no_of_clusters, pts_per_fiber),
+                                 np.nan)
+    if len(q) == 0:
+        return clusterPercentiles
+
+    # Start of each cluster once fibers are grouped by cluster
+    clusterStart = np.zeros(no_of_clusters, dtype=np.int64)
+    clusterStart[1:] = np.cumsum(np.bincount(labelIdx,
+                                             minlength=no_of_clusters))[:-1]
+
+    for pidx in range(pts_per_fiber):
+        # Group by cluster, sorting values within clusters (NaN last)
+        sortedValues = scalarArray[np.lexsort((scalarArray[:, pidx],
+                                               labelIdx)), pidx]
+
+        n = count[:, pidx]
+        rank = q[:, None] / 100. * np.maximum(n - 1, 0)[None, :]
+        lo = np.floor(rank).astype(np.int64)
+        hi = np.minimum(lo + 1, np.maximum(n - 1, 0)[None, :].astype(np.int64))
+        frac = rank - lo
+
+        lower = sortedValues[clusterStart[None, :] + lo]
+        upper = sortedValues[clusterStart[None, :] + hi]
+        clusterPercentiles[:, :, pidx] = np.where(n[None, :] > 0,
+                                                  lower + frac * (upper - lower),
+                                                  np.nan)
+
+    return clusterPercentiles
+
+@misc.profiled('stats.writeStats')
+def writeStats(clusterStats, scalarType, dirpath=None):
+    """
+    Writes along-tract statistics of all clusters for a scalar type. The
+    average value at each sampled point of each cluster is written to a csv
+    file (one row per cluster) in a single write, with all statistics also
+    saved to a binary (.npz) table of the same name.
+
+    INPUT:
+        clusterStats - dictionary of statistics (from calcClusterStats)
+        scalarType - type of quantitative data
+        dirpath - location to store files; defaults None
+
+    OUTPUT:
+        none
+    """
+
+    if dirpath is None:
+        dirpath = os.getcwd()
+
+    statspath = dirpath + '/stats/'
+    if not os.path.exists(statspath):
+        os.makedirs(statspath)
+
+    fileName = scalarType.split('/', -1)[-1]
+    filePath = statspath + fileName
+
+    pts_per_fiber = clusterStats['mean'].shape[1]
+    table = np.column_stack((clusterStats['labels'], clusterStats['mean']))
+    header = ','.join(['Cluster ID'] +
+                      [str(idx) for idx in range(pts_per_fiber)])
+
+    rows = [header]
+    for row in table:
+        rows.append(','.join([str(int(row[0]))] +
+                             [repr(float(value)) for value in row[1:]]))
+
+    with open(filePath + '.csv', 'w') as f:
+        f.write('\n'.join(rows) + '\n')
+
+    np.savez(filePath + '.npz', **clusterStats)
+
+class GroupStats:
+    """
+    Streaming group-level along-tract statistics of each cluster. Running
+    counts, means and sums of squared deviations at each sampled point are
+    kept both pooled over fibers of all subjects and over the mean profiles
+    of subjects, such that contributions of subjects (or partial groups) can
+    be merged in any order. Labels of clusters are expected to correspond
+    across subjects (ie. subjects clustered with the same prior).
+    Value returned is of class GroupStats
+    """
+
+    def __init__(self):
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.subjects = []
+
+        # Pooled over fibers
+        self.count = None
+        self.mean = None
+        self.m2 = None
+
+        # Over mean profiles of subjects
+        self.subjectCount = None
+        self.subjectMean = None
+        self.subjectM2 = None
+
+    def _align(self, labels, pts_per_fiber):
+        """ *INTERNAL FUNCTION*
+        Extends stored statistics to include provided cluster labels,
+        returning indices of labels within stored statistics.
+        """
+        if self.count is None:
+            shape = (0, pts_per_fiber)
+            self.count, self.subjectCount = np.zeros(shape), np.zeros(shape)
+            self.mean, self.subjectMean = np.zeros(shape), np.zeros(shape)
+            self.m2, self.subjectM2 = np.zeros(shape), np.zeros(shape)
+        elif self.count.shape[1] != pts_per_fiber:
+            raise ValueError("Number of samples along fibers does not match "
+                             "group statistics.")
+
+        newLabels = np.union1d(self.labels, labels)
+        if len(newLabels) != len(self.labels):
+            oldIdx = np.searchsorted(newLabels, self.labels)
+            for attr in ('count', 'mean', 'm2', 'subjectCount', 'subjectMean',
+                         'subjectM2'):
+                values = np.zeros((len(newLabels), pts_per_fiber))
+                values[oldIdx] = getattr(self, attr)
+                setattr(self, attr, values)
+            self.labels = newLabels
+
+        return np.searchsorted(self.labels, labels)
+
+    def update(self, clusterStats, subjid=None):
+        """
+        Adds statistics of a single subject.
+
+        INPUT:
+            clusterStats - dictionary of statistics of subject (from
+                           calcClusterStats)
+            subjid - id of subject; subjects already added are skipped
+
+        OUTPUT:
+            none
+        """
+        if subjid is not None and subjid in self.subjects:
+            return
+
+        count = clusterStats['count'].astype(np.float64)
+        mean = np.where(count > 0, clusterStats['mean'], 0.)
+        m2 = np.where(count > 0, clusterStats['std'] ** 2 * count, 0.)
+
+        cidx = self._align(clusterStats['labels'], count.shape[1])
+
+        self.count[cidx], self.mean[cidx], self.m2[cidx] = \
+            _chanMerge(self.count[cidx], self.mean[cidx], self.m2[cidx],
+                       count, mean, m2)
+
+        # Subject profile as a single observation
+        subjectCount = (count > 0).astype(np.float64)
+        self.subjectCount[cidx], self.subjectMean[cidx], \
+            self.subjectM2[cidx] = _chanMerge(self.subjectCount[cidx],
+                                              self.subjectMean[cidx],
+                                              self.subjectM2[cidx],
+                                              subjectCount, mean,
+                                              np.zeros_like(mean))
+
+        if subjid is not None:
+            self.subjects.append(subjid)
+
+    def merge(self, groupStats):
+        """
+        Merges statistics of another (partial) group of subjects.
+
+        INPUT:
+            groupStats - group statistics of class GroupStats to be merged
+
+        OUTPUT:
+            none
+        """
+        if groupStats.count is None:
+            return
+
+        overlap = set(self.subjects).intersection(groupStats.subjects)
+        if overlap:
+            raise ValueError("Subjects %s are found in both groups."
+                             % ', '.join(sorted(overlap)))
+
+        cidx = self._align(groupStats.labels, groupStats.count.shape[1])
+
+        self.count[cidx], self.mean[cidx], self.m2[cidx] = \
+            _chanMerge(self.count[cidx], self.mean[cidx], self.m2[cidx],
+                       groupStats.count, groupStats.mean, groupStats.m2)
+        self.subjectCount[cidx], self.subjectMean[cidx], \
+            self.subjectM2[cidx] = _chanMerge(self.subjectCount[cidx],
+                                              self.subjectMean[cidx],
+                                              self.subjectM2[cidx],
+                                              groupStats.subjectCount,
+                                              groupStats.subjectMean,
+                                              groupStats.subjectM2)
+
+        self.subjects.extend(groupStats.subjects)
+
+    def getProfiles(self, subjectFlag=False):
+        """
+        Returns group statistics at each sampled point of each cluster.
+
+        INPUT:
+            subjectFlag - flag to return statistics over mean profiles of
+                          subjects instead of pooled over fibers; defaults
+                          False
+
+        OUTPUT:
+            labels - sorted cluster labels
+            count - number of values (fibers or subjects)
+            mean - group mean
+            std - group standard deviation
+        """
+        if subjectFlag:
+            count, mean, m2 = self.subjectCount, self.subjectMean, \
+                              self.subjectM2
+        else:
+            count, mean, m2 = self.count, self.mean, self.m2
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, mean, np.nan)
+            std = np.sqrt(m2 / count)
+
+        return self.labels, count.astype(np.int64), mean, std
+
+    def save(self, filePath):
+        """
+        Saves group statistics to a binary (.npz) store, replacing any
+        existing store atomically.
+
+        INPUT:
+            filePath - path of store to be written
+
+        OUTPUT:
+            none
+        """
+        dirpath = os.path.dirname(os.path.realpath(filePath))
+        if not os.path.exists(dirpath):
+            os.makedirs(dirpath)
+
+        fd, tmpPath = tempfile.mkstemp(suffix='.npz', dir=dirpath)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, labels=self.labels,
+                     subjects=np.array(self.subjects, dtype=str),
+                     count=self.count, mean=self.mean, m2=self.m2,
+                     subjectCount=self.subjectCount,
+                     subjectMean=self.subjectMean, subjectM2=self.subjectM2)
+        os.rename(tmpPath, filePath)
+
+def loadGroupStats(filePath):
+    """
+    Loads group statistics from a store; returns empty group statistics if
+    the store does not exist.
+
+    INPUT:
+        filePath - path of store
+
+    OUTPUT:
+        groupStats - group statistics of class GroupStats
+    """
+    groupStats = GroupStats()
+
+    if os.path.exists(filePath):
+        with np.load(filePath) as store:
+            groupStats.labels = store['labels']
+            groupStats.subjects = [str(subjid) for subjid in store['subjects']]
+            for attr in ('count', 'mean', 'm2', 'subjectCount', 'subjectMean',
+                         'subjectM2'):
+                setattr(groupStats, attr, store[attr])
+
+    return groupStats
+
+@misc.profiled('stats.updateGroupStats')
+def updateGroupStats(filePath, clusterStats, subjid=None):
+    """
+    Merges statistics of a single subject into a persistent group store.
+    Concurrent updates of the same store are serialized with a lock file.
+
+    INPUT:
+        filePath - path of store
+        clusterStats - dictionary of statistics of subject (from
+                       calcClusterStats)
+        subjid - id of subject; subjects already in store are skipped
+
+    OUTPUT:
+        groupStats - updated group statistics of class GroupStats
+    """
+    import fcntl
+
+    dirpath = os.path.dirname(os.path.realpath(filePath))
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+
+    with open(filePath + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        groupStats = loadGroupStats(filePath)
+        groupStats.update(clusterStats, subjid)
+        groupStats.save(filePath)
+
+    return groupStats
+
+def mergeGroupStats(filePaths, outPath=None):
+    """
+    Merges partial group stores (eg. written by parallel workers).
+
+    INPUT:
+        filePaths - list of paths of stores to be merged
+        outPath - path of merged store to be written; defaults None (not
+                  written)
+
+    OUTPUT:
+        groupStats - merged group statistics of class GroupStats
+    """
+    groupStats = GroupStats()
+    for filePath in filePaths:
+        groupStats.merge(loadGroupStats(filePath))
+
+    if outPath is not None:
+        groupStats.save(outPath)
+
+    return groupStats
+
+def _chanMerge(countA, meanA, m2A, countB, meanB, m2B):
+    """ *INTERNAL FUNCTION*
+    Merges running counts, means and sums of squared deviations of two sets
+    of values (Chan et al.).
+
+    INPUT:
+        countA, meanA, m2A - count, mean and sum of squared deviations of
+                             first set
+        countB, meanB, m2B - count, mean and sum of squared deviations of
+                             second set
+
+    OUTPUT:
+        count, mean, m2 - merged count, mean and sum of squared deviations
+    """
+    count = countA + countB
+    delta = meanB - meanA
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        weight = np.where(count > 0, countB / count, 0.)
+
+    mean = meanA + delta * weight
+    m2 = m2A + m2B + delta ** 2 * countA * weight
+
+    return count, mean, m2
+
+def loadStats(filePath):
+    """
+    Loads along-tract statistics saved by writeStats.
+
+    INPUT:
+        filePath - path to binary (.npz) table of statistics
+
+    OUTPUT:
+        clusterStats - dictionary of statistics
+        scalarType - type of quantitative data
+    """
+    with np.load(filePath) as statsFile:
+        clusterStats = dict((key, statsFile[key]) for key in statsFile.files)
+
+    scalarType = os.path.splitext(os.path.basename(filePath))[0]
+
+    return clusterStats, scalarType
+
+@misc.profiled('stats.plotClusterStats')
+def plotClusterStats(clusterStatsList, scalarTypeList, dirpath=None,
+                     n_jobs=-1):
+    """
+    Plots precomputed tract-based statistics of every cluster for each scalar
+    type, rendering plots in parallel processes. Plots of each cluster are
+    stored in a 'stats_<label>' directory.
+
+    INPUT:
+        clusterStatsList - list of dictionaries of statistics (from
+                           calcClusterStats), one per scalar type
+        scalarTypeList - list of types of quantitative data
+        dirpath - location to store plots; defaults None
+        n_jobs - number of processes used to render plots; defaults -1 (all
+                 cores)
+
+    OUTPUT:
+        none
+    """
+    from joblib import Parallel, delayed
+
+    if dirpath is None:
+        dirpath = os.getcwd()
+
+    plots = []
+    for clusterStats, scalarType in zip(clusterStatsList, scalarTypeList):
+        for cidx, label in enumerate(clusterStats['labels']):
+            labeldir = os.path.join(dirpath, 'stats_%i' % label)
+            if not os.path.exists(labeldir):
+                os.makedirs(labeldir)
+
+            plots.append((clusterStats['mean'][cidx],
+                          clusterStats['std'][cidx],
+                          clusterStats['avg'][cidx],
+                          clusterStats['stdev'][cidx], scalarType, labeldir))
+
+    Parallel(n_jobs=n_jobs)(delayed(_plotProfile)(*plot) for plot in plots)
+
+def plotStatsDir(dirpath, n_jobs=-1):
+    """
+    Plots tract-based statistics of every cluster from statistics saved with
+    writeStats, such that plots can be rendered separately from clustering.
+
+    INPUT:
+        dirpath - location statistics were written to and plots are stored
+        n_jobs - number of processes used to render plots; defaults -1 (all
+                 cores)
+
+    OUTPUT:
+        none
+    """
+    clusterStatsList, scalarTypeList = [], []
+    for filePath in sorted(glob.glob(os.path.join(dirpath, 'stats', '*.npz'))):
+        clusterStats, scalarType = loadStats(filePath)
+        clusterStatsList.append(clusterStats)
+        scalarTypeList.append(scalarType)
+
+    plotClusterStats(clusterStatsList, scalarTypeList, dirpath, n_jobs)
+
 def plotStats(fiberTree, scalarType, idxes=None, dirpath=None):
     """
     Plots the calculated tract-based statistics for each fiber bundle
@@ -200,35 +789,57 @@ def plotStats(fiberTree, scalarType, idxes=None, dirpath=None):
             os.makedirs(dirpath)
 
     # Statistical calculations for plot
-    x = range(fiberTree.pts_per_fiber)
     yavg, avg = _mean(fiberTree, scalarType, idxes)
     ystd, stdev = _stddev(fiberTree, scalarType, idxes)
 
-    # Plot of stats
-    f = plt.figure(figsize=(10, 10))
-    plt.grid()
+    _plotProfile(yavg, ystd, avg, stdev, scalarType, dirpath)
 
-    avgline = plt.plot(x, yavg, 'b', linewidth=3, label='Mean')
-    avgdot = plt.plot(x, yavg, '.r', markersize=15)
-    stdupper = plt.plot(x, yavg+ystd, 'k', linewidth=2, alpha=0.7)
-    stdlower = plt.plot(x, yavg-ystd, 'k', linewidth=2, alpha=0.7,
-                        label='Std. Dev')
-    plt.fill_between(x, yavg-ystd, yavg+ystd, facecolor='grey', alpha=0.7)
-    plt.xlim(min(x), max(x))
+def _plotProfile(yavg, ystd, avg, stdev, scalarType, dirpath):
+    """ *INTERNAL FUNCTION*
+    Renders plot of a tract-based profile with the Agg backend, without
+    using pyplot such that plots can be rendered concurrently.
+
+    INPUT:
+        yavg - average at each sampled point
+        ystd - standard deviation at each sampled point
+        avg - average of all sampled points
+        stdev - standard deviation of all sampled points
+        scalarType - type of quantitative data to plot
+        dirpath - location to store plot
+
+    OUTPUT:
+        none
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    x = range(len(yavg))
+
+    # Plot of stats
+    f = Figure(figsize=(10, 10))
+    FigureCanvasAgg(f)
+    ax = f.add_subplot(111)
+    ax.grid()
+
+    ax.plot(x, yavg, 'b', linewidth=3, label='Mean')
+    ax.plot(x, yavg, '.r', markersize=15)
+    ax.plot(x, yavg+ystd, 'k', linewidth=2, alpha=0.7)
+    ax.plot(x, yavg-ystd, 'k', linewidth=2, alpha=0.7, label='Std. Dev')
+    ax.fill_between(x, yavg-ystd, yavg+ystd, facecolor='grey', alpha=0.7)
+    ax.set_xlim(min(x), max(x))
 
     # Plot labels
     fileName = scalarType.split('/', -1)[-1]
     title = fileName + ' (%.2f +/- %.2f)' % (avg, stdev)
     ytitle = fileName
 
-    plt.title(title, fontsize=16)
-    plt.ylabel(ytitle.upper(), fontsize=14)
-    plt.xlabel('Fiber Samples', fontsize=14)
-    plt.legend(loc='upper left', fontsize=14)
-    plt.tick_params(axis='both', which='major', labelsize=14,
-                    length=10, pad=10, width=1, direction='out',
-                    top='off', right='off')
+    ax.set_title(title, fontsize=16)
+    ax.set_ylabel(ytitle.upper(), fontsize=14)
+    ax.set_xlabel('Fiber Samples', fontsize=14)
+    ax.legend(loc='upper left', fontsize=14)
+    ax.tick_params(axis='both', which='major', labelsize=14,
+                   length=10, pad=10, width=1, direction='out',
+                   top=False, right=False)
 
     # Save figure
-    plt.savefig(dirpath + '/' + fileName + '_stats.png')
-    plt.close(f)
+    f.savefig(dirpath + '/' + fileName + '_stats.png')
@@ -5,9 +5,56 @@ Module provides input/output functionality
 """
 
 import os.path as op
-import vtk
+import numpy as np
+from collections import OrderedDict
 from . import misc
 
+# Data types of legacy VTK files; binary data is stored big-endian
+_vtkDataTypes = {'bit': 'u1', 'unsigned_char': 'u1', 'char': 'i1',
+                 'short': '>i2', 'unsigned_short': '>u2', 'int': '>i4',
+                 'signed_char': 'i1', 'unsigned_int': '>u4', 'long': '>i8',
+                 'unsigned_long': '>u8',
+                 'vtktypeint64': '>i8', 'vtktypeuint64': '>u8',
+                 'float': '>f4', 'double': '>f8'}
+
+# Data read ahead of use (see prefetch), keyed by path of file
+_prefetched = {}
+
+# VTK data types written for numpy arrays, as named by vtkPolyDataWriter
+_numpyDataTypes = {'u1': 'unsigned_char', 'i1': 'signed_char',
+                   'i2': 'short', 'u2': 'unsigned_short', 'i4': 'int',
+                   'u4': 'unsigned_int', 'i8': 'long', 'u8': 'unsigned_long',
+                   'f4': 'float', 'f8': 'double'}
+
+class PolyData:
+    """
+    Tractography polydata stored as numpy arrays, with fibers described by
+    offsets into point connectivity.
+    Value returned is of class PolyData
+    """
+
+    def __init__(self, points=None, offsets=None, connectivity=None):
+        if points is None:
+            points = np.zeros((0, 3), dtype=np.float32)
+        if offsets is None:
+            offsets = np.zeros(1, dtype=np.int64)
+        if connectivity is None:
+            connectivity = np.zeros(0, dtype=np.int64)
+
+        self.points = points
+        self.offsets = offsets
+        self.connectivity = connectivity
+
+        # Arrays stored per fiber and per point
+        self.cellData = OrderedDict()
+        self.pointData = OrderedDict()
+
+    def getNumberOfLines(self):
+        """
+        Returns number of fibers stored within polydata.
+        """
+        return len(self.offsets) - 1
+
 def readVTK(in_vtk, verbose=0):
     """
     Reads vtkPolyData containing tractography
@@ -25,6 +72,7 @@ def readVTK(in_vtk, verbose=0):
     if (ext == ".vtk"):
         misc.vprint("Reading %s..." % in_vtk, verbose)
 
+        import vtk
         vtk_reader = vtk.vtkPolyDataReader()
         vtk_reader.SetFileName(in_vtk)
         vtk_reader.Update()
@@ -39,12 +87,596 @@ def readVTK(in_vtk, verbose=0):
     else:
         raise IOError("Invalid / unrecognized file format.")
 
+def readVTKInfo(in_vtk, verbose=0):
+    """
+    Reads information of legacy vtkPolyData containing tractography from the
+    file headers only, skipping over stored data without decoding.
+
+    INPUT:
+        in_vtk - input file of .vtk type containing tractography
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        vtkInfo - dictionary with number of fibers ('no_of_fibers'), number
+                  of points ('no_of_points'), points per fiber
+                  ('pts_per_fiber') and names of arrays stored per fiber
+                  ('cellData') and per point ('pointData')
+    """
+
+    filename, ext = op.splitext(in_vtk)
+
+    if (ext == ".vtk"):
+        misc.vprint("Reading header of %s..." % in_vtk, verbose)
+
+        vtkInfo = {'no_of_fibers': 0, 'no_of_points': 0, 'pts_per_fiber': 0,
+                   'cellData': [], 'pointData': []}
+
+        with open(in_vtk, 'rb') as f:
+            for block in _scanVTK(f):
+                if block['section'] == 'POINTS':
+                    vtkInfo['no_of_points'] = block['shape'][0]
+                elif block['section'] == 'LINES' and \
+                     block['name'] in ('OFFSETS', 'CELLS'):
+                    vtkInfo['no_of_fibers'] = block['no_of_cells']
+                elif block['section'] == 'CELL_DATA':
+                    vtkInfo['cellData'].append(block['name'])
+                elif block['section'] == 'POINT_DATA':
+                    vtkInfo['pointData'].append(block['name'])
+
+        if vtkInfo['no_of_fibers'] > 0:
+            vtkInfo['pts_per_fiber'] = \
+                int(vtkInfo['no_of_points'] / vtkInfo['no_of_fibers'])
+
+        misc.vprint("Number of fibers found: %d." % vtkInfo['no_of_fibers'],
+                    verbose)
+
+        return vtkInfo
+
+    else:
+        raise IOError("Invalid / unrecognized file format.")
+
+@misc.profiled('tractio.readPolyData')
+def readPolyData(in_vtk, verbose=0, pts_per_fiber=None):
+    """
+    Reads tractography directly into numpy arrays. Binary legacy .vtk files
+    are decoded natively; other .vtk files are read with vtkPolyDataReader.
+    MRtrix (.tck) and TrackVis (.trk) tractograms are streamed with nibabel,
+    with points in world (RAS+ mm) coordinates.
+
+    If pts_per_fiber is given, fibers are resampled as in
+    fibers.resamplePolyData; .tck and .trk tractograms are then resampled
+    chunk by chunk, so that all of their points are never held at once.
+    Resampled polydata keeps no point data and cannot be paired with
+    scalars stored per point of the original tractography.
+
+    INPUT:
+        in_vtk - input file of .vtk, .tck or .trk type containing tractography
+        verbose - verbosity of function; defaults 0
+        pts_per_fiber - number of points to resample each fiber to; defaults
+                        None (all points are read)
+
+    OUTPUT:
+        polyData - polydata stored within file, of class PolyData
+    """
+
+    if _prefetched:
+        polyData = _prefetched.pop(op.realpath(in_vtk), None)
+        if polyData is not None:
+            return _resample(polyData, pts_per_fiber)
+
+    filename, ext = op.splitext(in_vtk)
+
+    if (ext in (".tck", ".trk")):
+        return _readStreamlines(in_vtk, verbose, pts_per_fiber=pts_per_fiber)
+
+    elif (ext == ".vtk"):
+        misc.vprint("Reading %s..." % in_vtk, verbose)
+
+        with open(in_vtk, 'rb') as f:
+            blocks = list(_scanVTK(f))
+
+        if not all(block['binary'] for block in blocks):
+            return _resample(polyDataFromVTK(readVTK(in_vtk)), pts_per_fiber)
+
+        polyData = PolyData()
+        vtkData = np.memmap(in_vtk, dtype=np.uint8, mode='r')
+
+        for block in blocks:
+            data = _readVTKData(vtkData, block)
+
+            if block['section'] == 'POINTS':
+                polyData.points = data
+            elif block['section'] == 'LINES':
+                if block['name'] == 'OFFSETS':
+                    polyData.offsets = data.astype(np.int64)
+                elif block['name'] == 'CONNECTIVITY':
+                    polyData.connectivity = data.astype(np.int64)
+                else:
+                    polyData.offsets, polyData.connectivity = \
+                        _cellsToOffsets(data, block['no_of_cells'])
+            elif block['section'] == 'CELL_DATA':
+                polyData.cellData[block['name']] = data
+            elif block['section'] == 'POINT_DATA':
+                polyData.pointData[block['name']] = data
+            else:
+                raise IOError("Only polydata with lines is supported.")
+
+        del vtkData
+
+        misc.vprint("Finished reading %s." % in_vtk, verbose)
+        misc.vprint("Number of fibers found: %d." %
+                    polyData.getNumberOfLines(), verbose)
+
+        return _resample(polyData, pts_per_fiber)
+
+    else:
+        raise IOError("Invalid / unrecognized file format.")
+
+def _resample(polyData, pts_per_fiber):
+    """ *INTERNAL FUNCTION*
+    Resamples polydata to given number of points along each fiber, if any.
+
+    INPUT:
+        polyData - tractography polydata of class PolyData
+        pts_per_fiber - number of points to resample each fiber to, or None
+
+    OUTPUT:
+        polyData - (resampled) tractography polydata of class PolyData
+    """
+    if pts_per_fiber is None:
+        return polyData
+
+    from .fibers import resamplePolyData
+
+    return resamplePolyData(polyData, pts_per_fiber)
+
+def _readStreamlines(in_tract, verbose=0, chunk_size=10000,
+                     pts_per_fiber=None):
+    """ *INTERNAL FUNCTION*
+    Streams streamlines of a .tck or .trk tractogram into numpy arrays,
+    without materializing any intermediate file. Unless pts_per_fiber is
+    given, points of all streamlines are merged and held at once; otherwise
+    each chunk is resampled before being merged.
+
+    INPUT:
+        in_tract - input file of .tck or .trk type containing tractography
+        verbose - verbosity of function; defaults 0
+        chunk_size - number of streamlines gathered before being merged;
+                     defaults 10000
+        pts_per_fiber - number of points to resample each fiber to; defaults
+                        None (all points are kept)
+
+    OUTPUT:
+        polyData - tractography polydata of class PolyData
+    """
+    from nibabel import streamlines
+
+    misc.vprint("Reading %s..." % in_tract, verbose)
+
+    tractogram = streamlines.load(in_tract, lazy_load=True).tractogram
+
+    def mergeChunk(chunk):
+        points = np.concatenate(chunk).astype(np.float32)
+        chunkData = PolyData(
+            points=points,
+            offsets=np.r_[0, np.cumsum([len(sl) for sl in chunk])
+                          ].astype(np.int64),
+            connectivity=np.arange(len(points), dtype=np.int64))
+        chunkData = _resample(chunkData, pts_per_fiber)
+
+        ptsChunks.append(chunkData.points)
+        lengths.extend(np.diff(chunkData.offsets))
+
+    ptsChunks, lengths, chunk = [], [], []
+    for streamline in tractogram.streamlines:
+        chunk.append(streamline)
+
+        if len(chunk) == chunk_size:
+            mergeChunk(chunk)
+            chunk = []
+
+    if len(chunk) > 0:
+        mergeChunk(chunk)
+
+    polyData = PolyData()
+    if len(ptsChunks) > 0:
+        polyData.points = np.concatenate(ptsChunks)
+
+    polyData.offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    polyData.offsets[1:] = np.cumsum(lengths)
+    polyData.connectivity = np.arange(polyData.offsets[-1], dtype=np.int64)
+
+    misc.vprint("Finished reading %s." % in_tract, verbose)
+    misc.vprint("Number of fibers found: %d." % polyData.getNumberOfLines(),
+                verbose)
+
+    return polyData
+
+def _readVTKData(vtkData, block):
+    """ *INTERNAL FUNCTION*
+    Decodes binary array described by block into a native-endian numpy
+    array; arrays with a single component are returned flat.
+
+    INPUT:
+        vtkData - contents of .vtk file as an array of bytes
+        block - dictionary describing stored array (from _scanVTK)
+
+    OUTPUT:
+        data - decoded array
+    """
+    if block['dataType'] == 'bit':
+        raise IOError("Unsupported VTK data type bit.")
+
+    dtype = np.dtype(_vtkDataTypes[block['dataType']])
+    nValues = int(np.prod(block['shape']))
+
+    data = np.frombuffer(vtkData, dtype=dtype, count=nValues,
+                         offset=block['offset'])
+    data = data.astype(dtype.newbyteorder('='))
+
+    if len(block['shape']) > 1 and block['shape'][1] > 1:
+        data = data.reshape(block['shape'])
+
+    return data
+
+def _cellsToOffsets(cells, no_of_cells):
+    """ *INTERNAL FUNCTION*
+    Converts cells stored in legacy layout (number of points of each cell
+    followed by its point ids) to offsets and connectivity.
+
+    INPUT:
+        cells - array of cells in legacy layout
+        no_of_cells - number of cells stored
+
+    OUTPUT:
+        offsets - array of offsets of each cell into connectivity
+        connectivity - array of point ids of all cells
+    """
+    cells = cells.astype(np.int64)
+
+    if no_of_cells == 0:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    # Fibers resampled to equal number of points
+    cellLength = int(cells[0])
+    if len(cells) == no_of_cells * (cellLength + 1) and \
+       np.all(cells[::cellLength + 1] == cellLength):
+        offsets = np.arange(no_of_cells + 1, dtype=np.int64) * cellLength
+        connectivity = cells.reshape(no_of_cells, cellLength + 1)[:, 1:]
+
+        return offsets, connectivity.ravel()
+
+    # Point ids usually run in sequence across cells: each cell then starts
+    # where the sequence breaks and resumes right after its size
+    breaks = np.flatnonzero(np.diff(cells[:-1]) != 1) + 1
+    breaks = breaks[cells[breaks + 1] == cells[breaks - 1] + 1]
+    cellStarts = np.r_[0, breaks]
+
+    # Cells located from the sizes read at their starts must chain exactly
+    # from first to last; otherwise, cells are traversed one by one
+    offsets = None
+    if len(cellStarts) == no_of_cells:
+        offsets = np.zeros(no_of_cells + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(cells[cellStarts])
+        if offsets[-1] + no_of_cells != len(cells) or \
+           np.any(cellStarts != offsets[:-1] + np.arange(no_of_cells)):
+            offsets = None
+
+    if offsets is None:
+        cellLengths = np.zeros(no_of_cells, dtype=np.int64)
+        idx = 0
+        for cidx in range(no_of_cells):
+            cellLengths[cidx] = cells[idx]
+            idx += cells[idx] + 1
+
+        offsets = np.zeros(no_of_cells + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(cellLengths)
+
+    connectivity = np.delete(cells, offsets[:-1] + np.arange(no_of_cells))
+
+    return offsets, connectivity
+
+def _offsetsToCells(offsets, connectivity, dtype):
+    """ *INTERNAL FUNCTION*
+    Converts offsets and connectivity to cells stored in legacy layout
+    (number of points of each cell followed by its point ids).
+
+    INPUT:
+        offsets - array of offsets of each cell into connectivity
+        connectivity - array of point ids of all cells
+        dtype - data type of output array
+
+    OUTPUT:
+        cells - array of cells in legacy layout
+    """
+    no_of_cells = len(offsets) - 1
+
+    cells = np.zeros(no_of_cells + len(connectivity), dtype=dtype)
+    cellIdx = offsets[:-1] + np.arange(no_of_cells)
+    cells[cellIdx] = np.diff(offsets)
+
+    cellMask = np.ones(len(cells), dtype=bool)
+    cellMask[cellIdx] = False
+    cells[cellMask] = connectivity
+
+    return cells
+
+def polyDataFromVTK(vtkPolyData):
+    """
+    Converts vtkPolyData containing tractography to numpy arrays.
+
+    INPUT:
+        vtkPolyData - tractography polydata in VTK form
+
+    OUTPUT:
+        polyData - tractography polydata of class PolyData
+    """
+    from vtk.util import numpy_support
+
+    polyData = PolyData()
+
+    if vtkPolyData.GetPoints() is not None:
+        polyData.points = \
+            numpy_support.vtk_to_numpy(vtkPolyData.GetPoints().GetData())
+
+    lines = vtkPolyData.GetLines()
+    if hasattr(lines, 'GetOffsetsArray'):
+        polyData.offsets = numpy_support.vtk_to_numpy(
+            lines.GetOffsetsArray()).astype(np.int64)
+        polyData.connectivity = numpy_support.vtk_to_numpy(
+            lines.GetConnectivityArray()).astype(np.int64)
+        if len(polyData.offsets) == 0:
+            polyData.offsets = np.zeros(1, dtype=np.int64)
+    else:
+        polyData.offsets, polyData.connectivity = \
+            _cellsToOffsets(numpy_support.vtk_to_numpy(lines.GetData()),
+                            lines.GetNumberOfCells())
+
+    for vtkData, data in ((vtkPolyData.GetCellData(), polyData.cellData),
+                          (vtkPolyData.GetPointData(), polyData.pointData)):
+        for aidx in range(vtkData.GetNumberOfArrays()):
+            vtkArray = vtkData.GetAbstractArray(aidx)
+            data[vtkArray.GetName()] = numpy_support.vtk_to_numpy(vtkArray)
+
+    return polyData
+
+def polyDataToVTK(polyData):
+    """
+    Converts tractography stored as numpy arrays to vtkPolyData.
+
+    INPUT:
+        polyData - tractography polydata of class PolyData
+
+    OUTPUT:
+        vtkPolyData - tractography polydata in VTK form
+    """
+    import vtk
+    from vtk.util import numpy_support
+
+    vtkPolyData = vtk.vtkPolyData()
+
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_support.numpy_to_vtk(polyData.points, deep=1))
+    vtkPolyData.SetPoints(vtkPoints)
+
+    no_of_lines = polyData.getNumberOfLines()
+    cells = _offsetsToCells(polyData.offsets, polyData.connectivity,
+                            np.int64)
+
+    vtkLines = vtk.vtkCellArray()
+    vtkLines.SetCells(no_of_lines,
+                      numpy_support.numpy_to_vtkIdTypeArray(cells, deep=1))
+    vtkPolyData.SetLines(vtkLines)
+
+    for data, vtkData in ((polyData.cellData, vtkPolyData.GetCellData()),
+                          (polyData.pointData, vtkPolyData.GetPointData())):
+        for name, array in data.items():
+            vtkArray = numpy_support.numpy_to_vtk(np.ascontiguousarray(array),
+                                                  deep=1)
+            vtkArray.SetName(name)
+            vtkData.AddArray(vtkArray)
+
+    return vtkPolyData
+
+def _scanVTK(f):
+    """ *INTERNAL FUNCTION*
+    Generator traversing sections of a legacy .vtk polydata file. Stored data
+    of each section is skipped without being decoded.
+
+    INPUT:
+        f - file object of .vtk file opened in binary mode
+
+    OUTPUT:
+        block - dictionary describing each stored array with the section
+                ('POINTS', 'LINES', 'CELL_DATA', 'POINT_DATA', ...), name,
+                VTK data type, shape, byte offset of data within the file and
+                whether data is stored in binary
+    """
+    header = f.readline().decode('latin-1')
+    if not header.startswith('# vtk DataFile'):
+        raise IOError("Invalid / unrecognized file format.")
+    version = float(header.split()[-1])
+
+    f.readline()
+    binary = _readTokens(f)[0].upper() == 'BINARY'
+
+    dataset = _readTokens(f)
+    if len(dataset) < 2 or dataset[1].upper() != 'POLYDATA':
+        raise IOError("Only VTK polydata is supported.")
+
+    section, count = 'FIELD', 0
+
+    while True:
+        tokens = _readTokens(f)
+        if tokens is None:
+            break
+
+        key = tokens[0].upper()
+
+        if key == 'POINTS':
+            yield _skipVTKData(f, 'POINTS', 'POINTS', tokens[2],
+                               (int(tokens[1]), 3), binary)
+
+        elif key in ('VERTICES', 'LINES', 'POLYGONS', 'TRIANGLE_STRIPS'):
+            if version >= 5.0:
+                offsetTokens = _readTokens(f)
+                offsets = _skipVTKData(f, key, 'OFFSETS', offsetTokens[1],
+                                       (int(tokens[1]),), binary)
+                offsets['no_of_cells'] = max(int(tokens[1]) - 1, 0)
+                yield offsets
+
+                connTokens = _readTokens(f)
+                yield _skipVTKData(f, key, 'CONNECTIVITY', connTokens[1],
+                                   (int(tokens[2]),), binary)
+            else:
+                cells = _skipVTKData(f, key, 'CELLS', 'int',
+                                     (int(tokens[2]),), binary)
+                cells['no_of_cells'] = int(tokens[1])
+                yield cells
+
+        elif key in ('CELL_DATA', 'POINT_DATA'):
+            section, count = key, int(tokens[1])
+
+        elif key == 'FIELD':
+            nArrays = int(tokens[2])
+            while nArrays > 0:
+                arrayTokens = _readTokens(f)
+                if arrayTokens[0].upper() == 'METADATA':
+                    _skipVTKMetadata(f)
+                    continue
+
+                nArrays -= 1
+                if arrayTokens[0].upper() == 'NULL_ARRAY':
+                    continue
+
+                yield _skipVTKData(f, section, _decodeName(arrayTokens[0]),
+                                   arrayTokens[3], (int(arrayTokens[2]),
+                                   int(arrayTokens[1])), binary)
+
+        elif key == 'SCALARS':
+            ncomp = int(tokens[3]) if len(tokens) > 3 else 1
+            _readTokens(f)  # LOOKUP_TABLE
+            yield _skipVTKData(f, section, tokens[1], tokens[2],
+                               (count, ncomp), binary)
+
+        elif key == 'COLOR_SCALARS':
+            dataType = 'unsigned_char' if binary else 'float'
+            yield _skipVTKData(f, section, tokens[1], dataType,
+                               (count, int(tokens[2])), binary)
+
+        elif key in ('VECTORS', 'NORMALS', 'TENSORS', 'TENSORS6'):
+            ncomp = {'VECTORS': 3, 'NORMALS': 3, 'TENSORS': 9,
+                     'TENSORS6': 6}[key]
+            yield _skipVTKData(f, section, tokens[1], tokens[2],
+                               (count, ncomp), binary)
+
+        elif key == 'TEXTURE_COORDINATES':
+            yield _skipVTKData(f, section, tokens[1], tokens[3],
+                               (count, int(tokens[2])), binary)
+
+        elif key == 'LOOKUP_TABLE':
+            dataType = 'unsigned_char' if binary else 'float'
+            _skipVTKData(f, section, tokens[1], dataType,
+                         (int(tokens[2]), 4), binary)
+
+        elif key == 'METADATA':
+            _skipVTKMetadata(f)
+
+        else:
+            raise IOError("Unsupported VTK section %s." % tokens[0])
+
+def _readTokens(f):
+    """ *INTERNAL FUNCTION*
+    Reads next non-empty line of file, returning its tokens; returns None at
+    end of file.
+    """
+    while True:
+        line = f.readline()
+        if not line:
+            return None
+
+        tokens = line.decode('latin-1').split()
+        if tokens:
+            return tokens
+
+def _skipVTKData(f, section, name, dataType, shape, binary):
+    """ *INTERNAL FUNCTION*
+    Describes data stored at the current position of file and moves past it.
+
+    INPUT:
+        f - file object of .vtk file opened in binary mode
+        section - section data belongs to
+        name - name of array
+        dataType - VTK data type of array
+        shape - shape of array (tuples, components)
+        binary - flag indicating data is stored in binary
+
+    OUTPUT:
+        block - dictionary describing stored array
+    """
+    dataType = dataType.lower()
+    if dataType not in _vtkDataTypes:
+        raise IOError("Unsupported VTK data type %s." % dataType)
+
+    block = {'section': section, 'name': name, 'dataType': dataType,
+             'shape': shape, 'offset': f.tell(), 'binary': binary}
+
+    nValues = int(np.prod(shape))
+    if not binary:
+        while nValues > 0:
+            nValues -= len(f.readline().split())
+    elif dataType == 'bit':
+        f.seek((nValues + 7) // 8, 1)
+    else:
+        f.seek(nValues * np.dtype(_vtkDataTypes[dataType]).itemsize, 1)
+
+    return block
+
+def _skipVTKMetadata(f):
+    """ *INTERNAL FUNCTION*
+    Moves past metadata of an array, which ends with an empty line.
+    """
+    while True:
+        line = f.readline()
+        if not line or not line.strip():
+            return
+
+def _decodeName(name):
+    """ *INTERNAL FUNCTION*
+    Decodes characters escaped as %XX within names of legacy VTK arrays.
+    """
+    if '%' not in name:
+        return name
+
+    decoded, idx = '', 0
+    while idx < len(name):
+        if name[idx] == '%' and idx + 2 < len(name):
+            decoded += chr(int(name[idx + 1:idx + 3], 16))
+            idx += 3
+        else:
+            decoded += name[idx]
+            idx += 1
+
+    return decoded
+
+def _encodeName(name):
+    """ *INTERNAL FUNCTION*
+    Escapes whitespace, non-printable characters and '%' within names of
+    legacy VTK arrays as %XX.
+    """
+    return ''.join(c if ' ' < c <= '~' and c != '%' else '%%%02X' % ord(c)
+                   for c in name)
+
+@misc.profiled('tractio.writeVTK')
 def writeVTK(in_data, vtk_file, verbose=0):
     """
-    Write tractography data into vtkPolyData
+    Write tractography data into vtkPolyData. All files are written in the
+    binary legacy format version 4.2; polydata of class PolyData is written
+    natively in the same layout as vtkPolyDataWriter.
 
     INPUT:
-        in_data - tractography data to be written to file
+        in_data - tractography data (vtkPolyData or PolyData) to be written
+                  to file
         vtk_file - name of file to be written
         verbose - verbosity of function; defaults 0
 
@@ -57,8 +689,16 @@ def writeVTK(in_data, vtk_file, verbose=0):
     if (ext == ".vtk"):
         misc.vprint("Writing %s ..." % vtk_file, verbose)
 
+        if isinstance(in_data, PolyData):
+            _writePolyData(in_data, vtk_file)
+            return
+
+        import vtk
         vtk_writer = vtk.vtkPolyDataWriter()
         vtk_writer.SetFileTypeToBinary()
+        # Newer versions of VTK default to format version 5.1
+        if hasattr(vtk_writer, 'SetFileVersion'):
+            vtk_writer.SetFileVersion(42)
         vtk_writer.SetFileName(vtk_file)
         vtk_writer.SetInputData(in_data)
         vtk_writer.Update()
@@ -68,30 +708,92 @@ def writeVTK(in_data, vtk_file, verbose=0):
     else:
         raise IOError("Invalid file format.")
 
+def _writePolyData(polyData, vtk_file):
+    """ *INTERNAL FUNCTION*
+    Writes polydata stored as numpy arrays into a binary legacy .vtk file
+    (version 4.2), following the layout of vtkPolyDataWriter.
+
+    INPUT:
+        polyData - tractography polydata of class PolyData
+        vtk_file - name of file to be written
+
+    OUTPUT:
+        none
+    """
+    no_of_points = len(polyData.points)
+    no_of_lines = polyData.getNumberOfLines()
+
+    with open(vtk_file, 'wb') as f:
+        f.write(b"# vtk DataFile Version 4.2\nvtk output\nBINARY\n"
+                b"DATASET POLYDATA\n")
+
+        f.write(("POINTS %d %s\n" % (no_of_points,
+                 _numpyDataTypes[polyData.points.dtype.str[1:]])).encode())
+        _writeVTKData(f, polyData.points)
+
+        if no_of_lines > 0:
+            cells = _offsetsToCells(polyData.offsets, polyData.connectivity,
+                                    np.int32)
+
+            f.write(("LINES %d %d\n" % (no_of_lines, len(cells))).encode())
+            _writeVTKData(f, cells)
+
+        for section, data, count in (
+                ('CELL_DATA', polyData.cellData, no_of_lines),
+                ('POINT_DATA', polyData.pointData, no_of_points)):
+            if count == 0 or len(data) == 0:
+                continue
+
+            f.write(("%s %d\nFIELD FieldData %d\n" %
+                    (section, count, len(data))).encode())
+
+            for name, array in data.items():
+                ncomp = 1 if array.ndim == 1 else array.shape[1]
+                f.write(("%s %d %d %s\n" % (_encodeName(name), ncomp,
+                         len(array), _numpyDataTypes[array.dtype.str[1:]])
+                        ).encode())
+                _writeVTKData(f, array)
+
+def _writeVTKData(f, array):
+    """ *INTERNAL FUNCTION*
+    Writes array to file as a single big-endian buffer followed by newline.
+    """
+    f.write(np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('>'))
+            .tobytes())
+    f.write(b"\n")
+
 def readScalar(scalar_file, verbose=0):
     """
-    Read input text file containing scalar values assocaited with tractography
+    Read input file containing scalar values associated with tractography.
+    Scalars are stored one value per point, either as text (.txt), a numpy
+    array (.npy) or raw big-endian doubles (.bdouble, eg. Camino tractstats).
 
     INPUT:
-        scalar_file - text file containing quantitative scalar information
+        scalar_file - file containing quantitative scalar information
         verbose - verbosity of function; defaults 0
 
     OUTPUT:
-        scalar_data - list of scalar values from file
+        scalar_data - array of scalar values from file
         scalar_type - type of scalar information (eg. FA, MD, T1)
     """
 
+    if _prefetched:
+        scalar = _prefetched.pop(op.realpath(scalar_file), None)
+        if scalar is not None:
+            return scalar
+
     scalar_type, ext = op.splitext(scalar_file)
 
-    if (ext == '.txt'):
+    if (ext in ('.txt', '.npy', '.bdouble')):
         misc.vprint("Reading %s..." % scalar_file, verbose)
 
-        file_reader = open(scalar_file, 'rU')
-        scalar_data = file_reader.readlines()
-        file_reader.close()
-
-        for i in range(len(scalar_data)):
-            scalar_data[i] = scalar_data[i].rstrip('\n')
+        if ext == '.txt':
+            scalar_data = np.fromfile(scalar_file, dtype=np.float32, sep=' ')
+        elif ext == '.npy':
+            scalar_data = np.load(scalar_file).astype(np.float32).ravel()
+        else:
+            scalar_data = np.fromfile(scalar_file, dtype='>f8')
+            scalar_data = scalar_data.astype(np.float32)
 
         scalar_type = scalar_type.split('_', -1)[-1]
 
@@ -101,3 +803,358 @@ def readScalar(scalar_file, verbose=0):
 
     else:
         raise IOError("Invalid / unreognized file.")
+
+def writeScalar(scalar_data, scalar_file, verbose=0):
+    """
+    Write scalar values associated with tractography, one value per point,
+    as text (.txt), a numpy array (.npy) or raw big-endian doubles
+    (.bdouble).
+
+    INPUT:
+        scalar_data - array of scalar values to be written
+        scalar_file - name of file to be written
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        none
+    """
+
+    filename, ext = op.splitext(scalar_file)
+
+    if (ext in ('.txt', '.npy', '.bdouble')):
+        misc.vprint("Writing %s..." % scalar_file, verbose)
+
+        scalar_data = np.asarray(scalar_data).ravel()
+
+        if ext == '.txt':
+            np.savetxt(scalar_file, scalar_data, fmt='%.9g')
+        elif ext == '.npy':
+            np.save(scalar_file, scalar_data.astype(np.float32))
+        else:
+            scalar_data.astype('>f8').tofile(scalar_file)
+
+        return
+
+    else:
+        raise IOError("Invalid file format.")
+
+@misc.profiled('tractio.readScalars')
+def readScalars(scalar_files, n_jobs=-1, verbose=0):
+    """
+    Read multiple files containing scalar values associated with tractography
+    concurrently.
+
+    INPUT:
+        scalar_files - list of files containing quantitative scalar
+                       information
+        n_jobs - number of files to read in parallel; defaults -1 (all cores)
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        scalarDataList - list of arrays of scalar values, in order of files
+        scalarTypeList - list of types of scalar information
+    """
+    from joblib import Parallel, delayed
+
+    scalars = Parallel(n_jobs=n_jobs, backend='threading')(
+        delayed(readScalar)(scalar_file, verbose)
+        for scalar_file in scalar_files)
+
+    scalarDataList = [scalar[0] for scalar in scalars]
+    scalarTypeList = [scalar[1] for scalar in scalars]
+
+    return scalarDataList, scalarTypeList
+
+def prefetch(in_files, verbose=0):
+    """
+    Reads tractography and scalar files ahead of use (eg. in a background
+    thread while other data is processed). The next readPolyData or
+    readScalar call of each file returns the prefetched data instead of
+    reading the file again.
+
+    INPUT:
+        in_files - list of tractography (.vtk, .tck, .trk) and scalar
+                   (.txt, .npy, .bdouble) files
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        none
+    """
+    for in_file in in_files:
+        if op.splitext(in_file)[1] in ('.txt', '.npy', '.bdouble'):
+            data = readScalar(in_file, verbose)
+        else:
+            data = readPolyData(in_file, verbose)
+
+        _prefetched[op.realpath(in_file)] = data
+
+def clearPrefetch(in_files=None):
+    """
+    Removes prefetched data not yet read.
+
+    INPUT:
+        in_files - list of files to remove; defaults None (all files)
+
+    OUTPUT:
+        none
+    """
+    if in_files is None:
+        _prefetched.clear()
+    else:
+        for in_file in in_files:
+            _prefetched.pop(op.realpath(in_file), None)
+
+def fibersToPolyData(fiberArray, pointData=None):
+    """
+    Converts fibers sampled with the same number of points to polydata.
+
+    INPUT:
+        fiberArray - array of fibers of shape (N, pts_per_fiber, 3)
+        pointData - dictionary of arrays (N, pts_per_fiber) of scalars at
+                    each sample; defaults None
+
+    OUTPUT:
+        polyData - tractography polydata of class PolyData
+    """
+    no_of_fibers, pts_per_fiber = fiberArray.shape[:2]
+
+    polyData = PolyData(
+        np.asarray(fiberArray, dtype=np.float32).reshape(-1, 3),
+        np.arange(no_of_fibers + 1, dtype=np.int64) * pts_per_fiber,
+        np.arange(no_of_fibers * pts_per_fiber, dtype=np.int64))
+
+    if pointData is not None:
+        for name, data in pointData.items():
+            polyData.pointData[name] = np.asarray(data).reshape(-1)
+
+    return polyData
+
+@misc.profiled('tractio.writeResults')
+def writeResults(results_file, polyData, clusterStatsList=[],
+                 scalarTypeList=[], clusterInfo=None, eigval=None,
+                 eigvec=None, suffix='_Cluster%i.vtk', verbose=0):
+    """
+    Writes results of clustering into a single container (uncompressed
+    zip of .npy arrays) in place of separate .vtk, statistics and
+    eigenvector files. Fibers and scalars are stored per cluster, such that
+    each cluster can be read without reading the others.
+
+    INPUT:
+        results_file - name of file to be written (.npz)
+        polyData - clustered tractography (vtkPolyData or PolyData), with
+                   'ClusterLabel', 'Colour' and 'Centroid' cell data and
+                   each fiber sampled with the same number of points
+        clusterStatsList - list of dictionaries of along-tract statistics
+                           (from stats.calcClusterStats), one per scalar type
+        scalarTypeList - list of types of quantitative data of statistics
+        clusterInfo - dictionary of arrays of statistics per cluster (eg.
+                      fiber length); defaults None
+        eigval - eigenvalues of embedding; defaults None
+        eigvec - eigenvectors of embedding; defaults None
+        suffix - suffix of per-cluster .vtk files when exported; defaults
+                 '_Cluster%i.vtk'
+        verbose - verbosity of function; defaults 0
+
+    OUTPUT:
+        none
+    """
+    from . import fibers
+
+    if not isinstance(polyData, PolyData):
+        polyData = polyDataFromVTK(polyData)
+
+    misc.vprint("Writing %s ..." % results_file, verbose)
+
+    no_of_fibers = polyData.getNumberOfLines()
+    lengths = np.diff(polyData.offsets)
+    if no_of_fibers > 0 and np.any(lengths != lengths[0]):
+        raise ValueError("Fibers must be sampled with the same number of "
+                         "points.")
+    pts_per_fiber = int(lengths[0]) if no_of_fibers > 0 else 0
+
+    fiberArray = polyData.points[polyData.connectivity].reshape(
+        no_of_fibers, pts_per_fiber, 3)
+    clusterIdx = np.asarray(polyData.cellData['ClusterLabel']).reshape(-1)
+
+    clusterIndex = fibers.ClusterIndex(clusterIdx)
+    labels = clusterIndex.labels
+    firstIdx = clusterIndex.order[clusterIndex.offsets[:-1]]
+
+    results = OrderedDict()
+    results['labels'] = labels
+    results['clusterIdx'] = clusterIdx
+    results['colour'] = np.asarray(
+        polyData.cellData['Colour']).reshape(no_of_fibers, -1)[firstIdx]
+    results['centroids'] = np.asarray(
+        polyData.cellData['Centroid']).reshape(no_of_fibers, -1)[firstIdx]
+    results['scalarNames'] = np.array(list(polyData.pointData.keys()),
+                                      dtype=str)
+    results['cellNames'] = np.array(
+        [name for name in polyData.cellData.keys()
+         if name not in ('Colour', 'ClusterLabel', 'Centroid')], dtype=str)
+    for name in results['cellNames']:
+        results['cellData/%s' % name] = polyData.cellData[name]
+    results['suffix'] = np.array(suffix)
+
+    for label, fidxes in clusterIndex:
+        results['fidxes/%d' % label] = fidxes
+        results['fibers/%d' % label] = fiberArray[fidxes]
+        for name, data in polyData.pointData.items():
+            results['scalars/%s/%d' % (name, label)] = np.asarray(
+                data).reshape(no_of_fibers, pts_per_fiber)[fidxes]
+
+    results['statsNames'] = np.array([scalarType.split('/', -1)[-1]
+                                      for scalarType in scalarTypeList],
+                                     dtype=str)
+    for scalarType, clusterStats in zip(scalarTypeList, clusterStatsList):
+        for key, value in clusterStats.items():
+            results['stats/%s/%s' % (scalarType.split('/', -1)[-1],
+                                     key)] = value
+
+    if clusterInfo is not None:
+        for key, value in clusterInfo.items():
+            results['clusterInfo/%s' % key] = value
+
+    if eigval is not None:
+        results['eigval'] = eigval
+    if eigvec is not None:
+        results['eigvec'] = eigvec
+
+    with open(results_file, 'wb') as f:
+        np.savez(f, **results)
+
+class Results:
+    """
+    Results of clustering stored within a single container written by
+    writeResults. Arrays are read from the container on access.
+    Value returned is of class Results
+    """
+
+    def __init__(self, results_file):
+        self.results = np.load(results_file)
+
+        # Info related to clusters
+        self.labels = self.results['labels']
+        self.colour = self.results['colour']
+        self.centroids = self.results['centroids']
+        self.scalarNames = [str(name) for name in self.results['scalarNames']]
+        self.cellNames = [str(name) for name in self.results['cellNames']]
+        self.statsNames = [str(name) for name in self.results['statsNames']]
+        self.suffix = str(self.results['suffix'])
+
+    def close(self):
+        self.results.close()
+
+    def getClusterIdx(self):
+        """
+        Returns cluster labels of all fibers.
+        """
+        return self.results['clusterIdx']
+
+    def getCluster(self, label):
+        """
+        Reads fibers and scalars of a single cluster.
+
+        INPUT:
+            label - cluster label
+
+        OUTPUT:
+            fiberArray - array of fibers of cluster (N, pts_per_fiber, 3)
+            scalars - dictionary of arrays of scalars (N, pts_per_fiber) of
+                      cluster
+        """
+        if 'fibers/%d' % label not in self.results.files:
+            raise KeyError("Cluster %d not in results" % label)
+
+        scalars = OrderedDict((name, self.results['scalars/%s/%d'
+                                                  % (name, label)])
+                              for name in self.scalarNames)
+
+        return self.results['fibers/%d' % label], scalars
+
+    def getClusterStats(self, scalarType):
+        """
+        Reads along-tract statistics of all clusters for a scalar type.
+
+        INPUT:
+            scalarType - type of quantitative data
+
+        OUTPUT:
+            clusterStats - dictionary of statistics (as stats.calcClusterStats)
+        """
+        prefix = 'stats/%s/' % scalarType.split('/', -1)[-1]
+
+        return dict((key[len(prefix):], self.results[key])
+                    for key in self.results.files if key.startswith(prefix))
+
+    def getClusterInfo(self):
+        """
+        Reads statistics of each cluster (eg. fiber length).
+        """
+        return dict((key[len('clusterInfo/'):], self.results[key])
+                    for key in self.results.files
+                    if key.startswith('clusterInfo/'))
+
+    def getEig(self):
+        """
+        Reads eigenvalues and eigenvectors of embedding, if stored.
+        """
+        if 'eigval' not in self.results.files:
+            return None, None
+
+        return self.results['eigval'], self.results['eigvec']
+
+    def getPolyData(self, label=None):
+        """
+        Converts a cluster, or all clusters, to polydata in the layout of
+        the clustered .vtk file.
+
+        INPUT:
+            label - cluster label; defaults None (all clusters in original
+                    fiber order)
+
+        OUTPUT:
+            polyData - tractography polydata of class PolyData
+        """
+        if label is not None:
+            fiberArray, scalars = self.getCluster(label)
+            return fibersToPolyData(fiberArray, scalars)
+
+        clusterIdx = self.getClusterIdx()
+        fidxes = np.concatenate([self.results['fidxes/%d' % label]
+                                 for label in self.labels])
+        order = np.argsort(fidxes)
+
+        fiberArray = np.concatenate([self.results['fibers/%d' % label]
+                                     for label in self.labels])[order]
+        scalars = OrderedDict(
+            (name, np.concatenate([self.results['scalars/%s/%d'
+                                                % (name, label)]
+                                   for label in self.labels])[order])
+            for name in self.scalarNames)
+
+        lidx = np.searchsorted(self.labels, clusterIdx)
+        polyData = fibersToPolyData(fiberArray)
+        polyData.cellData['Colour'] = self.colour[lidx]
+        polyData.cellData['ClusterLabel'] = clusterIdx
+        polyData.cellData['Centroid'] = self.centroids[lidx]
+        for name in self.cellNames:
+            polyData.cellData[name] = self.results['cellData/%s' % name]
+        for name, data in scalars.items():
+            polyData.pointData[name] = data.reshape(-1)
+
+        return polyData
+
+    def exportVTK(self, vtk_file, label=None, verbose=0):
+        """
+        Writes a cluster, or all clusters, to a .vtk file.
+
+        INPUT:
+            vtk_file - name of file to be written
+            label - cluster label; defaults None (all clusters)
+            verbose - verbosity of function; defaults 0
+
+        OUTPUT:
+            none
+        """
+        writeVTK(self.getPolyData(label), vtk_file, verbose)
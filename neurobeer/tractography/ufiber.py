@@ -7,38 +7,90 @@ ufibers
 
 import os, csv
 import numpy as np
-from . import fibers
+from . import fibers, misc, stats
 
-def findUFiber(fiberData):
+@misc.profiled('ufiber.findUFiber')
+def findUFiber(fiberData, min_length=20, max_length=80, sep_ratio=1/np.pi,
+               hemi_flag=True):
     """
     Identifies U-fibers from tractography
 
     INPUT:
         fiberData - fiber tree containing tractography data
+        min_length - minimum length of u-shaped fibers; defaults 20
+        max_length - maximum length of u-shaped fibers; defaults 80
+        sep_ratio - maximum ratio of end point separation to length of
+                    u-shaped fibers; defaults 1/pi
+        hemi_flag - flag to exclude fibers crossing between hemispheres
+                    (x = 0); defaults True
 
     OUTPUT:
-        uArray - array containing indices of all u-shaped fibers
-        LArray - array containing lengths of all u-shaped fibers
-        DArray - array containing end point seperation distance
+        uMask - boolean array identifying u-shaped fibers
+        LArray - array containing lengths of all fibers
+        DArray - array containing end point seperation distance of all fibers
     """
-    # Array storing indices of u-shaped fibers
-    uArray = []
-    LArray = []
-    DArray = []
+    fiberArray = np.stack(fiberData.getFibers(range(fiberData.no_of_fibers)),
+                          axis=-1)
 
-    # Determine fiber length and u-shape
-    for fidx in range(fiberData.no_of_fibers):
-        L = _calcFiberLength(fiberData, fidx)
+    return classifyUFiber(fiberArray, min_length, max_length, sep_ratio,
+                          hemi_flag)
 
-        D = _calcEndPointSep(fiberData, fidx)
+def classifyUFiber(fiberArray, min_length=20, max_length=80, sep_ratio=1/np.pi,
+                   hemi_flag=True):
+    """
+    Identifies U-fibers from array of fiber coordinates
+
+    INPUT:
+        fiberArray - array of fiber coordinates (N x P x 3)
+        min_length - minimum length of u-shaped fibers; defaults 20
+        max_length - maximum length of u-shaped fibers; defaults 80
+        sep_ratio - maximum ratio of end point separation to length of
+                    u-shaped fibers; defaults 1/pi
+        hemi_flag - flag to exclude fibers crossing between hemispheres
+                    (x = 0); defaults True
+
+    OUTPUT:
+        uMask - boolean array identifying u-shaped fibers
+        LArray - array containing lengths of all fibers
+        DArray - array containing end point seperation distance of all fibers
+    """
+    LArray = _calcFiberLength(fiberArray)
+    DArray = _calcEndPointSep(fiberArray)
 
-        # Temporary max length constraint
-        if (L > 20) and (D <= (L / np.pi)) and (L < 80):
-            uArray.append(fidx)
-            LArray.append(L)
-            DArray.append(D)
+    uMask = (LArray > min_length) & (LArray < max_length) & \
+            (DArray <= LArray * sep_ratio)
 
-    return uArray, LArray, DArray
+    # Fibers crossing between hemispheres
+    if hemi_flag:
+        x = fiberArray[:, :, 0]
+        uMask &= ~np.any(x[:, 1:] * x[:, :-1] < 0, axis=1)
+
+    return uMask, LArray, DArray
+
+@misc.profiled('ufiber.regionPartition')
+def regionPartition(fiberData, region_size=40):
+    """
+    Partitions fibers into spatial regions by hemisphere and a coarse grid
+    over the midpoint between end points of each fiber.
+
+    INPUT:
+        fiberData - fiber tree containing tractography data
+        region_size - size (mm) of grid cells of regions; defaults 40
+
+    OUTPUT:
+        regionIdx - array of region labels of fibers
+    """
+    fiberArray = np.stack(fiberData.getFibers(range(fiberData.no_of_fibers)),
+                          axis=-1)
+
+    midpoints = 0.5 * (fiberArray[:, 0] + fiberArray[:, -1])
+    hemi = (midpoints[:, 0] < 0).astype(np.int64)
+    grid = np.floor(midpoints / float(region_size)).astype(np.int64)
+
+    _, regionIdx = np.unique(np.column_stack((hemi, grid)), axis=0,
+                             return_inverse=True)
+
+    return regionIdx.reshape(-1)
 
 def _mean(fiberTree, scalarType, idxes=None):
     """ *INTERNAL FUNCTION*
@@ -170,14 +222,12 @@ def uFiberStats(LArray, DArray, fidxes):
         DMean - mean distance between end points
         DSD - standard deviation between end points
     """
+    mask = np.zeros(len(LArray), dtype=bool)
+    fidxes = np.asarray(fidxes, dtype=np.int64).reshape(-1)
+    mask[fidxes[(fidxes >= 0) & (fidxes < len(LArray))]] = True
 
-    Ltemp = []
-    Dtemp = []
-
-    for fidx in range(len(LArray)):
-        if fidx in fidxes:
-            Ltemp.append(LArray[fidx])
-            Dtemp.append(DArray[fidx])
+    Ltemp = np.asarray(LArray)[mask]
+    Dtemp = np.asarray(DArray)[mask]
 
     LMean = np.mean(Ltemp)
     LSD = np.std(Ltemp)
@@ -186,62 +236,70 @@ def uFiberStats(LArray, DArray, fidxes):
 
     return LMean, LSD, DMean, DSD
 
-def _calcFiberLength(fiberData, fidx):
-    """ * INTERNAL FUNCTION *
-    Calculates the fiber length via arc length
+def calcUFiberStats(clusterLabels, LArray, DArray):
+    """
+    Calculates the mean and standard deviation for fiber length and distance
+    between end points of all clusters at once.
 
     INPUT:
-        fiberData - fiber tree containing tractography information
-        fidx - fiber index
+        clusterLabels - array of cluster labels of fibers
+        LArray - array of fiber lengths, in order of clusterLabels
+        DArray - array of distances between end points, in order of
+                 clusterLabels
 
     OUTPUT:
-        L - fength of fiber
+        uStats - dictionary of arrays indexed by cluster, with keys:
+                 'labels' - cluster labels
+                 'count' - number of fibers of each cluster
+                 'LMean', 'LStd' - mean & standard deviation of fiber length
+                 'DMean', 'DStd' - mean & standard deviation of distance
+                                   between end points
     """
-    no_of_pts = fiberData.pts_per_fiber
 
-    if no_of_pts < 2:
-        raise ValueError("Not enough samples to determine length of fiber")
-
-    L = 0
+    return stats.calcClusterMeanStd(clusterLabels, [('L', LArray),
+                                                    ('D', DArray)])
 
-    for idx in range(1, no_of_pts):
-        x1 = fiberData.fiberTree[fidx][idx]['x']
-        x2 = fiberData.fiberTree[fidx][idx - 1]['x']
-        y1 = fiberData.fiberTree[fidx][idx]['y']
-        y2 = fiberData.fiberTree[fidx][idx - 1]['y']
-        z1 = fiberData.fiberTree[fidx][idx]['z']
-        z2 = fiberData.fiberTree[fidx][idx - 1]['z']
+@misc.profiled('ufiber.writeUFiberStats')
+def writeUFiberStats(uStats, dirpath=None):
+    """
+    Writes the length and distance of all clusters to clusterInfo.csv in a
+    single write.
 
-        # Temporary fix for finding if fibers cross
-        if x1 < 0 and x2 > 0:
-            return 0
-        elif x1 > 0 and x2 < 0:
-            return 0
-        else:
-            L = L + np.sqrt((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2)
+    INPUT:
+        uStats - dictionary of statistics (from calcUFiberStats)
+        dirpath - location to store file; defaults None
 
-    return L
+    OUTPUT:
+        none
+    """
+    stats.writeClusterInfo(uStats, [('LMean', 'Length Mean'),
+                                    ('LStd', 'Length S.D.'),
+                                    ('DMean', 'Distance Mean'),
+                                    ('DStd', 'Distance S.D.')], dirpath)
 
-def _calcEndPointSep(fiberData, fidx):
+def _calcFiberLength(fiberArray):
     """ * INTERNAL FUNCTION *
-    Calculates distance between end points
+    Calculates the fiber length via arc length
 
     INPUT:
-        fiberData - fiber tree containing tractography information
-        fidx - fiber index
+        fiberArray - array of fiber coordinates (N x P x 3)
 
     OUTPUT:
-        D - distance between end points
+        LArray - array of fiber lengths
     """
-    endpt = fiberData.pts_per_fiber - 1
+    if fiberArray.shape[1] < 2:
+        raise ValueError("Not enough samples to determine length of fiber")
+
+    return np.sum(np.linalg.norm(np.diff(fiberArray, axis=1), axis=2), axis=1)
 
-    x1 = fiberData.fiberTree[fidx][0]['x']
-    x2 = fiberData.fiberTree[fidx][endpt]['x']
-    y1 = fiberData.fiberTree[fidx][0]['y']
-    y2 = fiberData.fiberTree[fidx][endpt]['y']
-    z1 = fiberData.fiberTree[fidx][0]['z']
-    z2 = fiberData.fiberTree[fidx][endpt]['z']
+def _calcEndPointSep(fiberArray):
+    """ * INTERNAL FUNCTION *
+    Calculates distance between end points
 
-    D = np.sqrt((x2 - x1)**2 + (y2 - y1)**2 + (z2 - z1)**2)
+    INPUT:
+        fiberArray - array of fiber coordinates (N x P x 3)
 
-    return D
+    OUTPUT:
+        DArray - array of distances between end points
+    """
+    return np.linalg.norm(fiberArray[:, -1] - fiberArray[:, 0], axis=1)
@@ -14,7 +14,11 @@ setup(
              'neurobeer/cli/clusterUFiberPrior',
              'neurobeer/cli/tractscalar',
              'neurobeer/cli/vtk2nii',
-             'neurobeer/cli/xfmData'],
+             'neurobeer/cli/xfmData',
+             'neurobeer/cli/compactPrior',
+             'neurobeer/cli/plotStats',
+             'neurobeer/cli/exportClusters',
+             'neurobeer/cli/clusterBatch'],
 
     # Metadata
     author='Jason Kai',
@@ -0,0 +1,109 @@
+""" test_cluster.py
+
+Tests of files of clusters written by cluster.writeClusters and exported
+from containers of results.
+
+"""
+
+import filecmp
+import os.path as op
+import numpy as np
+import pytest
+
+vtk = pytest.importorskip('vtk')
+
+from neurobeer.tractography import cluster, fibers, tractio
+
+def _clusteredTree(no_of_fibers=40, pts_per_fiber=10, k_clusters=4, seed=0):
+    """
+    Builds fiber tree of clustered fibers with scalars 'FA' and 'MD'.
+    """
+    rng = np.random.RandomState(seed)
+
+    fiberArray = rng.normal(size=(no_of_fibers, pts_per_fiber, 3))
+    scalars = [('FA', rng.rand(no_of_fibers, pts_per_fiber)),
+               ('MD', rng.rand(no_of_fibers, pts_per_fiber))]
+    polyData = tractio.fibersToPolyData(fiberArray.astype(np.float32),
+                                        dict((name, data.astype(np.float32))
+                                             for name, data in scalars))
+
+    fiberData = fibers.FiberTree()
+    fiberData.convertFromVTK(polyData, pts_per_fiber)
+    for name, _ in scalars:
+        fiberData.addScalar(polyData, polyData.pointData[name], name,
+                            pts_per_fiber)
+
+    clusterIdx = np.arange(no_of_fibers) % k_clusters
+
+    return fiberData, clusterIdx
+
+def test_writeClusters_matches_vtk_output(tmpdir):
+    fiberData, clusterIdx = _clusteredTree()
+    scalarTypeList = ['FA', 'MD']
+    filePrefix = op.join(str(tmpdir), 'bundle')
+
+    cluster.writeClusters(fiberData, clusterIdx, scalarTypeList, filePrefix,
+                          n_jobs=1)
+
+    for label in np.unique(clusterIdx):
+        # Cluster written through vtkPolyData, as in previous releases
+        idxes = np.where(clusterIdx == label)[0]
+        bundle = fibers.convertFromTuple(fiberData.getFibers(idxes))
+        polyData = bundle.convertToVTK()
+        for scalarType in scalarTypeList:
+            polyData = cluster.addScalarToVTK(polyData, fiberData,
+                                              scalarType, list(idxes))
+        vtk_file = op.join(str(tmpdir), 'vtk_Cluster%d.vtk' % label)
+        tractio.writeVTK(polyData, vtk_file)
+
+        assert filecmp.cmp(filePrefix + '_Cluster%d.vtk' % label, vtk_file,
+                           shallow=False)
+
+def test_outputs_share_format(tmpdir):
+    fiberData, clusterIdx = _clusteredTree()
+    filePrefix = op.join(str(tmpdir), 'bundle')
+
+    centroids = np.eye(4)[:, :3]
+    polyData = cluster._format_outputVTK(fiberData.convertToVTK(), clusterIdx,
+                                         cluster._cluster_to_rgb(centroids),
+                                         centroids)
+    tractio.writeVTK(polyData, filePrefix + '_Clustered.vtk')
+    cluster.writeClusters(fiberData, clusterIdx, ['FA'], filePrefix,
+                          n_jobs=1)
+
+    headers = set()
+    for vtk_file in [filePrefix + '_Clustered.vtk'] + \
+                    [filePrefix + '_Cluster%d.vtk' % label
+                     for label in np.unique(clusterIdx)]:
+        with open(vtk_file, 'rb') as f:
+            headers.add(f.readline())
+
+    assert headers == set([b'# vtk DataFile Version 4.2\n'])
+
+def test_exportVTK_matches_outputs(tmpdir):
+    fiberData, clusterIdx = _clusteredTree()
+    scalarTypeList = ['FA', 'MD']
+    filePrefix = op.join(str(tmpdir), 'bundle')
+    exportPrefix = op.join(str(tmpdir), 'export')
+
+    centroids = np.eye(4)[:, :3]
+    polyData = cluster._format_outputVTK(fiberData.convertToVTK(), clusterIdx,
+                                         cluster._cluster_to_rgb(centroids),
+                                         centroids)
+    for scalarType in scalarTypeList:
+        polyData = cluster.addScalarToVTK(polyData, fiberData, scalarType)
+    tractio.writeVTK(polyData, filePrefix + '_Clustered.vtk')
+    cluster.writeClusters(fiberData, clusterIdx, scalarTypeList, filePrefix,
+                          n_jobs=1)
+
+    tractio.writeResults(filePrefix + '_clusters.npz', polyData)
+    results = tractio.Results(filePrefix + '_clusters.npz')
+    results.exportVTK(exportPrefix + '_Clustered.vtk')
+    for label in results.labels:
+        results.exportVTK(exportPrefix + results.suffix % label, label)
+    results.close()
+
+    for suffix in ['_Clustered.vtk'] + ['_Cluster%d.vtk' % label
+                                        for label in np.unique(clusterIdx)]:
+        assert filecmp.cmp(filePrefix + suffix, exportPrefix + suffix,
+                           shallow=False)
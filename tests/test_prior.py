@@ -0,0 +1,67 @@
+""" test_prior.py
+
+Tests of priors loaded from .vtk files and attached from shared stores.
+
+"""
+
+import os.path as op
+import numpy as np
+import pytest
+
+vtk = pytest.importorskip('vtk')
+
+from neurobeer.tractography import prior, tractio
+
+def _writePrior(priorVTKPath, no_of_fibers=60, pts_per_fiber=10,
+                k_clusters=3, seed=0):
+    """
+    Writes prior of clustered fibers with scalar 'FA'.
+    """
+    rng = np.random.RandomState(seed)
+
+    fiberArray = rng.normal(size=(no_of_fibers, pts_per_fiber, 3))
+    clusterArray = np.arange(no_of_fibers) % k_clusters
+    polyData = tractio.fibersToPolyData(
+        fiberArray, {'FA': rng.rand(no_of_fibers, pts_per_fiber)
+                     .astype(np.float32)})
+    polyData.cellData['ClusterLabel'] = clusterArray.astype(np.int32)
+    polyData.cellData['Centroid'] = np.eye(k_clusters, dtype=np.float32)[
+        clusterArray]
+    tractio.writeVTK(polyData, priorVTKPath)
+
+    return fiberArray, polyData.pointData['FA'].reshape(no_of_fibers, -1)
+
+@pytest.mark.parametrize('templateFlag', [False, True])
+def test_attachStore_matches_vtk(tmpdir, templateFlag):
+    priorVTKPath = op.join(str(tmpdir), 'prior.vtk')
+    cacheDir = op.join(str(tmpdir), 'cache')
+    fiberArray, scalarArray = _writePrior(priorVTKPath)
+
+    priorInfo = []
+    for _ in range(2):
+        # Parsed from VTK, then attached to store
+        prior.clearCache()
+        priorInfo.append(prior.load(priorVTKPath, templateFlag,
+                                    cacheDir=cacheDir))
+    prior.clearCache()
+
+    (vtkTree, vtkCentroids, vtkClusters, vtkSubset), \
+        (storeTree, storeCentroids, storeClusters, storeSubset) = priorInfo
+    fidxes = range(vtkTree.no_of_fibers)
+    subsetIdxes = fidxes if vtkSubset is None else vtkSubset
+
+    assert isinstance(storeTree.fiberArray, np.memmap)
+    assert storeTree.no_of_fibers == vtkTree.no_of_fibers
+    np.testing.assert_array_equal(storeSubset, vtkSubset)
+    np.testing.assert_array_equal(storeCentroids, vtkCentroids)
+    np.testing.assert_array_equal(storeClusters, vtkClusters)
+    for fiberTree in (vtkTree, storeTree):
+        np.testing.assert_allclose(
+            np.transpose(fiberTree.getFibers(fidxes), (1, 2, 0)),
+            fiberArray[subsetIdxes], rtol=1e-6)
+        np.testing.assert_array_equal(fiberTree.getFiber(1),
+                                      vtkTree.getFiber(1))
+        np.testing.assert_array_equal(fiberTree.getScalars(fidxes, 'FA'),
+                                      scalarArray[subsetIdxes])
+        np.testing.assert_array_equal(fiberTree.getScalar(1, 'FA'),
+                                      scalarArray[subsetIdxes[1]])
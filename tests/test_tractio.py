@@ -0,0 +1,112 @@
+""" test_tractio.py
+
+Tests of native reading and writing of legacy .vtk polydata against
+vtkPolyDataReader and vtkPolyDataWriter.
+
+"""
+
+import filecmp
+import os.path as op
+import numpy as np
+import pytest
+
+vtk = pytest.importorskip('vtk')
+from vtk.util import numpy_support
+
+from neurobeer.tractography import tractio
+
+def _polyData(lengths, seed=0):
+    """
+    Builds polydata of fibers of given number of points, with data stored
+    per fiber and per point.
+    """
+    rng = np.random.RandomState(seed)
+
+    polyData = tractio.PolyData()
+    polyData.points = rng.normal(size=(sum(lengths), 3)).astype(np.float32)
+    polyData.offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+    polyData.connectivity = np.arange(sum(lengths), dtype=np.int64)
+
+    polyData.cellData['Colour'] = rng.randint(0, 256, size=(len(lengths), 3)
+                                              ).astype(np.uint8)
+    polyData.cellData['ClusterLabel'] = np.arange(len(lengths),
+                                                  dtype=np.int32)
+    polyData.cellData['Centroid'] = rng.normal(size=(len(lengths), 4)
+                                               ).astype(np.float32)
+    polyData.pointData['FA'] = rng.rand(sum(lengths)).astype(np.float32)
+
+    return polyData
+
+@pytest.mark.parametrize('lengths', [[20] * 30, [5, 12, 3, 40, 7]])
+def test_writeVTK_matches_vtk_writer(tmpdir, lengths):
+    polyData = _polyData(lengths)
+    nativeFile = op.join(str(tmpdir), 'native.vtk')
+    vtkFile = op.join(str(tmpdir), 'vtk.vtk')
+
+    tractio.writeVTK(polyData, nativeFile)
+    tractio.writeVTK(tractio.polyDataToVTK(polyData), vtkFile)
+
+    assert filecmp.cmp(nativeFile, vtkFile, shallow=False)
+
+@pytest.mark.parametrize('lengths', [[20] * 30, [5, 12, 3, 40, 7]])
+def test_writeVTK_roundtrip(tmpdir, lengths):
+    polyData = _polyData(lengths)
+    vtk_file = op.join(str(tmpdir), 'native.vtk')
+    tractio.writeVTK(polyData, vtk_file)
+
+    vtkPolyData = tractio.readVTK(vtk_file)
+    np.testing.assert_array_equal(
+        numpy_support.vtk_to_numpy(vtkPolyData.GetPoints().GetData()),
+        polyData.points)
+    assert vtkPolyData.GetNumberOfLines() == len(lengths)
+
+    for polyDataRead in (tractio.polyDataFromVTK(vtkPolyData),
+                         tractio.readPolyData(vtk_file)):
+        np.testing.assert_array_equal(polyDataRead.points, polyData.points)
+        np.testing.assert_array_equal(polyDataRead.offsets, polyData.offsets)
+        np.testing.assert_array_equal(polyDataRead.connectivity,
+                                      polyData.connectivity)
+        for data, dataRead in ((polyData.cellData, polyDataRead.cellData),
+                               (polyData.pointData, polyDataRead.pointData)):
+            assert list(dataRead.keys()) == list(data.keys())
+            for name, array in data.items():
+                np.testing.assert_array_equal(dataRead[name], array)
+
+@pytest.mark.parametrize('chunk_size', [7, 10000])
+def test_readStreamlines_resampled_by_chunk(tmpdir, chunk_size):
+    streamlines = pytest.importorskip('nibabel.streamlines')
+    from neurobeer.tractography import fibers
+
+    rng = np.random.RandomState(0)
+    tck_file = op.join(str(tmpdir), 'bundle.tck')
+    streamlines.TckFile(streamlines.Tractogram(
+        [rng.normal(size=(length, 3)).astype(np.float32)
+         for length in rng.randint(2, 60, size=50)],
+        affine_to_rasmm=np.eye(4))).save(tck_file)
+
+    polyData = fibers.resamplePolyData(tractio.readPolyData(tck_file), 20)
+    polyDataRead = tractio._readStreamlines(tck_file, chunk_size=chunk_size,
+                                            pts_per_fiber=20)
+
+    np.testing.assert_array_equal(polyDataRead.points, polyData.points)
+    np.testing.assert_array_equal(polyDataRead.offsets, polyData.offsets)
+    np.testing.assert_array_equal(polyDataRead.connectivity,
+                                  polyData.connectivity)
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_cellsToOffsets_variable_lengths(shuffle):
+    lengths = [5, 12, 3, 1, 40, 7]
+    offsets = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+    connectivity = np.arange(sum(lengths), dtype=np.int64)
+    if shuffle:
+        np.random.RandomState(0).shuffle(connectivity)
+
+    cells = np.concatenate([np.r_[length, connectivity[start:end]]
+                            for length, start, end in zip(lengths,
+                                                          offsets[:-1],
+                                                          offsets[1:])])
+    offsetsRead, connectivityRead = tractio._cellsToOffsets(cells,
+                                                            len(lengths))
+
+    np.testing.assert_array_equal(offsetsRead, offsets)
+    np.testing.assert_array_equal(connectivityRead, connectivity)